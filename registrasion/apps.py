@@ -6,3 +6,16 @@ class RegistrasionConfig(AppConfig):
     name = "registrasion"
     label = "registrasion"
     verbose_name = "Registrasion"
+
+    def ready(self):
+        from registrasion.controllers.badge_version import (
+            BadgeVersionController,
+        )
+        from registrasion.controllers.search import AttendeeSearchController
+        from registrasion.controllers.write_version import (
+            WriteVersionController,
+        )
+        AttendeeSearchController.connect_signals()
+        BadgeVersionController.connect_signals()
+        WriteVersionController.check_cache()
+        WriteVersionController.connect_signals()
@@ -15,23 +15,34 @@ management command, and by the tickets/badger and tickets/badge API functions.
 import sys
 import os
 import csv
+import hashlib
+import json
+import re
 from lxml import etree
 import tempfile
+import itertools
+import multiprocessing
 from copy import deepcopy
 import subprocess
 import progressbar
 
+from collections import defaultdict
+
 import pdb
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
 
-from django.contrib.auth.models import User, Group
+from django.contrib.auth.models import User
 from pinaxcon.registrasion.models import AttendeeProfile
+from registrasion.controllers.badge_version import BadgeVersionController
 from registrasion.controllers.cart import CartController
 from registrasion.controllers.invoice import InvoiceController
 from registrasion.models import Voucher
 from registrasion.models import Attendee
 from registrasion.models import Product
+from registrasion.models import ProductItem
 from registrasion.models import Invoice
 from symposion.speakers.models import Speaker
 
@@ -102,11 +113,137 @@ def text_size(text, prev=9999):
     return min(prev, size)
 
 
+SVG_NAMESPACE = '{http://www.w3.org/2000/svg}'
+
+
+class BadgeTemplate(object):
+    '''
+    An SVG badge template, parsed once. The position of every element that
+    has an id is recorded up front, so filling in a copy of the template
+    never has to search the tree for an element.
+    '''
+
+    _cache = {}
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            source = f.read()
+        self.fingerprint = hashlib.sha1(source).hexdigest()
+        self.tree = etree.fromstring(source).getroottree()
+        self.positions = dict(
+            (elem.get('id'), n)
+            for n, elem in enumerate(self.tree.getroot().iter())
+            if elem.get('id') is not None
+        )
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Returns the template at path, parsing it again only if the file has
+        changed since it was last loaded by this process.
+        '''
+        key = (path, os.path.getmtime(path))
+        if key not in cls._cache:
+            cls._cache[key] = cls(path)
+        return cls._cache[key]
+
+    def sheet(self):
+        ''' Returns a fresh copy of the template to fill in. '''
+        return BadgeSheet(self)
+
+
+class BadgeSheet(object):
+    '''
+    A copy of a BadgeTemplate, whose elements can be looked up by id
+    directly.
+    '''
+
+    def __init__(self, template):
+        self.template = template
+        self.tree = deepcopy(template.tree)
+        self.root = self.tree.getroot()
+        self._nodes = None
+
+    def element(self, element_id):
+        position = self.template.positions.get(element_id)
+        if position is None:
+            return None
+        if self._nodes is None:
+            # A deep copy iterates in the same order as the original.
+            self._nodes = list(self.root.iter())
+        return self._nodes[position]
+
+    def tostring(self):
+        return etree.tostring(self.root)
+
+    def write(self, name):
+        self.tree.write(name)
+
+
+# Each sheet in a badge template has room for this many badges.
+BADGES_PER_SHEET = 2
+
+
+def _split_length(length):
+    '''
+    Splits an SVG length such as "210mm" into its number and its units.
+    '''
+    match = re.match(r'\s*([0-9.]+)\s*(.*)', length or '')
+    if match is None:
+        raise ValueError('could not understand length %r' % (length,))
+    return float(match.group(1)), match.group(2).strip()
+
+
+def impose(template, sheets, columns, rows):
+    '''
+    Lays out filled-in sheets of template on a single page, in a grid with
+    the given number of columns and rows, filling each row from left to
+    right. Returns the page as an lxml ElementTree.
+    '''
+    root = template.tree.getroot()
+    width, width_units = _split_length(root.get('width'))
+    height, height_units = _split_length(root.get('height'))
+
+    viewbox = root.get('viewBox')
+    if viewbox:
+        box = [float(i) for i in viewbox.replace(',', ' ').split()]
+        box_width, box_height = box[2], box[3]
+    else:
+        box_width, box_height = width, height
+        viewbox = '0 0 %g %g' % (width, height)
+
+    page = etree.Element(root.tag, nsmap=root.nsmap)
+    page.set('width', '%g%s' % (width * columns, width_units))
+    page.set('height', '%g%s' % (height * rows, height_units))
+    page.set('viewBox', '0 0 %g %g' % (box_width * columns, box_height * rows))
+
+    for n, sheet in enumerate(sheets):
+        # Each sheet becomes a nested SVG viewport at its place in the grid.
+        cell = sheet.root
+        cell.set('x', '%g' % (box_width * (n % columns)))
+        cell.set('y', '%g' % (box_height * (n // columns)))
+        cell.set('width', '%g' % box_width)
+        cell.set('height', '%g' % box_height)
+        cell.set('viewBox', viewbox)
+        page.append(cell)
+
+    return page.getroottree()
+
+
+def _find_by_id(soup, element_id):
+    if isinstance(soup, BadgeSheet):
+        return soup.element(element_id)
+    return soup.find(".//*[@id='%s']" % element_id)
+
+
 def set_text(soup, text_id, text, resize=None):
     '''
     Set the text value of an element (via beautiful soup calls).
     '''
-    elem = soup.find(".//*[@id='%s']/{http://www.w3.org/2000/svg}tspan" % text_id)
+    elem = _find_by_id(soup, text_id)
+    if elem is not None:
+        elem = elem.find(SVG_NAMESPACE + 'tspan')
     if elem is None:
         raise ValueError('could not find tag id=%s' % text_id)
     elem.text = text
@@ -119,28 +256,52 @@ def set_colour(soup, slice_id, colour):
     '''
     Set colour of an element (using beautiful soup calls).
     '''
-    elem = soup.find(".//*[@id='%s']" % slice_id)
+    elem = _find_by_id(soup, slice_id)
     if elem is None:
         raise ValueError('could not find tag id=%s' % slice_id)
     style = elem.get('style')
     elem.set('style', style.replace('fill:#316a9a', 'fill:#%s' % colour))
 
-Volunteers = Group.objects.filter(name='Conference volunteers').first().user_set.all()
-Organisers = Group.objects.filter(name='Conference organisers').first().user_set.all()
+VOLUNTEERS_GROUP = 'Conference volunteers'
+ORGANISERS_GROUP = 'Conference organisers'
+
 
-def is_volunteer(attendee):
+class BadgeRoles(object):
+    '''
+    Looks up the members of the volunteer and organiser groups the first
+    time they're needed, and remembers them for the rest of a collation
+    run. A group that doesn't exist has no members.
+    '''
+    def __init__(self):
+        self._members = {}
+
+    def members(self, group_name):
+        if group_name not in self._members:
+            self._members[group_name] = set(User.objects.filter(
+                groups__name=group_name,
+            ).values_list('id', flat=True))
+        return self._members[group_name]
+
+    def is_volunteer(self, attendee):
+        return attendee.user_id in self.members(VOLUNTEERS_GROUP)
+
+    def is_organiser(self, attendee):
+        return attendee.user_id in self.members(ORGANISERS_GROUP)
+
+
+def is_volunteer(attendee, roles=None):
     '''
     Returns True if attendee is in the Conference volunteers group.
     False otherwise.
     '''
-    return attendee.user in Volunteers
+    return (roles or BadgeRoles()).is_volunteer(attendee)
 
-def is_organiser(attendee):
+def is_organiser(attendee, roles=None):
     '''
-    Returns True if attendee is in the Conference volunteers group.
+    Returns True if attendee is in the Conference organisers group.
     False otherwise.
     '''
-    return attendee.user in Organisers
+    return (roles or BadgeRoles()).is_organiser(attendee)
 
 
 def svg_badge(soup, data, n):
@@ -224,17 +385,73 @@ def svg_badge(soup, data, n):
         set_text(soup, 'email-' + side, data['email'])
 
 
+def _accepted_speakers(users):
+    '''
+    Returns the ids of the users who have at least one accepted proposal.
+    '''
+    return set(Speaker.objects.filter(
+        user__in=users,
+        proposals__result__status='accepted',
+    ).values_list('user', flat=True))
+
+
+def _paid_carts(users):
+    '''
+    Returns a dict mapping user id to a list of the products in each of
+    that user's paid carts, in invoice order. Each product is a
+    (product name, category name) pair.
+    '''
+    items = defaultdict(list)
+    for cart, product, category in ProductItem.objects.filter(
+        cart__invoice__status=Invoice.STATUS_PAID,
+        cart__user__in=users,
+    ).values_list(
+        'cart', 'product__name', 'product__category__name',
+    ).distinct().order_by('product', 'id'):
+        items[cart].append((product, category))
+
+    carts = defaultdict(list)
+    for user, cart in Invoice.objects.filter(
+        status=Invoice.STATUS_PAID,
+        user__in=users,
+        cart__isnull=False,
+    ).values_list('user', 'cart').order_by('id'):
+        carts[user].append(items[cart])
+
+    return carts
+
+
 def collate(options):
-    # If specific usernames were given on the command line, just use those.
-    # Otherwise, use the entire list of attendees.
+    # Group memberships are looked up once for the whole run.
+    roles = BadgeRoles()
+
+    # If specific usernames were given on the command line, or a queryset of
+    # users, just use those. Otherwise, use the entire list of attendees.
     users = User.objects.filter(invoice__status=Invoice.STATUS_PAID)
     if options['usernames']:
         users = users.filter(username__in=options['usernames'])
+    if options.get('users') is not None:
+        # As a subquery, so that any number of users can be selected
+        users = users.filter(id__in=options['users'].values('id'))
+    users = users.distinct().order_by('id')
+
+    # Everything else about the attendees is fetched up front in bulk,
+    # rather than a handful of queries per attendee.
+    profiles = dict(
+        (ap.attendee.user_id, ap) for ap in AttendeeProfile.objects.filter(
+            attendee__user__in=users,
+        ).select_related('attendee__user')
+    )
+    speakers = _accepted_speakers(users)
+    paid_carts = _paid_carts(users)
 
     # Iterate through the attendee list to generate the badges.
-    for n, user in enumerate(users.distinct()):
-        ap = user.attendee.attendeeprofilebase.attendeeprofile
-        data = dict()
+    for n, user in enumerate(users):
+        ap = profiles.get(user.id)
+        if ap is None:
+            print "ERROR:", user, 'has no profile'
+            continue
+        data = dict(user_id=user.id)
 
         at_nm = ap.name.split()
         if at_nm[0].lower() in 'mr dr ms mrs miss'.split():
@@ -252,40 +469,36 @@ def collate(options):
 
         data['email'] = user.email
         data['over18'] = ap.of_legal_age
-        speaker = Speaker.objects.filter(user=user).first()
-        if speaker is None:
-            data['speaker'] = False
-        else:
-            data['speaker'] = bool(speaker.proposals.filter(result__status='accepted'))
+        data['speaker'] = user.id in speakers
 
         data['paid'] = data['friday'] = data['sprints'] = data['tutorial'] = False
         data['shirts'] = []
         data['ticket'] = ''
 
-        # look over all the invoices, yes
-        for inv in Invoice.objects.filter(user_id=ap.attendee.user.id):
-            if not inv.is_paid:
-                continue
-            cart = inv.cart
-            if cart is None:
-                continue
+        # look over all the paid carts, yes
+        for items in paid_carts[user.id]:
             data['paid'] = True
-            if cart.productitem_set.filter(product__category__name__startswith="Specialist Day").exists():
+            categories = [category for product, category in items]
+            if any(c.startswith("Specialist Day") for c in categories):
                 data['friday'] = True
-            if cart.productitem_set.filter(product__category__name__startswith="Sprint Ticket").exists():
+            if any(c.startswith("Sprint Ticket") for c in categories):
                 data['sprints'] = True
-            if cart.productitem_set.filter(product__category__name__contains="Tutorial").exists():
+            if any("Tutorial" in c for c in categories):
                 data['tutorial'] = True
-            t = cart.productitem_set.filter(product__category__name__startswith="Conference Ticket")
-            if t.exists():
-                product = t.first().product.name
-                if 'SOLD OUT' not in product:
-                    data['ticket'] = product
-            elif cart.productitem_set.filter(product__category__name__contains="Specialist Day Only").exists():
+            tickets = [
+                product for product, category in items
+                if category.startswith("Conference Ticket")
+            ]
+            if tickets:
+                if 'SOLD OUT' not in tickets[0]:
+                    data['ticket'] = tickets[0]
+            elif any("Specialist Day Only" in c for c in categories):
                 data['ticket'] = 'Specialist Day Only'
 
-            data['shirts'].extend(ts.product.name for ts in cart.productitem_set.filter(
-                product__category__name__startswith="T-Shirt"))
+            data['shirts'].extend(
+                product for product, category in items
+                if category.startswith("T-Shirt")
+            )
 
         if not data['paid']:
             print "INFO:", ap.attendee.user, 'not paid!'
@@ -297,8 +510,8 @@ def collate(options):
 
         data['company'] = overrides.get(ap.company, ap.company).strip()
 
-        data['volunteer'] = is_volunteer(ap.attendee)
-        data['organiser'] = is_organiser(ap.attendee)
+        data['volunteer'] = is_volunteer(ap.attendee, roles)
+        data['organiser'] = is_organiser(ap.attendee, roles)
 
         if 'Specialist Day Only' in data['ticket']:
             data['ticket'] = 'Friday Only'
@@ -319,6 +532,45 @@ def collate(options):
         yield data
 
 
+def _badge_cache_timeout():
+    return getattr(settings, 'BADGE_CACHE_TIMEOUT', 60 * 60)
+
+
+def collate_user(user):
+    '''
+    Returns the badge data for a single user, or None if they shouldn't
+    have a badge. The data are cached until something on the user's badge
+    changes (see BadgeVersionController).
+    '''
+    key = 'registrasion:badge_data:%d:%d' % (
+        user.id, BadgeVersionController.current(user.id),
+    )
+    badges = cache.get(key)
+    if badges is None:
+        badges = list(collate({'usernames': [user.username]}))
+        cache.set(key, badges, _badge_cache_timeout())
+    return badges[0] if badges else None
+
+
+def render_badge(template, data, n=0):
+    '''
+    Returns the SVG for a single badge on a copy of template. Rendered
+    badges are cached against the badge data and the template's contents,
+    so rendering the same badge again costs nothing.
+    '''
+    digest = hashlib.sha1(template.fingerprint)
+    digest.update(json.dumps([n, data], sort_keys=True))
+    key = 'registrasion:badge_svg:' + digest.hexdigest()
+
+    svg = cache.get(key)
+    if svg is None:
+        sheet = template.sheet()
+        svg_badge(sheet, data, n)
+        svg = sheet.tostring()
+        cache.set(key, svg, _badge_cache_timeout())
+    return svg
+
+
 def generate_stats(options):
     stats = {
         'firstname': [],
@@ -343,44 +595,83 @@ def generate_stats(options):
         print '%2d %s' % (l, s)
 
 
+def _render_page(job):
+    '''
+    Fills in one page of badges and writes it to disk, converting it to PDF
+    if asked. This runs in a worker process, which loads the template the
+    first time it's needed.
+    '''
+    template_path, name, badges, columns, rows, pdf = job
+    template = BadgeTemplate.load(template_path)
+
+    sheets = []
+    for n in range(0, len(badges), BADGES_PER_SHEET):
+        sheet = template.sheet()
+        for side, data in enumerate(badges[n:n + BADGES_PER_SHEET]):
+            svg_badge(sheet, data, side)
+        sheets.append(sheet)
+
+    if columns * rows == 1:
+        sheets[0].write(name)
+    else:
+        impose(template, sheets, columns, rows).write(name)
+
+    if pdf:
+        subprocess.check_call(
+            ['inkscape', '-z', '-C',
+             '--export-pdf=%s.pdf' % name,
+             '--file=' + name])
+
+    return name
+
+
 def generate_badges(options):
-    names = list()
-
-    orig = etree.parse(options['template'])
-    tree = deepcopy(orig)
-    root = tree.getroot()
-
-    for n, data in enumerate(collate(options)):
-        svg_badge(root, data, n % 2)
-        if n % 2:
-            name = os.path.abspath(
-                os.path.join(options['out_dir'], 'badge-%d.svg' % n))
-            tree.write(name)
-            names.append(name)
-            tree = deepcopy(orig)
-            root = tree.getroot()
-
-    if not n % 2:
-        name = os.path.abspath(
-            os.path.join(options['out_dir'], 'badge-%d.svg' % n))
-        tree.write(name)
-        names.append(name)
-
-    # progress = progressbar.ProgressBar(widgets=[progressbar.FormatLabel(
-    #     'Pages: %(value)s/%(max)s '
-    # )])
-    # for name in progress(names):
-    #     subprocess.check_call(
-    #         ['inkscape', '-z', '-C',
-    #          '--export-pdf=%s.pdf' % name,
-    #          '--file=' + name])
-    #
-    # output = os.path.join(options['out_dir'], 'all-badges.pdf')
-    # print 'Assembling: %s' % (output)
-    #
-    # subprocess.check_call(
-    #     ['pdftk'] + ['%s.pdf' % n for n in names] + ['cat', 'output', output])
-    #
+    '''
+    Writes the badges out as SVG pages. Each page holds a grid of sheets of
+    the template, options['columns'] wide and options['rows'] high (one
+    sheet by default), and is named after the last badge on it. If
+    options['pdf'] is set, the pages are also assembled into a single
+    all-badges.pdf, which needs inkscape and pdftk.
+    '''
+    # Collation needs the database, so it happens here; filling in the
+    # pages doesn't, so that's spread across a pool of processes.
+    badges = list(collate(options))
+
+    columns = options.get('columns') or 1
+    rows = options.get('rows') or 1
+    pdf = bool(options.get('pdf'))
+    per_page = BADGES_PER_SHEET * columns * rows
+
+    jobs = []
+    for n in range(0, len(badges), per_page):
+        page = badges[n:n + per_page]
+        name = os.path.abspath(os.path.join(
+            options['out_dir'], 'badge-%d.svg' % (n + len(page) - 1)))
+        jobs.append((options['template'], name, page, columns, rows, pdf))
+
+    processes = options.get('processes') or multiprocessing.cpu_count()
+    if processes <= 1 or len(jobs) <= 1:
+        pool = None
+        pages = itertools.imap(_render_page, jobs)
+    else:
+        pool = multiprocessing.Pool(processes)
+        pages = pool.imap(_render_page, jobs)
+
+    # Pages are written by the workers as soon as they're filled in.
+    try:
+        names = list(pages)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if pdf and names:
+        output = os.path.join(options['out_dir'], 'all-badges.pdf')
+        print 'Assembling: %s' % (output)
+
+        subprocess.check_call(
+            ['pdftk'] + ['%s.pdf' % n for n in names] + ['cat', 'output', output])
+
     return 0
 
 class InvalidTicketChoiceError(Exception):
@@ -0,0 +1,141 @@
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+
+
+class BadgeVersionController(object):
+    ''' Keeps a version number for each user's badge, which changes whenever
+    anything that appears on their badge might have changed: their user
+    record, their profile, their invoices and carts, their speaker record
+    and proposal results, and their group memberships.
+
+    Badge data can be cached against a user's version, and will be collated
+    again once it changes. Like the write version, the versions are kept in
+    Django's default cache, which must be shared between server processes.
+
+    '''
+
+    CACHE_KEY = "registrasion:badge_version:%d"
+
+    # Models whose changes appear on badges (along with their subclasses),
+    # and how to find the user whose badge they appear on.
+    _MODELS = {
+        "auth.user": lambda user: user.pk,
+        "registrasion.attendee": lambda attendee: attendee.user_id,
+        "registrasion.attendeeprofilebase": (
+            lambda profile: profile.attendee.user_id
+        ),
+        "registrasion.cart": lambda cart: cart.user_id,
+        "registrasion.invoice": lambda invoice: invoice.user_id,
+        "symposion_speakers.speaker": lambda speaker: speaker.user_id,
+        "symposion_reviews.proposalresult": (
+            lambda result: result.proposal.speaker.user_id
+        ),
+    }
+
+    # The function that finds the user for each model that sends signals,
+    # filled in by connect_signals().
+    _user_ids = {}
+
+    @classmethod
+    def current(cls, user_id):
+        ''' Returns the current badge version for the given user. '''
+
+        key = cls.CACHE_KEY % user_id
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, cls._initial_version(), None)
+            version = cache.get(key)
+        return version
+
+    @classmethod
+    def user_changed(cls, user_id):
+        ''' Moves the user to a new badge version, and again once the current
+        transaction commits, so that nothing computed from uncommitted data
+        keeps the final version. '''
+
+        cls.bump(user_id)
+        transaction.on_commit(lambda: cls.bump(user_id))
+
+    @classmethod
+    def bump(cls, user_id):
+        ''' Moves the user to a new badge version. '''
+
+        key = cls.CACHE_KEY % user_id
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Not in the cache (perhaps evicted)
+            version = cls._initial_version()
+            cache.set(key, version, None)
+            return version
+
+    @classmethod
+    def _initial_version(cls):
+        return int(time.time() * 1000000)
+
+    @classmethod
+    def connect_signals(cls):
+        ''' Changes badge versions whenever badge data are saved or deleted.
+        Called when the app is ready. '''
+
+        from django.contrib.auth.models import User
+
+        for model, user_id in cls._models():
+            cls._user_ids[model] = user_id
+            uid = "%s:%s" % (cls.CACHE_KEY, model._meta.label_lower)
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    cls._model_changed, sender=model, dispatch_uid=uid,
+                )
+
+        m2m_changed.connect(
+            cls._groups_changed,
+            sender=User.groups.through,
+            dispatch_uid=cls.CACHE_KEY,
+        )
+
+    @classmethod
+    def _models(cls):
+        ''' Returns (model, function that finds the user) for each installed
+        model whose changes appear on badges. '''
+
+        bases = []
+        for label, user_id in cls._MODELS.items():
+            try:
+                bases.append((apps.get_model(label), user_id))
+            except LookupError:
+                # That app isn't installed
+                pass
+
+        return [
+            (model, user_id)
+            for model in apps.get_models()
+            for base, user_id in bases
+            if issubclass(model, base)
+        ]
+
+    @classmethod
+    def _model_changed(cls, sender, instance, **kwargs):
+        user_id = cls._user_ids[sender](instance)
+        if user_id is not None:
+            cls.user_changed(user_id)
+
+    @classmethod
+    def _groups_changed(cls, instance, action, reverse, pk_set, **kwargs):
+        if not reverse:
+            # A user's groups changed
+            if action.startswith("post_"):
+                cls.user_changed(instance.pk)
+        elif action in ("post_add", "post_remove"):
+            # A group's users changed
+            for user_id in pk_set:
+                cls.user_changed(user_id)
+        elif action == "pre_clear":
+            for user_id in instance.user_set.values_list("id", flat=True):
+                cls.user_changed(user_id)
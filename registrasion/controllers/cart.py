@@ -3,6 +3,7 @@ from .category import CategoryController
 from .discount import DiscountController
 from .flag import FlagController
 from .product import ProductController
+from .write_version import WriteVersionController
 
 import collections
 import datetime
@@ -217,6 +218,7 @@ class CartController(object):
 
         items_in_cart.filter(to_delete).delete()
         commerce.ProductItem.objects.bulk_create(new_items)
+        WriteVersionController.data_changed()
 
     def _test_limits(self, product_quantities):
         ''' Tests that the quantity changes we intend to make do not violate
@@ -13,6 +13,7 @@ from registrasion.models import people
 from .cart import CartController
 from .credit_note import CreditNoteController
 from .for_id import ForId
+from .write_version import WriteVersionController
 
 
 class InvoiceController(ForId, object):
@@ -174,7 +175,7 @@ class InvoiceController(ForId, object):
 
         # Get the invoice recipient
         profile = people.AttendeeProfileBase.objects.get_subclass(
-            id=user.attendee.attendeeprofilebase.id,
+            attendee__user=user,
         )
         recipient = profile.invoice_recipient()
 
@@ -196,6 +197,7 @@ class InvoiceController(ForId, object):
             line_item.invoice = invoice
 
         commerce.LineItem.objects.bulk_create(line_items)
+        WriteVersionController.data_changed()
 
         cls._apply_credit_notes(invoice)
         cls.email_on_invoice_creation(invoice)
@@ -0,0 +1,196 @@
+import math
+import re
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_save
+
+
+class AttendeeSearchController(object):
+    ''' Finds attendees by their name, email address, company, username, or
+    access code, using an index of the trigrams in each of those
+    (``AttendeeSearchTerm``), which is kept up to date as attendees, their
+    users, and their profiles are saved.
+
+    Words are lower-cased and padded before they're split into trigrams, as
+    PostgreSQL's pg_trgm does, so that a search for the start of a word
+    finds the whole word.
+
+    '''
+
+    # The most results that a search returns.
+    RESULTS = 50
+
+    # The smallest fraction of a search's trigrams that an attendee must
+    # have to match it. Unlike pg_trgm's similarity, the attendee's other
+    # trigrams don't count against them, so that short searches still find
+    # attendees with long names. The threshold is pg_trgm's default.
+    SIMILARITY = 0.3
+
+    _WORD = re.compile(r"\w+", re.UNICODE)
+
+    @classmethod
+    def trigrams(cls, text):
+        ''' Returns the set of trigrams in the given text. '''
+
+        trigrams = set()
+        for word in cls._WORD.findall(text.lower()):
+            word = "  " + word + " "
+            trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+        return trigrams
+
+    @classmethod
+    def search(cls, query, limit=RESULTS):
+        ''' Returns the attendees that best match the query, best first,
+        leaving out those that have too few of its trigrams to be a match.
+
+        Returns:
+            [(int, float), ...]: The ID of each matching attendee, along with
+                the fraction of the query's trigrams that they have.
+
+        '''
+
+        from registrasion.models import people
+
+        trigrams = cls.trigrams(query)
+        if not trigrams:
+            return []
+
+        needed = max(1, int(math.ceil(cls.SIMILARITY * len(trigrams))))
+
+        matches = people.AttendeeSearchTerm.objects.filter(
+            term__in=trigrams,
+        ).values("attendee").annotate(
+            matched=Count("term", distinct=True),
+        ).filter(
+            matched__gte=needed,
+        ).order_by("-matched", "attendee")[:limit]
+
+        return [
+            (match["attendee"], float(match["matched"]) / len(trigrams))
+            for match in matches
+        ]
+
+    @classmethod
+    def index(cls, attendee, profile=None):
+        ''' Replaces the indexed trigrams for an attendee. ``profile``
+        should be the attendee's profile, if it's already been fetched. '''
+
+        from registrasion.models import people
+
+        if profile is None:
+            profile = people.AttendeeProfileBase.objects.select_subclasses(
+            ).filter(attendee=attendee).first()
+
+        people.AttendeeSearchTerm.objects.filter(attendee=attendee).delete()
+        people.AttendeeSearchTerm.objects.bulk_create(
+            cls._terms(attendee, attendee.user, profile)
+        )
+
+    @classmethod
+    def index_created(cls, attendees):
+        ''' Indexes attendees that were created in bulk, which doesn't send
+        post_save. They're looked up by their access codes, as bulk_create
+        doesn't give them IDs on every database. '''
+
+        from registrasion.models import people
+
+        created = people.Attendee.objects.filter(
+            access_code__in=[attendee.access_code for attendee in attendees],
+        ).select_related("user")
+
+        terms = []
+        for attendee in created:
+            terms.extend(cls._terms(attendee, attendee.user, None))
+        people.AttendeeSearchTerm.objects.bulk_create(terms)
+
+    @classmethod
+    def index_all(cls):
+        ''' Rebuilds the index for every attendee, in bulk. The old index is
+        replaced in one transaction, so searches never see it half-built. '''
+
+        from registrasion.models import people
+
+        with transaction.atomic():
+            profiles = people.AttendeeProfileBase.objects.select_subclasses()
+            profiles = dict(
+                (profile.attendee_id, profile) for profile in profiles
+            )
+            attendees = people.Attendee.objects.select_related("user")
+
+            people.AttendeeSearchTerm.objects.all().delete()
+
+            count = 0
+            terms = []
+            for attendee in attendees.iterator():
+                count += 1
+                terms.extend(cls._terms(
+                    attendee, attendee.user, profiles.get(attendee.id),
+                ))
+                if len(terms) >= 10000:
+                    people.AttendeeSearchTerm.objects.bulk_create(terms)
+                    terms = []
+            people.AttendeeSearchTerm.objects.bulk_create(terms)
+
+        return count
+
+    @classmethod
+    def _terms(cls, attendee, user, profile):
+        from registrasion.models import people
+
+        text = [user.username, user.email or "", attendee.access_code]
+        if profile is not None:
+            profile = profile.concrete_profile()
+            text += [
+                getattr(profile, field) or ""
+                for field in profile.search_fields()
+            ]
+
+        return [
+            people.AttendeeSearchTerm(attendee=attendee, term=term)
+            for term in cls.trigrams(" ".join(text))
+        ]
+
+    @classmethod
+    def connect_signals(cls):
+        ''' Re-indexes attendees as they, their profiles, and their users are
+        saved. Called when the app is ready. '''
+
+        from django.contrib.auth.models import User
+        from registrasion.models import people
+
+        senders = [User, people.Attendee] + [
+            model for model in apps.get_models()
+            if issubclass(model, people.AttendeeProfileBase)
+        ]
+        for sender in senders:
+            post_save.connect(
+                cls._model_saved,
+                sender=sender,
+                dispatch_uid="registrasion:attendee_search:%s" % (
+                    sender._meta.label_lower,
+                ),
+            )
+
+    @classmethod
+    def _model_saved(cls, sender, instance, created, update_fields, **kwargs):
+        from django.contrib.auth.models import User
+        from registrasion.models import people
+
+        if isinstance(instance, people.AttendeeProfileBase):
+            cls.index(instance.attendee, instance)
+        elif isinstance(instance, people.Attendee):
+            # Attendees' searchable details are only set when they're created,
+            # which is before they have a profile.
+            if created:
+                people.AttendeeSearchTerm.objects.bulk_create(
+                    cls._terms(instance, instance.user, None)
+                )
+        elif isinstance(instance, User):
+            # Logging in only saves the last login time
+            if update_fields and set(update_fields) <= set(["last_login"]):
+                return
+            attendee = people.Attendee.objects.filter(user=instance).first()
+            if attendee is not None:
+                cls.index(attendee)
@@ -0,0 +1,158 @@
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.cache import caches
+from django.core.cache import DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+
+
+class WriteVersionController(object):
+    ''' Keeps a version number for the registration data, which changes
+    whenever any of Registrasion's models, or the models from other apps
+    that reports show (users, attendee profiles, and speakers and their
+    proposals), are saved or deleted. Anything derived from that data can be
+    cached against the version, and will be recalculated once the data
+    changes.
+
+    The version is kept in Django's default cache. If you run more than one
+    server process, that cache must be shared between them (e.g. memcached),
+    or else processes will not see each other's writes. Anything that caches
+    data in process memory against the version should only do so if
+    ``shared`` is True.
+
+    '''
+
+    CACHE_KEY = "registrasion:write_version"
+    TIME_CACHE_KEY = "registrasion:write_time"
+
+    # Models whose changes don't affect the registration data.
+    _IGNORED_MODELS = set(["attendeesearchterm", "reportsnapshot"])
+
+    # Models from other apps that reports show. Their subclasses (e.g. the
+    # site's attendee profile and proposal models) are included as well.
+    _RELATED_MODELS = (
+        "auth.user",
+        "symposion_proposals.proposalbase",
+        "symposion_proposals.proposalkind",
+        "symposion_schedule.presentation",
+        "symposion_speakers.speaker",
+    )
+
+    # Whether the default cache is shared between server processes, so that
+    # every process sees the same version. Set by check_cache().
+    shared = False
+
+    @classmethod
+    def current(cls):
+        ''' Returns the current write version. '''
+
+        version = cache.get(cls.CACHE_KEY)
+        if version is None:
+            cache.add(cls.CACHE_KEY, cls._initial_version(), None)
+            version = cache.get(cls.CACHE_KEY)
+        return version
+
+    @classmethod
+    def last_changed(cls):
+        ''' Returns the time (as from ``time.time()``) that the version last
+        changed, or None if that isn't known. '''
+
+        return cache.get(cls.TIME_CACHE_KEY)
+
+    @classmethod
+    def data_changed(cls):
+        ''' Moves to a new write version, and again once the current
+        transaction commits, so that nothing computed from uncommitted data
+        keeps the final version. Call this after changing data without
+        saving models, e.g. with ``QuerySet.update()`` or ``bulk_create()``.
+        '''
+
+        cls.bump()
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(cls.bump)
+
+    @classmethod
+    def bump(cls):
+        ''' Moves to a new write version. '''
+
+        cache.set(cls.TIME_CACHE_KEY, time.time(), None)
+
+        try:
+            return cache.incr(cls.CACHE_KEY)
+        except ValueError:
+            # Not in the cache (perhaps evicted)
+            version = cls._initial_version()
+            cache.set(cls.CACHE_KEY, version, None)
+            return version
+
+    @classmethod
+    def _initial_version(cls):
+        # If the version goes missing from the cache, starting again from a
+        # timestamp means that we never reuse an old version number.
+        return int(time.time() * 1000000)
+
+    @classmethod
+    def check_cache(cls):
+        ''' Works out whether the default cache is shared between server
+        processes. Local memory caches are private to each process, and the
+        dummy cache doesn't keep the version at all. Called when the app is
+        ready. '''
+
+        backend = caches[DEFAULT_CACHE_ALIAS]
+        cls.shared = not isinstance(backend, (DummyCache, LocMemCache))
+
+    @classmethod
+    def connect_signals(cls):
+        ''' Bumps the write version whenever the registration data are saved
+        or deleted. Called when the app is ready. '''
+
+        for model in cls._models():
+            uid = "%s:%s" % (cls.CACHE_KEY, model._meta.label_lower)
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    cls._model_changed, sender=model, dispatch_uid=uid,
+                )
+            for field in model._meta.local_many_to_many:
+                m2m_changed.connect(
+                    cls._relation_changed,
+                    sender=field.remote_field.through,
+                    dispatch_uid=uid,
+                )
+
+    @classmethod
+    def _models(cls):
+        ''' Returns the models whose changes affect the registration data. '''
+
+        bases = [
+            model for model in apps.get_app_config("registrasion").get_models()
+            if model._meta.model_name not in cls._IGNORED_MODELS
+        ]
+        for label in cls._RELATED_MODELS:
+            try:
+                bases.append(apps.get_model(label))
+            except LookupError:
+                # That app isn't installed
+                pass
+
+        return [
+            model for model in apps.get_models()
+            if issubclass(model, tuple(bases))
+        ]
+
+    @classmethod
+    def _model_changed(cls, sender, update_fields=None, **kwargs):
+        # Logging in only saves the last login time
+        if update_fields and set(update_fields) <= set(["last_login"]):
+            return
+        cls.data_changed()
+
+    @classmethod
+    def _relation_changed(cls, action, **kwargs):
+        if action.startswith("post_"):
+            cls.data_changed()
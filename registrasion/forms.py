@@ -1,4 +1,7 @@
+import threading
+
 from .controllers.product import ProductController
+from .controllers.write_version import WriteVersionController
 from .models import commerce
 from .models import inventory
 
@@ -525,11 +528,49 @@ class InvoiceEmailForm(InvoicesWithProductAndStatusForm):
 
 from registrasion.contrib.badger import InvalidTicketChoiceError
 
+_ticket_choices_lock = threading.Lock()
+_ticket_choices = {}
+
+
 def ticket_selection():
-   return list(enumerate(['!!! NOT A VALID TICKET !!!'] + \
-                         [p.name for p in inventory.Product.objects.\
-                            filter(category__name__contains="Ticket").\
-                            exclude(name__contains="Organiser").order_by('id')]))
+    ''' Returns the tickets that can be chosen on a BadgeForm, as
+    (product id, product name) pairs, following an invalid first choice
+    with an id of 0. If the write version is shared between processes,
+    these are cached for the current version, so they're only queried again
+    once the inventory changes. '''
+
+    if not WriteVersionController.shared:
+        return _ticket_selection()
+
+    version = WriteVersionController.current()
+    with _ticket_choices_lock:
+        if version not in _ticket_choices:
+            _ticket_choices.clear()
+            _ticket_choices[version] = _ticket_selection()
+        return list(_ticket_choices[version])
+
+
+def _ticket_selection():
+    return [(0, '!!! NOT A VALID TICKET !!!')] + \
+        list(inventory.Product.objects.
+             filter(category__name__contains="Ticket").
+             exclude(name__contains="Organiser").order_by('id').
+             values_list('id', 'name'))
+
+
+def ticket_name(product_id, choices=None):
+    ''' Returns the name of the ticket with the given product id, as
+    chosen on a BadgeForm. Raises InvalidTicketChoiceError if it isn't one
+    of the tickets on offer. ``choices`` are the tickets on offer, if they've
+    already been fetched. '''
+
+    if choices is None:
+        choices = ticket_selection()
+    choices = dict(choices)
+    product_id = int(product_id)
+    if product_id == 0 or product_id not in choices:
+        raise InvalidTicketChoiceError()
+    return choices[product_id]
 
 
 class TicketSelectionField(forms.ChoiceField):
@@ -537,8 +578,7 @@ class TicketSelectionField(forms.ChoiceField):
     def validate(self, value):
         super(TicketSelectionField, self).validate(value)
 
-        result = int(self.to_python(value))
-        if result <= 0 or result > len(list(self.choices)):
+        if int(self.to_python(value)) == 0:
             raise InvalidTicketChoiceError()
 
 
@@ -564,6 +604,17 @@ class BadgeForm(forms.Form):
     friday = forms.BooleanField(label="Specialist Day", required=False)
     sprints = forms.BooleanField(label="Sprints", required=False)
 
+    def __init__(self, *a, **k):
+        super(BadgeForm, self).__init__(*a, **k)
+
+        # Fetch the tickets once for this form, rather than each time the
+        # choices are rendered or validated.
+        self.fields['ticket'].choices = ticket_selection()
+
+    def ticket_name(self):
+        ''' Returns the name of the chosen ticket (see ticket_name). '''
+
+        return ticket_name(self.data['ticket'], self.fields['ticket'].choices)
 
     def is_valid(self):
         valid = super(BadgeForm, self).is_valid()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from registrasion.controllers.search import AttendeeSearchController
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the index that the attendee report searches. Attendees are "
+        "re-indexed as they're saved, so this is only needed after attendee "
+        "data are loaded in bulk."
+    )
+
+    def handle(self, *args, **options):
+        count = AttendeeSearchController.index_all()
+        self.stdout.write("Indexed %d attendee(s)." % count)
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from registrasion.reporting import snapshots
+
+# Importing the report views registers them, so that they can be looked up by
+# name.
+from registrasion.reporting import views  # NOQA
+
+
+class Command(BaseCommand):
+    help = (
+        "Computes queued report snapshots, and queues the reports in "
+        "settings.REPORT_SNAPSHOT_SCHEDULE that are due to be refreshed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--forever",
+            action="store_true",
+            default=False,
+            help="Keep running, checking for new snapshots periodically.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=60,
+            help="Seconds to wait between checks when running --forever.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            queued = snapshots.queue_scheduled_snapshots()
+            computed = snapshots.run_queued_snapshots()
+
+            if options["verbosity"] > 1 or queued or computed:
+                self.stdout.write(
+                    "Queued %d scheduled snapshot(s), computed %d." % (
+                        len(queued), computed,
+                    )
+                )
+
+            if not options["forever"]:
+                break
+
+            time.sleep(options["interval"])
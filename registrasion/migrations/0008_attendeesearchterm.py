@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registrasion', '0007_reportsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendeeSearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=3)),
+                ('attendee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='registrasion.Attendee')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='attendeesearchterm',
+            index_together=set([('term', 'attendee')]),
+        ),
+    ]
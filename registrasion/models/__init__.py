@@ -2,3 +2,4 @@ from .commerce import *  # NOQA
 from .conditions import *  # NOQA
 from .inventory import *  # NOQA
 from .people import *  # NOQA
+from .reporting import *  # NOQA
@@ -4,11 +4,13 @@ from . import inventory
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import F, Q, Sum
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Cast, Concat
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from model_utils.managers import InheritanceManager
+from model_utils.managers import InheritanceQuerySet
 
 
 # Commerce Models
@@ -290,6 +292,70 @@ class ManualPayment(PaymentBase):
     entered_by = models.ForeignKey(User)
 
 
+class CreditNoteQuerySet(InheritanceQuerySet):
+    ''' Works out the state of each credit note in the database, so that
+    listing credit notes does not need to look up their applications and
+    refunds one note at a time. '''
+
+    def with_status(self):
+        ''' Annotates each credit note with:
+
+        ``status_text``: the human-readable status of the credit note, as
+            returned by ``CreditNote.status``.
+
+        ``is_claimed``: whether the credit note has been applied to an
+            invoice or refunded.
+
+        ``remaining_value``: the value of the credit note that is yet to be
+            claimed.
+
+        '''
+
+        applied = Q(creditnoteapplication__isnull=False)
+        refunded = Q(creditnoterefund__isnull=False)
+
+        return self.annotate(
+            status_text=Case(
+                When(applied, then=Concat(
+                    Value("Applied to invoice "),
+                    Cast(
+                        "creditnoteapplication__invoice",
+                        models.CharField(max_length=20),
+                    ),
+                    output_field=models.CharField(),
+                )),
+                When(refunded, then=Concat(
+                    Value("Refunded with reference: "),
+                    "creditnoterefund__reference",
+                    output_field=models.CharField(),
+                )),
+                default=Value("Unclaimed"),
+                output_field=models.CharField(),
+            ),
+            is_claimed=Case(
+                When(applied | refunded, then=Value(True)),
+                default=Value(False),
+                output_field=models.BooleanField(),
+            ),
+            remaining_value=Case(
+                When(applied | refunded, then=Value(0)),
+                default=0 - F("amount"),
+                output_field=models.DecimalField(
+                    max_digits=8, decimal_places=2,
+                ),
+            ),
+        )
+
+    def unclaimed(self):
+        return self.filter(
+            creditnoteapplication=None,
+            creditnoterefund=None,
+        )
+
+    def refunded(self):
+        return self.exclude(creditnoterefund=None)
+
+
 class CreditNote(PaymentBase):
     ''' Credit notes represent money accounted for in the system that do not
     belong to specific invoices. They may be paid into other invoices, or
@@ -297,24 +363,30 @@ class CreditNote(PaymentBase):
 
     Each CreditNote may either be used to pay towards another Invoice in the
     system (by attaching a CreditNoteApplication), or may be marked as
-    refunded (by attaching a CreditNoteRefund).'''
+    refunded (by attaching a CreditNoteRefund).
+
+    ``CreditNote.objects.with_status()`` returns credit notes whose status is
+    worked out by the database; the ``status`` and ``is_unclaimed`` properties
+    use that where it is available.'''
 
     class Meta:
         app_label = "registrasion"
 
+    objects = InheritanceManager.from_queryset(CreditNoteQuerySet)()
+
     @classmethod
     def unclaimed(cls):
-        return cls.objects.filter(
-            creditnoteapplication=None,
-            creditnoterefund=None,
-        )
+        return cls.objects.unclaimed()
 
     @classmethod
     def refunded(cls):
-        return cls.objects.exclude(creditnoterefund=None)
+        return cls.objects.refunded()
 
     @property
     def status(self):
+        if hasattr(self, "status_text"):
+            return self.status_text
+
         if self.is_unclaimed:
             return "Unclaimed"
 
@@ -330,6 +402,9 @@ class CreditNote(PaymentBase):
 
     @property
     def is_unclaimed(self):
+        if hasattr(self, "is_claimed"):
+            return not self.is_claimed
+
         return not (
             hasattr(self, 'creditnoterefund') or
             hasattr(self, 'creditnoteapplication')
@@ -1,14 +1,76 @@
+import contextlib
+import threading
+
 from registrasion import util
+from registrasion.controllers.search import AttendeeSearchController
+from registrasion.controllers.write_version import WriteVersionController
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError
 from django.db import models
+from django.db import transaction
+from django.db.models.query import ModelIterable
 from django.utils.encoding import python_2_unicode_compatible
+from model_utils.managers import InheritanceIterable
 from model_utils.managers import InheritanceManager
+from model_utils.managers import InheritanceQuerySet
 
 
 # User models
 
+class AttendeeManager(models.Manager):
+
+    def bulk_create(self, objs, *a, **k):
+        ''' Creates attendees in bulk, first giving an access code to each
+        one that doesn't have one. '''
+
+        objs = list(objs)
+        missing = [attendee for attendee in objs if not attendee.access_code]
+
+        for attempt in range(Attendee.ACCESS_CODE_ATTEMPTS):
+            codes = Attendee.allocate_access_codes(len(missing))
+            Attendee._discard_pooled_access_codes(codes)
+            for attendee, access_code in zip(missing, codes):
+                attendee.access_code = access_code
+
+            try:
+                with _retryable():
+                    created = super(AttendeeManager, self).bulk_create(
+                        objs, *a, **k
+                    )
+                break
+            except IntegrityError:
+                # Another process may have taken some of the codes since
+                # they were checked; if so, replace just those.
+                taken = Attendee._taken_access_codes(codes)
+                if not taken:
+                    raise
+                missing = [i for i in missing if i.access_code in taken]
+        else:
+            raise IntegrityError("Could not find unused access codes")
+
+        AttendeeSearchController.index_created(objs)
+        WriteVersionController.data_changed()
+        return created
+
+
+def _retryable():
+    ''' Returns a context for an insert that may be retried if it fails.
+    Inside a transaction, that needs a savepoint, as the failure would
+    otherwise break the transaction. Outside of one, the insert commits on
+    its own, so the savepoint's extra queries are skipped. '''
+
+    if transaction.get_connection().in_atomic_block:
+        return transaction.atomic()
+    return _autocommit()
+
+
+@contextlib.contextmanager
+def _autocommit():
+    yield
+
+
 @python_2_unicode_compatible
 class Attendee(models.Model):
     ''' Miscellaneous user-related data. '''
@@ -16,6 +78,19 @@ class Attendee(models.Model):
     class Meta:
         app_label = "registrasion"
 
+    objects = AttendeeManager()
+
+    # Access codes are handed out to new attendees from a pool, which is
+    # checked against the database this many codes at a time.
+    ACCESS_CODE_BATCH_SIZE = 100
+
+    # How many codes from the pool to try, if they have been taken by
+    # another process since they were checked, before giving up.
+    ACCESS_CODE_ATTEMPTS = 10
+
+    _access_code_lock = threading.Lock()
+    _access_code_pool = []
+
     def __str__(self):
         return "%s" % self.user
 
@@ -28,12 +103,70 @@ class Attendee(models.Model):
         except ObjectDoesNotExist:
             return Attendee.objects.create(user=user)
 
+    @classmethod
+    def allocate_access_codes(cls, count):
+        ''' Returns a list of ``count`` distinct access codes, none of
+        which belong to an existing attendee. Candidate codes are checked
+        against the database in bulk, rather than one at a time. '''
+
+        codes = set()
+        while len(codes) < count:
+            candidates = set()
+            while len(candidates) < count - len(codes):
+                access_code = util.generate_access_code()
+                if access_code not in codes:
+                    candidates.add(access_code)
+            codes |= candidates - cls._taken_access_codes(candidates)
+        return list(codes)
+
+    @classmethod
+    def _taken_access_codes(cls, access_codes):
+        access_codes = list(access_codes)
+        taken = set()
+        # Keeps well clear of SQLite's limit on query parameters
+        for i in range(0, len(access_codes), 500):
+            taken.update(Attendee.objects.filter(
+                access_code__in=access_codes[i:i + 500],
+            ).values_list("access_code", flat=True))
+        return taken
+
+    @classmethod
+    def _next_access_code(cls):
+        with cls._access_code_lock:
+            if not cls._access_code_pool:
+                cls._access_code_pool.extend(
+                    cls.allocate_access_codes(cls.ACCESS_CODE_BATCH_SIZE)
+                )
+            return cls._access_code_pool.pop()
+
+    @classmethod
+    def _discard_pooled_access_codes(cls, access_codes):
+        ''' Removes access codes that have been used some other way from the
+        pool, so that they're not handed out again. '''
+
+        access_codes = set(access_codes)
+        with cls._access_code_lock:
+            cls._access_code_pool[:] = [
+                access_code for access_code in cls._access_code_pool
+                if access_code not in access_codes
+            ]
+
     def save(self, *a, **k):
-        while not self.access_code:
-            access_code = util.generate_access_code()
-            if Attendee.objects.filter(access_code=access_code).count() == 0:
-                self.access_code = access_code
-        return super(Attendee, self).save(*a, **k)
+        if self.access_code:
+            return super(Attendee, self).save(*a, **k)
+
+        for attempt in range(self.ACCESS_CODE_ATTEMPTS):
+            self.access_code = self._next_access_code()
+            try:
+                with _retryable():
+                    return super(Attendee, self).save(*a, **k)
+            except IntegrityError:
+                # Codes in the pool may have been taken since they were
+                # checked; if so, discard this one and try the next.
+                taken = Attendee.objects.filter(access_code=self.access_code)
+                if not taken.exists():
+                    raise
+        raise IntegrityError("Could not find an unused access code")
 
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     # Badge/profile is linked
@@ -46,6 +179,44 @@ class Attendee(models.Model):
     guided_categories_complete = models.ManyToManyField("category", blank=True)
 
 
+class AttendeeSearchTerm(models.Model):
+    ''' One trigram (three-character fragment) of the text that an attendee
+    can be found by. Attendees are searched for by counting how many of the
+    search's trigrams they have. These are kept up to date by
+    ``AttendeeSearchController``.
+
+    Terms aren't unique for each attendee, as databases with case or accent
+    insensitive collations would consider some distinct trigrams equal. '''
+
+    class Meta:
+        app_label = "registrasion"
+        index_together = (("term", "attendee"), )
+
+    term = models.CharField(max_length=3)
+    attendee = models.ForeignKey(
+        Attendee,
+        on_delete=models.CASCADE,
+        related_name="search_terms",
+    )
+
+
+class _ConcreteProfileIterable(InheritanceIterable, ModelIterable):
+    ''' Yields attendee profiles as instances of their concrete subclasses.
+    This is also a ModelIterable, so that Django will use it to prefetch
+    profiles. '''
+
+
+class AttendeeProfileQuerySet(InheritanceQuerySet):
+
+    def __init__(self, *a, **k):
+        super(AttendeeProfileQuerySet, self).__init__(*a, **k)
+        self._iterable_class = _ConcreteProfileIterable
+
+
+class AttendeeProfileManager(InheritanceManager):
+    _queryset_class = AttendeeProfileQuerySet
+
+
 class AttendeeProfileBase(models.Model):
     ''' Information for an attendee's badge and related preferences.
     Subclass this in your Django site to ask for attendee information in your
@@ -55,7 +226,7 @@ class AttendeeProfileBase(models.Model):
     class Meta:
         app_label = "registrasion"
 
-    objects = InheritanceManager()
+    objects = AttendeeProfileManager()
 
     @classmethod
     def name_field(cls):
@@ -67,11 +238,46 @@ class AttendeeProfileBase(models.Model):
         '''
         return None
 
+    @classmethod
+    def search_fields(cls):
+        '''
+        Returns:
+            The names of the fields that staff can find attendees by, as well
+            as their username, email address and access code. By default,
+            this is the name field and a ``company`` field, if the profile
+            has one. Override in subclasses to search other fields.
+        '''
+        fields = [cls.name_field()]
+        if any(field.name == "company" for field in cls._meta.get_fields()):
+            fields.append("company")
+        return [field for field in fields if field is not None]
+
+    @classmethod
+    def prefetch(cls, path):
+        '''
+        Returns:
+            A ``Prefetch`` for ``prefetch_related()``, which follows ``path``
+            (a lookup path that ends at an attendee's profile) and loads
+            every profile on it as its concrete subclass, in one query.
+        '''
+        return models.Prefetch(path, queryset=cls.objects.select_subclasses())
+
+    def concrete_profile(self):
+        '''
+        Returns:
+            This profile as an instance of its concrete subclass. This is
+            looked up once for each base class instance, and remembered.
+        '''
+        if type(self) != AttendeeProfileBase:
+            return self
+        if not hasattr(self, "_concrete_profile"):
+            self._concrete_profile = AttendeeProfileBase.objects.get_subclass(
+                id=self.id,
+            )
+        return self._concrete_profile
+
     def attendee_name(self):
-        if type(self) == AttendeeProfileBase:
-            real = AttendeeProfileBase.objects.get_subclass(id=self.id)
-        else:
-            real = self
+        real = self.concrete_profile()
         return getattr(real, real.name_field())
 
     def invoice_recipient(self):
@@ -84,7 +290,7 @@ class AttendeeProfileBase(models.Model):
         '''
 
         # Manual dispatch to subclass. Fleh.
-        slf = AttendeeProfileBase.objects.get_subclass(id=self.id)
+        slf = self.concrete_profile()
         # Actually compare the functions.
         if type(slf).invoice_recipient != type(self).invoice_recipient:
             return type(slf).invoice_recipient(slf)
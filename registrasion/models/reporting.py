@@ -0,0 +1,88 @@
+from django.contrib.auth.models import User
+from django.db import models
+from django.utils import timezone
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.translation import ugettext_lazy as _
+
+
+# Reporting Models
+
+@python_2_unicode_compatible
+class ReportSnapshot(models.Model):
+    ''' A stored copy of a report's output, computed in the background by the
+    ``report_snapshots`` management command, so that slow reports can be
+    downloaded once they are ready.
+
+    Attributes:
+        report (str): The name of the report view that this snapshot is of.
+
+        query (str): The URL-encoded form parameters that the report is
+            computed with.
+
+        requested_by (Optional[User]): The staff member who asked for this
+            snapshot. Snapshots queued by the schedule have no requester.
+
+        requested_time (datetime): When this snapshot was queued.
+
+        completed_time (Optional[datetime]): When the worker finished
+            computing this snapshot.
+
+        status (int): One of ``STATUS_QUEUED``, ``STATUS_RUNNING``,
+            ``STATUS_DONE``, or ``STATUS_FAILED``.
+
+        content (str): A JSON list of the report's sections, each with its
+            title, headings, and rows, as rendered for HTML and as plain text
+            for CSV.
+
+        error (str): A description of what went wrong, if computing the
+            snapshot failed.
+
+    '''
+
+    class Meta:
+        app_label = "registrasion"
+        ordering = ("-requested_time", )
+
+    STATUS_QUEUED = 1
+    STATUS_RUNNING = 2
+    STATUS_DONE = 3
+    STATUS_FAILED = 4
+
+    STATUS_TYPES = [
+        (STATUS_QUEUED, _("Queued")),
+        (STATUS_RUNNING, _("Running")),
+        (STATUS_DONE, _("Done")),
+        (STATUS_FAILED, _("Failed")),
+    ]
+
+    def __str__(self):
+        return "Snapshot of %s (%s)" % (self.report, self.query)
+
+    @property
+    def is_done(self):
+        return self.status == self.STATUS_DONE
+
+    report = models.CharField(
+        max_length=255,
+        db_index=True,
+        verbose_name=_("Report"),
+    )
+    query = models.TextField(
+        blank=True,
+        verbose_name=_("Query"),
+    )
+    requested_by = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    requested_time = models.DateTimeField(default=timezone.now)
+    completed_time = models.DateTimeField(null=True, blank=True)
+    status = models.IntegerField(
+        choices=STATUS_TYPES,
+        default=STATUS_QUEUED,
+        db_index=True,
+    )
+    content = models.TextField(blank=True)
+    error = models.TextField(blank=True)
@@ -0,0 +1,314 @@
+''' A columnar copy of the sales data that several reports summarise.
+
+Reports like product_status, discount_status, limits and items_sold all
+aggregate the same product, discount and line items in different ways. The
+SalesCube loads those items once, as NumPy arrays, and the reports pivot and
+sum from the arrays instead of querying the database again.
+
+The cube is cached for the current write version (see
+``WriteVersionController``), so a member of staff looking at several reports
+only loads the data once, until something changes. Each server process keeps
+its own cube, so this needs the write version to be kept in a cache that's
+shared between processes.
+
+NumPy is an optional dependency. If it isn't installed, or the default cache
+isn't shared, ``sales_cube()`` returns None, and reports query the database
+directly.
+
+'''
+
+import threading
+
+from decimal import Decimal
+from django.utils import timezone
+
+from registrasion.controllers.write_version import WriteVersionController
+from registrasion.models import commerce
+from registrasion.models import conditions
+from registrasion.models import inventory
+
+from .routers import current_database
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+def sales_cube():
+    ''' Returns the SalesCube for the current write version, loading it if
+    necessary.
+
+    Returns:
+        Optional[SalesCube]: None if NumPy is not installed, or if the write
+            version can't tell when the cube is out of date.
+
+    '''
+
+    if numpy is None or not WriteVersionController.shared:
+        return None
+
+    # Cubes loaded from a replica are kept separately, so that data from a
+    # lagging replica is never served for a report that reads the primary.
+    key = (current_database(), WriteVersionController.current())
+    with _cache_lock:
+        if key not in _cache:
+            _cache.clear()
+            _cache[key] = SalesCube()
+        return _cache[key]
+
+
+def _columns(rows, dtypes):
+    ''' Turns a list of row tuples into a dict of NumPy arrays, one for each
+    (name, dtype) pair in dtypes. '''
+
+    columns = list(zip(*rows)) or [()] * len(dtypes)
+    return dict(
+        (name, numpy.array(column, dtype=dtype))
+        for (name, dtype), column in zip(dtypes, columns)
+    )
+
+
+def _time(value):
+    ''' Converts an aware datetime to a naive UTC one, for datetime64. '''
+    if timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    return value
+
+
+def _expiry(row):
+    ''' Replaces the cart's last update time and reservation duration at
+    the end of row with the time its reservation expires. '''
+    return row[:-2] + (_time(row[-2] + row[-1]), )
+
+
+class SalesCube(object):
+    ''' Product, discount, and line item facts, loaded into NumPy column
+    arrays.
+
+    Attributes:
+        product_items (dict): columns ``user``, ``product``, ``category``,
+            ``status`` (the cart status), ``quantity``, and ``expires`` (when
+            the cart's reservation runs out). Whether an active cart is
+            reserved is worked out from ``expires`` each time the totals are
+            asked for, so the cube doesn't go stale as reservations expire.
+
+        discount_items (dict): columns ``user``, ``discount``, ``product``,
+            ``status``, ``quantity``, and ``expires``.
+
+        line_items (dict): columns ``description`` (an index into
+            ``descriptions``), ``price`` (in cents), and ``quantity``, for the
+            line items of paid invoices.
+
+        descriptions (numpy.ndarray): the distinct line item descriptions.
+
+    '''
+
+    def __init__(self):
+        products = inventory.Product.objects.select_related("category")
+        self.products = dict((product.id, product) for product in products)
+
+        self.discounts = dict(
+            conditions.DiscountBase.objects.values_list("id", "description")
+        )
+
+        product_items = commerce.ProductItem.objects.values_list(
+            "cart__user", "product", "product__category", "cart__status",
+            "quantity", "cart__time_last_updated",
+            "cart__reservation_duration",
+        )
+        self.product_items = _columns(
+            [_expiry(row) for row in product_items],
+            [
+                ("user", numpy.int32),
+                ("product", numpy.int32),
+                ("category", numpy.int32),
+                ("status", numpy.int8),
+                ("quantity", numpy.int32),
+                ("expires", "datetime64[us]"),
+            ],
+        )
+
+        discount_items = commerce.DiscountItem.objects.values_list(
+            "cart__user", "discount", "product", "cart__status",
+            "quantity", "cart__time_last_updated",
+            "cart__reservation_duration",
+        )
+        self.discount_items = _columns(
+            [_expiry(row) for row in discount_items],
+            [
+                ("user", numpy.int32),
+                ("discount", numpy.int32),
+                ("product", numpy.int32),
+                ("status", numpy.int8),
+                ("quantity", numpy.int32),
+                ("expires", "datetime64[us]"),
+            ],
+        )
+
+        line_items = list(commerce.LineItem.objects.filter(
+            invoice__status=commerce.Invoice.STATUS_PAID,
+        ).values_list("description", "price", "quantity"))
+        self.descriptions, description_codes = numpy.unique(
+            numpy.array([line[0] for line in line_items], dtype=object),
+            return_inverse=True,
+        )
+        self.line_items = _columns(
+            [
+                (code, int(line[1] * 100), line[2])
+                for code, line in zip(description_codes, line_items)
+            ],
+            [
+                ("description", numpy.int32),
+                ("price", numpy.int64),
+                ("quantity", numpy.int32),
+            ],
+        )
+
+    @staticmethod
+    def _totals_by_status(facts, key, mask):
+        ''' Sums the quantities of the selected facts, grouped by the key
+        column, and split up by cart status in the same way as
+        ``group_by_cart_status``.
+
+        Returns:
+            [(key, {total_name: total, ...}), ...], ordered by key.
+
+        '''
+
+        keys = facts[key][mask]
+        status = facts["status"][mask]
+        quantity = facts["quantity"][mask]
+
+        # Compared with the time now, as in Cart.reserved_carts()
+        now = numpy.datetime64(_time(timezone.now()), "us")
+        reserved = facts["expires"][mask] > now
+
+        groups, inverse = numpy.unique(keys, return_inverse=True)
+
+        active = status == commerce.Cart.STATUS_ACTIVE
+        selections = {
+            "total_paid": status == commerce.Cart.STATUS_PAID,
+            "total_refunded": status == commerce.Cart.STATUS_RELEASED,
+            "total_reserved": active & reserved,
+            "total_unreserved": active & ~reserved,
+        }
+
+        totals = dict(
+            (name, numpy.bincount(
+                inverse,
+                weights=numpy.where(selected, quantity, 0),
+                minlength=len(groups),
+            ))
+            for name, selected in selections.items()
+        )
+
+        return [
+            (int(group), dict(
+                (name, int(total[i])) for name, total in totals.items()
+            ))
+            for i, group in enumerate(groups)
+        ]
+
+    def product_totals(self, products=None, categories=None):
+        ''' Returns the cart status totals for each product that has been
+        added to a cart, in the same form as ``group_by_cart_status``.
+
+        Arguments:
+            products (Optional[[int, ...]]): product ids to include.
+            categories (Optional[[int, ...]]): include all products from
+                these category ids.
+
+        If neither products nor categories are given, all products are
+        included.
+
+        '''
+
+        facts = self.product_items
+        if products is None and categories is None:
+            mask = numpy.ones(len(facts["product"]), dtype=numpy.bool_)
+        else:
+            mask = (
+                numpy.in1d(facts["product"], list(products or [])) |
+                numpy.in1d(facts["category"], list(categories or []))
+            )
+
+        out = []
+        for product_id, totals in self._totals_by_status(
+                facts, "product", mask):
+            product = self.products[product_id]
+            totals.update({
+                "product": product_id,
+                "product__category__name": product.category.name,
+                "product__name": product.name,
+            })
+            out.append(totals)
+
+        def order(totals):
+            product = self.products[totals["product"]]
+            return (product.category.order, product.order, product.id)
+
+        out.sort(key=order)
+        return out
+
+    def discount_totals(self, discounts=None):
+        ''' Returns the cart status totals for each discount that has been
+        applied to a cart, in the same form as ``group_by_cart_status``.
+
+        Arguments:
+            discounts (Optional[[int, ...]]): discount ids to include. If not
+                given, all discounts are included.
+
+        '''
+
+        facts = self.discount_items
+        if discounts is None:
+            mask = numpy.ones(len(facts["discount"]), dtype=numpy.bool_)
+        else:
+            mask = numpy.in1d(facts["discount"], list(discounts))
+
+        out = []
+        for discount_id, totals in self._totals_by_status(
+                facts, "discount", mask):
+            totals.update({
+                "discount": discount_id,
+                "discount__description": self.discounts[discount_id],
+            })
+            out.append(totals)
+
+        return out
+
+    def items_sold(self):
+        ''' Returns the total quantity of each line item sold on paid
+        invoices, grouped by description and price, from the most expensive
+        to the least.
+
+        Returns:
+            [{"description", "price", "total_quantity"}, ...]
+
+        '''
+
+        facts = self.line_items
+        keys = numpy.column_stack([facts["price"], facts["description"]])
+        if not len(keys):
+            return []
+
+        groups, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+        quantities = numpy.bincount(inverse, weights=facts["quantity"])
+
+        out = [
+            {
+                "description": self.descriptions[description],
+                "price": Decimal(int(price)).scaleb(-2),
+                "total_quantity": int(quantities[i]),
+            }
+            for i, (price, description) in enumerate(groups)
+        ]
+
+        out.sort(key=lambda line: line["description"])
+        out.sort(key=lambda line: line["price"], reverse=True)
+        return out
@@ -49,6 +49,15 @@ class UserIdForm(forms.Form):
     )
 
 
+class AttendeeSearchForm(UserIdForm):
+
+    search = forms.CharField(
+        label="Search",
+        help_text="Name, email, company, username, or access code",
+        required=False,
+    )
+
+
 class ProposalKindForm(forms.Form):
 
     required_css_class = 'label-required'
@@ -78,6 +87,27 @@ class GroupByForm(forms.Form):
     )
 
 
+class GranularityForm(forms.Form):
+
+    required_css_class = 'label-required'
+
+    GRANULARITY_HOUR = "hour"
+    GRANULARITY_DAY = "day"
+    GRANULARITY_WEEK = "week"
+
+    choices = (
+        (GRANULARITY_DAY, "Day"),
+        (GRANULARITY_HOUR, "Hour"),
+        (GRANULARITY_WEEK, "Week"),
+    )
+
+    granularity = forms.ChoiceField(
+        label="Granularity",
+        choices=choices,
+        required=False,
+    )
+
+
 def model_fields_form_factory(model):
     ''' Creates a form for specifying fields from a model to display. '''
 
@@ -1,18 +1,216 @@
+import contextlib
 import csv
-
+import datetime
+import hashlib
+import json
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+
+from decimal import Decimal
+
+from django.conf import settings
 from django.contrib.auth.decorators import user_passes_test
+from django.db import connections
+from django.db import transaction
+from django.shortcuts import redirect
 from django.shortcuts import render
 from django.core.urlresolvers import reverse
+from django.template import loader
 from django.http import HttpResponse
+from django.http import HttpResponseNotModified
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.encoding import force_text
+from django.utils.http import http_date
+from django.utils.http import parse_http_date_safe
 from functools import wraps
+from multiprocessing.pool import ThreadPool
 
 from registrasion import views
+from registrasion.controllers.write_version import WriteVersionController
+
+from . import routers
+from . import timeouts
 
 
 ''' A list of report views objects that can be used to load a list of
 reports. '''
 _all_report_views = []
 
+logger = logging.getLogger(__name__)
+
+
+class ReportStatistics(object):
+    ''' Records the number of SQL queries, the time spent in the database,
+    and the wall time taken by one part of a report view.
+
+    Sections of a report are usually evaluated while the template renders, so
+    their statistics are only complete once rendering has finished.
+
+    Attributes:
+        name (str): The part of the report that was measured.
+        queries (int): The number of queries that were run.
+        db_time (float): Seconds spent waiting for those queries.
+        wall_time (float): Seconds spent overall.
+        timed_out (bool): Whether this part was stopped for taking longer
+            than the report's timeout.
+
+    '''
+
+    DEFAULT_THRESHOLDS = {
+        "queries": 50,
+        "db_time": 1.0,
+        "wall_time": 5.0,
+    }
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.db_time = 0.0
+        self.wall_time = 0.0
+        self.timed_out = False
+
+    @contextlib.contextmanager
+    def measure(self):
+        ''' Adds the queries and time spent inside this context to these
+        statistics. '''
+
+        with _count_queries(self):
+            start_time = time.time()
+            try:
+                yield
+            finally:
+                self.wall_time += time.time() - start_time
+
+    def add_query(self, db_time):
+        self.queries += 1
+        self.db_time += db_time
+
+    def thresholds(self):
+        thresholds = dict(self.DEFAULT_THRESHOLDS)
+        thresholds.update(
+            getattr(settings, "REPORT_STATISTICS_THRESHOLDS", {})
+        )
+        return thresholds
+
+    def exceeded(self):
+        ''' Returns the names of the statistics that are over the limits in
+        settings.REPORT_STATISTICS_THRESHOLDS. '''
+
+        thresholds = self.thresholds()
+        return [
+            name for name in ("queries", "db_time", "wall_time")
+            if thresholds.get(name) is not None and
+            getattr(self, name) > thresholds[name]
+        ]
+
+    @property
+    def is_slow(self):
+        return bool(self.exceeded())
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "queries": self.queries,
+            "db_time": round(self.db_time, 4),
+            "wall_time": round(self.wall_time, 4),
+            "exceeded": self.exceeded(),
+            "timed_out": self.timed_out,
+        }
+
+
+@contextlib.contextmanager
+def _count_queries(statistics):
+    ''' Wraps the cursors that this thread's connections make inside this
+    context, so that their queries are added to statistics. Unlike
+    connection.queries, this doesn't need debug cursors, and doesn't lose
+    queries once the query log is full. '''
+
+    saved = {}
+    for connection in connections.all():
+        saved[connection.alias] = connection.__dict__.get("_prepare_cursor")
+        connection._prepare_cursor = _counting(
+            connection._prepare_cursor, statistics,
+        )
+
+    try:
+        yield
+    finally:
+        for connection in connections.all():
+            if connection.alias not in saved:
+                continue
+            elif saved[connection.alias] is None:
+                del connection._prepare_cursor
+            else:
+                connection._prepare_cursor = saved[connection.alias]
+
+
+def _counting(prepare_cursor, statistics):
+    def _prepare_cursor(cursor):
+        return _QueryCountingCursor(prepare_cursor(cursor), statistics)
+    return _prepare_cursor
+
+
+class _QueryCountingCursor(object):
+    ''' Passes everything through to cursor, adding each query that it runs
+    to statistics. '''
+
+    def __init__(self, cursor, statistics):
+        self.cursor = cursor
+        self.statistics = statistics
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.cursor.__exit__(type, value, traceback)
+
+    def _timed(self, method, *a):
+        start = time.time()
+        try:
+            return method(*a)
+        finally:
+            self.statistics.add_query(time.time() - start)
+
+    def execute(self, sql, params=None):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+    def callproc(self, procname, params=None):
+        return self._timed(self.cursor.callproc, procname, params)
+
+
+def log_statistics(report_name, statistics):
+    ''' Logs the statistics for each part of a report. Parts that exceed
+    their thresholds, or that timed out, are logged as warnings. '''
+
+    for part in statistics:
+        fields = part.as_dict()
+        fields["report"] = report_name
+        if fields["exceeded"] or fields["timed_out"]:
+            level = logging.WARNING
+        else:
+            level = logging.INFO
+        logger.log(
+            level,
+            "report=%(report)s section=%(name)s queries=%(queries)d "
+            "db_time=%(db_time).4f wall_time=%(wall_time).4f "
+            "exceeded=%(exceeded)s timed_out=%(timed_out)s",
+            fields,
+            extra={"report_statistics": fields},
+        )
+
 
 class Report(object):
 
@@ -40,6 +238,12 @@ class Report(object):
         '''
         raise NotImplementedError
 
+    def evaluate(self, content_type):
+        ''' Returns this report, with all of its rows for content_type
+        computed. '''
+
+        return _EvaluatedReport(self, content_type)
+
     def _linked_text(self, content_type, address, text):
         '''
 
@@ -62,9 +266,23 @@ class _ReportTemplateWrapper(object):
     ''' Used internally to pass `Report` objects to templates. They effectively
     are used to specify the content_type for a report. '''
 
-    def __init__(self, content_type, report):
+    def __init__(self, content_type, report, database=None):
         self.content_type = content_type
         self.report = report
+        self.database = database
+        self.timed_out = False
+
+        if isinstance(report, DeferredReport):
+            # Don't compute the report just to find its title
+            self.statistics = ReportStatistics(report.name)
+        else:
+            self.statistics = ReportStatistics(report.title())
+
+    @contextlib.contextmanager
+    def _evaluating(self):
+        with routers.reporting_database(self.database):
+            with self.statistics.measure():
+                yield
 
     def title(self):
         return self.report.title()
@@ -73,10 +291,56 @@ class _ReportTemplateWrapper(object):
         return self.report.headings()
 
     def rows(self):
-        return self.report.rows(self.content_type)
+        # Evaluate each row in turn, so that streamed reports are measured
+        # and routed correctly.
+        with self._evaluating():
+            rows = iter(self.report.rows(self.content_type))
+
+        while True:
+            with self._evaluating():
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    return
+            yield row
 
     def count(self):
-        return self.report.count()
+        with self._evaluating():
+            return self.report.count()
+
+    def compute(self, timeout=None):
+        ''' Computes the report and all of its rows, ahead of rendering, and
+        returns the computed report.
+
+        Raises:
+            ReportTimedOut: if the report takes longer than timeout seconds.
+
+        '''
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._evaluating():
+            with timeouts.deadline(deadline, self.database):
+                return self.report.evaluate(self.content_type)
+
+    def evaluate(self, timeout=None):
+        ''' Computes the report ahead of rendering, or replaces it with a
+        notice if it takes longer than timeout seconds. '''
+
+        try:
+            self.set_report(self.compute(timeout))
+        except timeouts.ReportTimedOut:
+            self.time_out()
+
+    def set_report(self, report):
+        self.report = report
+        self.statistics.name = report.title()
+
+    def time_out(self):
+        ''' Replaces the report with a notice that it timed out. '''
+
+        self.timed_out = True
+        self.statistics.timed_out = True
+        self.report = _timed_out_report(self.statistics.name)
 
 
 class BasicReport(Report):
@@ -157,7 +421,12 @@ class QuerysetReport(BasicReport):
 
             return item
 
-        for row in self._queryset:
+        queryset = self._queryset
+        if not queryset._prefetch_related_lookups:
+            # Don't keep every row in memory; large reports are streamed.
+            queryset = queryset.iterator()
+
+        for row in queryset:
             yield [
                 self.cell_text(content_type, i, rgetattr(row, attribute))
                 for i, attribute in enumerate(self._attributes)
@@ -168,6 +437,125 @@ class QuerysetReport(BasicReport):
         return self._queryset.count()
 
 
+class IteratorReport(BasicReport):
+    ''' A report whose rows are produced on demand, so that very large reports
+    can be streamed rather than being built up in memory. '''
+
+    def __init__(self, title, headings, row_generator, count=None,
+                 link_view=None):
+        '''
+        Arguments:
+            row_generator (callable): Returns an iterator over the rows of
+                the report. It is called each time the rows are needed.
+
+            count (Optional[callable]): Returns the number of rows in the
+                report.
+
+        '''
+        super(IteratorReport, self).__init__(
+            title, headings, link_view=link_view
+        )
+        self._row_generator = row_generator
+        self._count = count
+
+    def rows(self, content_type):
+        for row in self._row_generator():
+            yield [
+                self.cell_text(content_type, i, cell)
+                for i, cell in enumerate(row)
+            ]
+
+    def count(self):
+        if self._count is None:
+            return sum(1 for row in self._row_generator())
+        return self._count()
+
+
+class SnapshotReport(BasicReport):
+    ''' A report whose rows were computed ahead of time and stored in a
+    ReportSnapshot. Rows are stored already rendered, both as HTML and as
+    plain text. '''
+
+    def __init__(self, title, headings, html_rows, text_rows):
+        super(SnapshotReport, self).__init__(title, headings)
+        self._html_rows = html_rows
+        self._text_rows = text_rows
+
+    def rows(self, content_type):
+        if content_type == "text/html":
+            return iter(self._html_rows)
+        else:
+            return iter(self._text_rows)
+
+    def count(self):
+        return len(self._html_rows)
+
+
+class DeferredReport(Report):
+    ''' A report that is computed by calling ``function(*a, **k)``, which
+    returns a Report. Report views can return several of these, so that
+    ReportViewRequestData can compute them at the same time (see
+    ``evaluate_reports``). '''
+
+    def __init__(self, function, *a, **k):
+        self.name = function.__name__
+        self._function = function
+        self._a = a
+        self._k = k
+        self._report = None
+
+    def report(self):
+        if self._report is None:
+            self._report = self._function(*self._a, **self._k)
+        return self._report
+
+    def evaluate(self, content_type):
+        ''' Returns the report, with all of its rows for content_type
+        computed. '''
+
+        return _EvaluatedReport(self.report(), content_type)
+
+    def title(self):
+        return self.report().title()
+
+    def headings(self):
+        return self.report().headings()
+
+    def rows(self, content_type):
+        return self.report().rows(content_type)
+
+    def count(self):
+        return self.report().count()
+
+
+class _EvaluatedReport(BasicReport):
+    ''' A report whose rows have already been computed for one content
+    type. Rows for other content types are computed as needed. '''
+
+    def __init__(self, report, content_type):
+        super(_EvaluatedReport, self).__init__(
+            report.title(), report.headings(),
+        )
+        self._report = report
+        self._content_type = content_type
+        self._rows = [list(row) for row in report.rows(content_type)]
+
+    def rows(self, content_type):
+        if content_type != self._content_type:
+            return self._report.rows(content_type)
+        return iter(self._rows)
+
+    def count(self):
+        return len(self._rows)
+
+
+def _timed_out_report(title):
+    return ListReport(title, [""], [[
+        "This took too long, and was stopped. Queue the report in the "
+        "background to see all of it."
+    ]])
+
+
 class Links(Report):
 
     def __init__(self, title, links):
@@ -195,7 +583,7 @@ class Links(Report):
     def count(self):
         return len(self._links)
 
-def report_view(title, form_type=None):
+def report_view(title, form_type=None, use_replica=True):
     ''' Decorator that converts a report view function into something that
     displays a Report.
 
@@ -205,15 +593,29 @@ def report_view(title, form_type=None):
         form_type (Optional[forms.Form]):
             A form class that can make this report display things. If not
             supplied, no form will be displayed.
+        use_replica (bool):
+            If True, this report reads from settings.REPORTING_DATABASE when
+            it is configured (see routers.py). Set this to False for reports
+            that must show live data.
 
     '''
 
     # Create & return view
     def _report(view):
-        report_view = ReportView(view, title, form_type)
-        report_view = user_passes_test(views._staff_only)(report_view)
+        inner_report_view = ReportView(
+            view, title, form_type, use_replica=use_replica,
+        )
+        report_view = user_passes_test(views._staff_only)(inner_report_view)
         report_view = wraps(view)(report_view)
 
+        # Reports only read data, and deferred reports are computed on other
+        # database connections, which can't see inside a request transaction.
+        report_view = transaction.non_atomic_requests(report_view)
+
+        # Keep the undecorated ReportView, so that reports can be computed
+        # outside of a request (see snapshots.py)
+        report_view.report_view = inner_report_view
+
         # Add this report to the list of reports.
         _all_report_views.append(report_view)
 
@@ -225,7 +627,7 @@ def report_view(title, form_type=None):
 class ReportView(object):
     ''' View objects that can render report data into HTML or CSV. '''
 
-    def __init__(self, inner_view, title, form_type):
+    def __init__(self, inner_view, title, form_type, use_replica=True):
         '''
 
         Arguments:
@@ -236,17 +638,90 @@ class ReportView(object):
 
             form_type: A Form class that can be used to query the report.
 
+            use_replica: Whether the report may read from the reporting
+                database, rather than the default database.
+
         '''
 
         # Consolidate form_type so it has content type and section
         self.inner_view = inner_view
         self.title = title
         self.form_type = form_type
+        self.use_replica = use_replica
+
+    # Content types that are served with ETag and Last-Modified headers.
+    CONDITIONAL_CONTENT_TYPES = ("application/json", "application/x-ndjson")
 
     def __call__(self, request, *a, **k):
+        if "snapshot" in request.GET:
+            return self.queue_snapshot(request)
+
+        conditional = (
+            request.GET.get("content_type") in self.CONDITIONAL_CONTENT_TYPES
+        )
+        if conditional and WriteVersionController.shared:
+            return self.conditional_render(request, *a, **k)
+
         data = ReportViewRequestData(self, request, *a, **k)
         return self.render(data)
 
+    def conditional_render(self, request, *a, **k):
+        ''' Renders the report with an ETag and Last-Modified derived from
+        the write version, so that clients polling the report get a
+        304 Not Modified, without the report being computed, if nothing has
+        changed since they last fetched it. Only used if the write version is
+        shared between server processes. '''
+
+        version = WriteVersionController.current()
+        last_changed = WriteVersionController.last_changed()
+        etag = self.etag(request, version, *a, **k)
+
+        if _not_modified(request, etag, last_changed):
+            response = HttpResponseNotModified()
+        else:
+            started = timezone.now()
+            data = ReportViewRequestData(self, request, *a, **k)
+            response = self.render(data)
+
+            lagging = data.as_of is not None and data.as_of < started
+            if data.timed_out or lagging:
+                # Incomplete or out of date, so clients shouldn't keep it.
+                return response
+
+        response["ETag"] = '"%s"' % etag
+        if last_changed is not None:
+            response["Last-Modified"] = http_date(last_changed)
+
+        return response
+
+    def etag(self, request, version, *a, **k):
+        ''' Returns an ETag for this report, with the parameters from
+        request, as of the given write version. '''
+
+        key = repr((
+            self.inner_view.__name__,
+            sorted(request.GET.lists()),
+            a,
+            sorted(k.items()),
+            version,
+        ))
+        return hashlib.md5(key.encode("utf8")).hexdigest()
+
+    def queue_snapshot(self, request):
+        ''' Queues this report, with the form parameters from request.GET,
+        to be computed in the background. Redirects to the snapshot. '''
+
+        # Local import to fix import cycles.
+        from . import snapshots
+
+        snapshot = snapshots.queue_snapshot(
+            self.inner_view.__name__,
+            snapshots.snapshot_query(request.GET),
+            request.user,
+        )
+
+        return redirect("report_snapshots", snapshot.id)
+
     def get_form(self, request):
 
         ''' Creates an instance of self.form_type using request.GET '''
@@ -263,13 +738,13 @@ class ReportView(object):
         return form
 
     @classmethod
-    def wrap_reports(cls, reports, content_type):
+    def wrap_reports(cls, reports, content_type, database=None):
         ''' Wraps the reports in a _ReportTemplateWrapper for the given
         content_type -- this allows data to be returned as HTML links, for
-        instance. '''
+        instance. The reports will read from the given database alias. '''
 
         reports = [
-            _ReportTemplateWrapper(content_type, report)
+            _ReportTemplateWrapper(content_type, report, database=database)
             for report in reports
         ]
 
@@ -287,36 +762,260 @@ class ReportView(object):
 
         '''
         renderers = {
+            "application/json": self._render_as_json,
+            "application/x-ndjson": self._render_as_ndjson,
             "text/csv": self._render_as_csv,
             "text/html": self._render_as_html,
             None: self._render_as_html,
         }
         render = renderers[data.content_type]
+
+        if render == self._render_as_html and "stream" in data.request.GET:
+            render = self._render_as_streaming_html
+
         return render(data)
 
-    def _render_as_html(self, data):
-        ctx = {
+    def _html_context(self, data, reports):
+        def url_with(parameter):
+            query = data.request.GET.copy()
+            query[parameter] = 1
+            return "?" + query.urlencode()
+
+        return {
             "title": self.title,
             "form": data.form,
-            "reports": data.reports,
+            "reports": reports,
+            "snapshot_url": url_with("snapshot"),
+            "stream_url": url_with("stream"),
+            "statistics": data.statistics,
+            "as_of": data.as_of,
+            "timed_out": data.timed_out,
         }
 
-        return render(data.request, "registrasion/report.html", ctx)
+    def _render_as_html(self, data):
+        ctx = self._html_context(data, data.reports)
+
+        response = render(data.request, "registrasion/report.html", ctx)
+        log_statistics(self.inner_view.__name__, data.statistics)
+
+        return response
+
+    def _render_as_streaming_html(self, data):
+        ''' Renders the page with placeholder reports, and then streams it
+        out, replacing each placeholder with the rows of the real report as
+        they are computed. Very large tables start arriving immediately, and
+        are never held in memory all at once.
+
+        Falls back to rendering the whole page if the template doesn't show
+        the placeholder rows as table rows.
+
+        '''
+
+        placeholders = [_PlaceholderReport(report) for report in data.reports]
+        ctx = self._html_context(data, placeholders)
+        page = loader.render_to_string(
+            "registrasion/report.html", ctx, request=data.request,
+        )
+
+        parts = _split_page(page, placeholders)
+        if parts is None:
+            return self._render_as_html(data)
+
+        def content():
+            yield parts[0]
+            for report, (row_template, after) in zip(data.reports, parts[1:]):
+                chunk = []
+                for row in report.rows():
+                    chunk.append(_render_row(row_template, row))
+                    if len(chunk) == self.STREAMING_CHUNK_SIZE:
+                        yield "".join(chunk)
+                        chunk = []
+                yield "".join(chunk) + after
+
+            log_statistics(self.inner_view.__name__, data.statistics)
+
+        return StreamingHttpResponse(content(), content_type="text/html")
+
+    # The number of table rows sent at a time by streaming HTML responses.
+    STREAMING_CHUNK_SIZE = 100
 
     def _render_as_csv(self, data):
         report = data.reports[data.section]
 
-        # Create the HttpResponse object with the appropriate CSV header.
-        response = HttpResponse(content_type='text/csv')
-
-        writer = csv.writer(response)
+        writer = csv.writer(_Echo())
         encode = lambda i: i.encode("utf8") if isinstance(i, unicode) else i  # NOQA
-        writer.writerow(list(encode(i) for i in report.headings()))
-        for row in report.rows():
-            writer.writerow(list(encode(i) for i in row))
+
+        def lines():
+            yield writer.writerow(list(encode(i) for i in report.headings()))
+            for row in report.rows():
+                yield writer.writerow(list(encode(i) for i in row))
+
+            statistics = [data.statistics[0], report.statistics]
+            log_statistics(self.inner_view.__name__, statistics)
+
+        # Stream the rows out as they're generated, so that large reports
+        # start downloading immediately.
+        response = StreamingHttpResponse(lines(), content_type='text/csv')
 
         return response
 
+    def _render_as_json(self, data):
+        document = {
+            "title": self.title,
+            "as_of": data.as_of,
+            "timed_out": data.timed_out,
+            "reports": [
+                {
+                    "section": section,
+                    "title": report.title(),
+                    "headings": report.headings(),
+                    "rows": list(report.rows()),
+                }
+                for section, report in data.sections()
+            ],
+        }
+
+        response = HttpResponse(
+            json.dumps(document, default=_json_value),
+            content_type="application/json",
+        )
+        log_statistics(self.inner_view.__name__, data.statistics)
+
+        return response
+
+    def _render_as_ndjson(self, data):
+        ''' Streams one JSON object per line: the title and headings of
+        each report, followed by each of its rows. '''
+
+        def line(value):
+            return json.dumps(value, default=_json_value) + "\n"
+
+        def lines():
+            for section, report in data.sections():
+                yield line({
+                    "section": section,
+                    "title": report.title(),
+                    "headings": report.headings(),
+                })
+                for row in report.rows():
+                    yield line({"section": section, "row": row})
+
+            log_statistics(self.inner_view.__name__, data.statistics)
+
+        return StreamingHttpResponse(
+            lines(), content_type="application/x-ndjson",
+        )
+
+
+class _PlaceholderReport(object):
+    ''' Stands in for a report while rendering a streamed page. It has a
+    single row with two marker cells, which show where the report's rows go,
+    and how the template lays out a row. '''
+
+    def __init__(self, report):
+        self.report = report
+        self.markers = ["stream-%s" % uuid.uuid4().hex for i in range(2)]
+
+    def title(self):
+        return self.report.title()
+
+    def headings(self):
+        return self.report.headings()
+
+    def rows(self):
+        return [self.markers]
+
+    def count(self):
+        return self.report.count()
+
+
+def _split_page(page, placeholders):
+    ''' Splits a page rendered with placeholder reports into the text
+    before the first report's rows, followed by a (row template, text after
+    the rows) pair for each report.
+
+    Row templates are (before the first cell, between cells, after the last
+    cell).
+
+    Returns:
+        None if a placeholder's row couldn't be found.
+
+    '''
+
+    parts = []
+    position = 0
+    for placeholder in placeholders:
+        first, second = placeholder.markers
+        first_at = page.find(first, position)
+        second_at = page.find(second, first_at)
+        start = page.rfind("<tr", position, first_at)
+        end = page.find("</tr>", second_at)
+        if min(first_at, second_at, start, end) == -1:
+            return None
+        end += len("</tr>")
+
+        row_template = (
+            page[start:first_at],
+            page[first_at + len(first):second_at],
+            page[second_at + len(second):end],
+        )
+        parts.append(page[position:start])
+        parts.append(row_template)
+        position = end
+
+    parts.append(page[position:])
+
+    # [before, row_template, between, ..., row_template, after]
+    return [parts[0]] + list(zip(parts[1::2], parts[2::2]))
+
+
+def _render_row(row_template, row):
+    ''' Lays out the cells of row in the same way that the template does.
+    Cells have already been rendered for HTML, so are written as-is. '''
+
+    before, between, after = row_template
+    return before + between.join(force_text(cell) for cell in row) + after
+
+
+def _json_value(value):
+    ''' Converts report cells that JSON can't represent directly. '''
+
+    if isinstance(value, Decimal):
+        # As a string, so that amounts aren't rounded
+        return str(value)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    else:
+        return force_text(value)
+
+
+def _not_modified(request, etag, last_changed):
+    ''' Returns True if the client making request already has the version
+    of a report with the given ETag and last change time. '''
+
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        etags = [i.strip() for i in if_none_match.split(",")]
+        return any(
+            i in ("*", '"%s"' % etag, 'W/"%s"' % etag) for i in etags
+        )
+
+    if_modified_since = parse_http_date_safe(
+        request.META.get("HTTP_IF_MODIFIED_SINCE", "")
+    )
+    if if_modified_since is not None and last_changed is not None:
+        return int(last_changed) <= if_modified_since
+
+    return False
+
+
+class _Echo(object):
+    ''' A file-like object that returns what's written to it, so that a
+    csv.writer can produce lines for a streaming response. '''
+
+    def write(self, value):
+        return value
+
 
 class ReportViewRequestData(object):
     '''
@@ -324,6 +1023,14 @@ class ReportViewRequestData(object):
     Attributes:
         form (Form): form based on request
         reports ([Report, ...]): The reports rendered from the request
+        statistics ([ReportStatistics, ...]): Statistics for calling the
+            report view, followed by the statistics for each report.
+        database (Optional[str]): The database alias the reports read from,
+            or None if they read from the default database.
+        as_of (Optional[datetime]): When reading from a replica, the time up
+            to which the replica is known to be current; otherwise None.
+        timed_out (bool): Whether any part of the report was stopped for
+            taking longer than its timeout (see timeouts.py).
 
     Arguments:
         report_view (ReportView): The ReportView to call back to.
@@ -336,8 +1043,13 @@ class ReportViewRequestData(object):
         self.report_view = report_view
         self.request = request
 
+        self.database, self.as_of = routers.choose_database(
+            report_view.use_replica,
+        )
+
         # Calculate other data
-        self.form = report_view.get_form(request)
+        with routers.reporting_database(self.database):
+            self.form = report_view.get_form(request)
 
         # Content type and section come from request.GET
         self.content_type = request.GET.get("content_type")
@@ -347,20 +1059,170 @@ class ReportViewRequestData(object):
         if self.content_type is None:
             self.content_type = "text/html"
 
+        # The view, and then each report it returns, may take up to timeout
+        # seconds.
+        timeout = self.timeout()
+        if timeout is None:
+            deadline = None
+        else:
+            deadline = time.time() + timeout
+
         # Reports come from calling the inner view
-        reports = report_view.inner_view(request, self.form, *a, **k)
+        view_statistics = ReportStatistics(report_view.title)
+        try:
+            with routers.reporting_database(self.database):
+                with view_statistics.measure():
+                    with timeouts.deadline(deadline, self.database):
+                        reports = report_view.inner_view(
+                            request, self.form, *a, **k
+                        )
+        except timeouts.ReportTimedOut:
+            view_statistics.timed_out = True
+            reports = _timed_out_report(report_view.title)
 
         # Normalise to a list
         if isinstance(reports, Report):
             reports = [reports]
 
         # Wrap them in appropriate format
-        reports = ReportView.wrap_reports(reports, self.content_type)
+        reports = ReportView.wrap_reports(
+            reports, self.content_type, database=self.database,
+        )
+
+        # Only the requested section is rendered, if one is given
+        if self.section is None:
+            evaluate_reports(reports, self.database, timeout)
+        else:
+            evaluate_reports(
+                reports[self.section:self.section + 1],
+                self.database,
+                timeout,
+            )
 
         self.reports = reports
+        self.statistics = [view_statistics]
+        self.statistics.extend(report.statistics for report in reports)
+        self.timed_out = any(i.timed_out for i in self.statistics)
+
+    def sections(self):
+        ''' Returns (index, report) for the requested section, or for every
+        report if no section was requested. '''
+
+        if self.section is None:
+            return list(enumerate(self.reports))
+        else:
+            return [(self.section, self.reports[self.section])]
+
+    def timeout(self):
+        ''' Returns the number of seconds that the report may take, or None
+        if it may take as long as it needs. '''
+
+        return timeouts.report_timeout(self.report_view.inner_view.__name__)
+
+
+def _remaining(at):
+    ''' Returns the number of seconds until the time ``at`` (as from
+    ``time.time()``), or None if there is no deadline. '''
+
+    return None if at is None else at - time.time()
+
+
+def _compute_in_thread(wrapper, at):
+    try:
+        # Sections that wait for a thread don't get any extra time
+        return wrapper.compute(_remaining(at))
+    finally:
+        # Each thread has its own database connections; don't leave them
+        # open between reports.
+        connections.close_all()
+
+
+def evaluate_reports(wrappers, database=None, timeout=None):
+    ''' Computes reports ahead of rendering. If there is more than one,
+    they are computed concurrently on a pool of up to settings.REPORT_THREADS
+    threads, each with its own database connection, so that a page of
+    reports takes as long as its slowest report, rather than all of them
+    added together.
+
+    Reports are computed one after another if REPORT_THREADS is 1 or less,
+    or if the current database connection is inside a transaction, as other
+    connections can't see data that hasn't been committed.
+
+    Every report must be finished within timeout seconds of this being
+    called. Reports computed concurrently are only waited for until then,
+    even if the database can't stop them. Each call has a pool of its own,
+    so a report that is stuck outside of the database only holds up its own
+    thread, which is left to finish on its own.
+
+    Arguments:
+        wrappers ([_ReportTemplateWrapper, ...]): the reports to compute.
+        database (Optional[str]): the database the reports read from.
+        timeout (Optional[float]): if given, every report is computed, and
+            reports that aren't finished within this many seconds are
+            replaced with a notice. Otherwise, only DeferredReports are
+            computed, and the rest are left to be computed as they render.
+
+    '''
+
+    if timeout is None:
+        pending = [
+            wrapper for wrapper in wrappers
+            if isinstance(wrapper.report, DeferredReport)
+        ]
+    else:
+        pending = list(wrappers)
+
+    at = None if timeout is None else time.time() + timeout
+
+    in_transaction = transaction.get_connection(database).in_atomic_block
+    threads = min(getattr(settings, "REPORT_THREADS", 4), len(pending))
+
+    if threads <= 1 or in_transaction:
+        for wrapper in pending:
+            wrapper.evaluate(_remaining(at))
+        return
+
+    pool = ThreadPool(threads)
+    try:
+        results = [
+            (wrapper, pool.apply_async(_compute_in_thread, (wrapper, at)))
+            for wrapper in pending
+        ]
+
+        for wrapper, result in results:
+            remaining = _remaining(at)
+            try:
+                # Reports that run past their timeout are usually stopped by
+                # the database, or by the watchdog. Reports that are stuck
+                # anywhere else are left to finish on their own.
+                report = result.get(
+                    None if remaining is None else max(0, remaining),
+                )
+            except (timeouts.ReportTimedOut, multiprocessing.TimeoutError):
+                wrapper.time_out()
+            else:
+                wrapper.set_report(report)
+    finally:
+        # Threads exit once they finish, without waiting for them here.
+        pool.close()
 
 
 def get_all_reports():
     ''' Returns all the views that have been registered with @report '''
 
     return list(_all_report_views)
+
+
+def get_report_view(name):
+    ''' Returns the ReportView for the report view with the given name.
+
+    Raises:
+        KeyError: if there is no report with that name.
+
+    '''
+
+    for report in _all_report_views:
+        if report.__name__ == name:
+            return report.report_view
+
+    raise KeyError(name)
@@ -0,0 +1,185 @@
+''' Sends the queries that reports make to a read replica, so that running
+reports doesn't slow down the database that's serving sales.
+
+To use a replica for reports, add it to your settings::
+
+    DATABASES = {
+        "default": {...},
+        "replica": {...},
+    }
+    DATABASE_ROUTERS = [
+        "registrasion.reporting.routers.ReportingRouter",
+    ]
+    REPORTING_DATABASE = "replica"
+
+    # Optional: use the primary database for reports if the replica is
+    # more than this many seconds behind it.
+    REPORTING_DATABASE_MAX_LAG = 300
+
+    # Optional: how many seconds to trust a check of the replica's lag before
+    # checking again (default 5). Checking compares the latest writes on both
+    # databases, so this keeps those queries off most report requests.
+    REPORTING_DATABASE_LAG_CHECK_INTERVAL = 5
+
+Reads are only routed to the replica while a report is being computed or
+rendered; everything else continues to use the default database.
+
+'''
+
+import contextlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Max
+from django.utils import timezone
+
+from registrasion.controllers.write_version import WriteVersionController
+from registrasion.models import commerce
+
+
+_state = threading.local()
+
+
+def current_database():
+    ''' Returns the database alias that reports are currently reading from,
+    or None if reads aren't being routed. '''
+
+    return getattr(_state, "alias", None)
+
+
+@contextlib.contextmanager
+def reporting_database(alias):
+    ''' Routes reads made inside this context to the database alias. If alias
+    is None, reads are routed as normal. '''
+
+    previous = current_database()
+    _state.alias = alias
+    try:
+        yield
+    finally:
+        _state.alias = previous
+
+
+class ReportingRouter(object):
+    ''' Database router that sends reads to the reporting database while
+    inside ``reporting_database()``. Writes always go to the default
+    database. '''
+
+    def db_for_read(self, model, **hints):
+        return current_database()
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set([DEFAULT_DB_ALIAS, _replica_alias()])
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+def _replica_alias():
+    return getattr(settings, "REPORTING_DATABASE", None)
+
+
+def _latest_write(using):
+    ''' Returns the time of the latest cart update or payment in the given
+    database. '''
+
+    cart = commerce.Cart.objects.using(using).aggregate(
+        latest=Max("time_last_updated"),
+    )["latest"]
+    payment = commerce.PaymentBase.objects.using(using).aggregate(
+        latest=Max("time"),
+    )["latest"]
+
+    times = [i for i in (cart, payment) if i is not None]
+    return max(times) if times else None
+
+
+def replica_as_of(alias):
+    ''' Works out how up to date the replica is, by comparing the latest
+    commerce writes it can see with those on the primary database.
+
+    Returns:
+        Optional[datetime]: the time up to which the replica is known to be
+            current. This is the current time if the replica has caught up,
+            or None if the replica has none of the primary's writes.
+
+    '''
+
+    primary = _latest_write(DEFAULT_DB_ALIAS)
+    replica = _latest_write(alias)
+
+    if primary is None or (replica is not None and replica >= primary):
+        return timezone.now()
+
+    return replica
+
+
+def _as_of_cache_key(alias):
+    return "registrasion:replica_as_of:%s" % alias
+
+
+def cached_replica_as_of(alias):
+    ''' Returns ``replica_as_of(alias)``, checking the databases at most once
+    per ``REPORTING_DATABASE_LAG_CHECK_INTERVAL`` seconds.
+
+    A replica that had caught up is still current if nothing has been written
+    since it was checked; otherwise, it is current as of the check. Other
+    processes' writes can only be seen if the write version is shared. '''
+
+    key = _as_of_cache_key(alias)
+    version = WriteVersionController.current()
+
+    cached = cache.get(key)
+    if cached is None:
+        checked = timezone.now()
+        as_of = replica_as_of(alias)
+        caught_up = as_of is not None and as_of >= checked
+        cached = (version, checked if caught_up else as_of, caught_up)
+
+        interval = getattr(
+            settings, "REPORTING_DATABASE_LAG_CHECK_INTERVAL", 5,
+        )
+        if interval:
+            cache.set(key, cached, interval)
+
+    checked_version, as_of, caught_up = cached
+    unchanged = WriteVersionController.shared and checked_version == version
+    if caught_up and unchanged:
+        return timezone.now()
+    return as_of
+
+
+def choose_database(use_replica=True):
+    ''' Decides which database a report should read from.
+
+    Returns:
+        (Optional[str], Optional[datetime]): the database alias to route
+            reads to, and the time the data is current as of. Both are None
+            if the report should read live data from the default database.
+
+    '''
+
+    alias = _replica_alias()
+    if not use_replica or alias is None or alias == DEFAULT_DB_ALIAS:
+        return None, None
+
+    as_of = cached_replica_as_of(alias)
+    if as_of is None:
+        # The replica is empty, or hasn't caught up with anything yet
+        return None, None
+
+    max_lag = getattr(settings, "REPORTING_DATABASE_MAX_LAG", None)
+    lag = timezone.now() - as_of
+    if max_lag is not None and lag.total_seconds() > max_lag:
+        # The replica is too far behind to be useful
+        return None, None
+
+    return alias, as_of
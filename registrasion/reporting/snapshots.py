@@ -0,0 +1,237 @@
+''' Computes reports in the background and stores their output as
+ReportSnapshots, so that staff can download slow reports once they are ready.
+
+Snapshots are queued by adding ``snapshot=1`` to a report's URL, and are
+computed by the ``report_snapshots`` management command. Reports listed in
+``settings.REPORT_SNAPSHOT_SCHEDULE`` are queued again by that command
+whenever their latest snapshot is older than the scheduled interval. For
+example::
+
+    REPORT_SNAPSHOT_SCHEDULE = [
+        # (report name, form parameters, interval in minutes)
+        ("manifest", "", 15),
+        ("attendee_data", "fields=name&fields=company", 30),
+    ]
+
+'''
+
+import datetime
+import json
+import traceback
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.urlresolvers import NoReverseMatch
+from django.core.urlresolvers import reverse
+from django.http import HttpRequest
+from django.http import QueryDict
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from registrasion.models import reporting
+
+from .reports import get_all_reports
+from .reports import get_report_view
+from .reports import ReportViewRequestData
+from .reports import SnapshotReport
+from .routers import reporting_database
+
+
+# Request parameters that change how a report is displayed, rather than
+# what it contains.
+_DISPLAY_PARAMETERS = ("content_type", "section", "snapshot", "stream")
+
+
+def snapshot_query(query_dict):
+    ''' Returns the URL-encoded form parameters from query_dict, leaving out
+    parameters that only affect how the report is displayed. '''
+
+    query = query_dict.copy()
+    for parameter in _DISPLAY_PARAMETERS:
+        query.pop(parameter, None)
+    return query.urlencode()
+
+
+def queue_snapshot(report, query, user=None):
+    ''' Queues a snapshot of the named report, computed with the given
+    URL-encoded form parameters. '''
+
+    if user is not None and not user.is_authenticated():
+        user = None
+
+    return reporting.ReportSnapshot.objects.create(
+        report=report,
+        query=query,
+        requested_by=user,
+    )
+
+
+def queue_scheduled_snapshots():
+    ''' Queues a snapshot of each report in settings.REPORT_SNAPSHOT_SCHEDULE
+    whose most recent snapshot was requested longer ago than its interval.
+
+    Returns:
+        [ReportSnapshot, ...]: the snapshots that were queued.
+
+    '''
+
+    schedule = getattr(settings, "REPORT_SNAPSHOT_SCHEDULE", ())
+    now = timezone.now()
+
+    queued = []
+    for report, query, minutes in schedule:
+        since = now - datetime.timedelta(minutes=minutes)
+        recent = reporting.ReportSnapshot.objects.filter(
+            report=report,
+            query=query,
+            requested_time__gt=since,
+        ).exclude(
+            status=reporting.ReportSnapshot.STATUS_FAILED,
+        )
+        if not recent.exists():
+            queued.append(queue_snapshot(report, query))
+
+    return queued
+
+
+def run_queued_snapshots():
+    ''' Computes every queued snapshot, oldest first.
+
+    Returns:
+        int: the number of snapshots that this call computed.
+
+    '''
+
+    queued = reporting.ReportSnapshot.objects.filter(
+        status=reporting.ReportSnapshot.STATUS_QUEUED,
+    ).order_by("requested_time")
+
+    return sum(1 for snapshot in queued if compute_snapshot(snapshot))
+
+
+def compute_snapshot(snapshot):
+    ''' Computes the report for snapshot, and stores its output.
+
+    Returns:
+        bool: False if the snapshot had already been claimed by another
+            worker, otherwise True.
+
+    '''
+
+    ReportSnapshot = reporting.ReportSnapshot
+
+    # Claim the snapshot, so that concurrent workers don't compute it twice.
+    claimed = ReportSnapshot.objects.filter(
+        id=snapshot.id,
+        status=ReportSnapshot.STATUS_QUEUED,
+    ).update(status=ReportSnapshot.STATUS_RUNNING)
+
+    if not claimed:
+        return False
+
+    try:
+        snapshot.content = json.dumps(_run_report(snapshot))
+        snapshot.status = ReportSnapshot.STATUS_DONE
+    except Exception:
+        snapshot.error = traceback.format_exc()
+        snapshot.status = ReportSnapshot.STATUS_FAILED
+
+    snapshot.completed_time = timezone.now()
+    snapshot.save()
+    return True
+
+
+def _run_report(snapshot):
+    ''' Runs the report view for snapshot outside of a request, and returns
+    each of its sections as a dict of title, headings, and rows. '''
+
+    report_view = get_report_view(snapshot.report)
+
+    path = _report_path(snapshot.report)
+    if path is None:
+        raise ValueError("Report %s has no URL" % snapshot.report)
+
+    request = _snapshot_request(snapshot, path)
+    data = _SnapshotRequestData(report_view, request)
+
+    sections = []
+    with reporting_database(data.database):
+        for wrapper in data.reports:
+            report = wrapper.report
+            sections.append({
+                "title": _cell(report.title()),
+                "headings": [_cell(heading) for heading in report.headings()],
+                "html": _rows(report, "text/html"),
+                "text": _rows(report, "text/csv"),
+            })
+
+    return sections
+
+
+def _report_path(name):
+    ''' Returns the path of the named report, or None if it has no URL. '''
+
+    for report in get_all_reports():
+        if report.__name__ == name:
+            try:
+                return reverse(report)
+            except NoReverseMatch:
+                return None
+
+
+def _snapshot_request(snapshot, path):
+    ''' Returns the request that would have been made to the report's URL,
+    so that reports can use anything a real request has. '''
+
+    request = HttpRequest()
+    request.method = "GET"
+    request.path = request.path_info = path
+    request.GET = QueryDict(snapshot.query)
+    request.META = {
+        "REQUEST_METHOD": "GET",
+        "QUERY_STRING": snapshot.query,
+        "SERVER_NAME": _server_name(),
+        "SERVER_PORT": "80",
+    }
+    request.user = snapshot.requested_by or AnonymousUser()
+    return request
+
+
+def _server_name():
+    ''' Returns a host that the site serves, for reports that build absolute
+    URLs from the request. '''
+
+    for host in settings.ALLOWED_HOSTS:
+        if host != "*" and not host.startswith("."):
+            return host
+    return "localhost"
+
+
+class _SnapshotRequestData(ReportViewRequestData):
+    ''' Snapshots are computed in the background so that they can take as
+    long as they need, so they don't time out. '''
+
+    def timeout(self):
+        return None
+
+
+def _rows(report, content_type):
+    return [[_cell(cell) for cell in row] for row in report.rows(content_type)]
+
+
+def _cell(value):
+    return "" if value is None else force_text(value)
+
+
+def snapshot_reports(snapshot):
+    ''' Returns the stored sections of a completed snapshot as Reports. '''
+
+    return [
+        SnapshotReport(
+            section["title"],
+            section["headings"],
+            section["html"],
+            section["text"],
+        )
+        for section in json.loads(snapshot.content)
+    ]
@@ -0,0 +1,153 @@
+''' Limits how long a report may spend in the database, so that a badly
+parameterised report can't hold database resources during a sale.
+
+Timeouts are set in seconds, for all reports or for individual report views.
+The report view may take up to the timeout, and then the sections of the
+report must all be finished within the timeout::
+
+    REPORT_TIMEOUT = 30
+    REPORT_TIMEOUTS = {
+        "attendee_data": 60,
+        "product_status": 20,
+    }
+
+On PostgreSQL and MySQL, the timeout is enforced by the database, as a
+statement timeout. On other databases, a watchdog thread interrupts the
+connection if the database supports it (SQLite does). Report sections that
+don't finish in time are shown with a notice, instead of the whole page
+hanging; the report can still be computed in full as a snapshot.
+
+Only database queries can be stopped. A report that is stuck anywhere else
+keeps its thread busy until it finishes, although the page doesn't wait for
+it if its sections are computed concurrently.
+
+'''
+
+import contextlib
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db import OperationalError
+from django.db import transaction
+
+
+class ReportTimedOut(Exception):
+    ''' Raised when a report takes longer than its timeout. '''
+    pass
+
+
+def report_timeout(name):
+    ''' Returns the timeout in seconds for the report view with the given
+    name, or None if it may run for as long as it needs. '''
+
+    timeouts = getattr(settings, "REPORT_TIMEOUTS", {})
+    if name in timeouts:
+        return timeouts[name]
+    return getattr(settings, "REPORT_TIMEOUT", None)
+
+
+@contextlib.contextmanager
+def deadline(at, using=None):
+    ''' Stops database queries made inside this context from running past
+    the time ``at`` (as from ``time.time()``). If ``at`` is None, queries
+    may run for as long as they need.
+
+    Raises:
+        ReportTimedOut: if ``at`` has already passed, or if the database
+            cancelled a query because it ran past ``at``.
+
+    '''
+
+    if at is None:
+        yield
+        return
+
+    remaining = at - time.time()
+    if remaining <= 0:
+        raise ReportTimedOut()
+
+    connection = connections[using or "default"]
+    try:
+        with _statement_timeout(connection, remaining):
+            yield
+    except OperationalError:
+        if time.time() < at:
+            raise
+        raise ReportTimedOut()
+
+
+@contextlib.contextmanager
+def _statement_timeout(connection, seconds):
+    milliseconds = max(1, int(seconds * 1000))
+
+    if connection.vendor == "postgresql":
+        # A cancelled query aborts the transaction, so the timeout is set in
+        # a savepoint (or a transaction of its own), which undoes it if the
+        # query is cancelled.
+        with transaction.atomic(using=connection.alias):
+            _execute(
+                connection, "SET LOCAL statement_timeout = %d" % milliseconds,
+            )
+            yield
+            _execute(connection, "SET LOCAL statement_timeout = DEFAULT")
+
+    elif connection.vendor == "mysql":
+        # Only applies to SELECT statements, which is all reports run.
+        _execute(
+            connection, "SET SESSION max_execution_time = %d" % milliseconds,
+        )
+        try:
+            yield
+        finally:
+            _execute(connection, "SET SESSION max_execution_time = DEFAULT")
+
+    else:
+        with _watchdog(connection, seconds):
+            yield
+
+
+def _execute(connection, sql):
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+
+
+# How often the watchdog interrupts a connection once its time is up.
+_INTERRUPT_INTERVAL = 0.1
+
+
+@contextlib.contextmanager
+def _watchdog(connection, seconds):
+    ''' Interrupts whatever query the connection is running once seconds
+    have passed, if the database driver supports it. The connection is
+    interrupted again every _INTERRUPT_INTERVAL seconds until the context
+    exits, so that queries made after an interrupted one are stopped too. '''
+
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def interrupt():
+        database = connection.connection
+        if database is not None and hasattr(database, "interrupt"):
+            database.interrupt()
+
+    def watch():
+        if done.wait(seconds):
+            return
+        while True:
+            # Don't interrupt queries made after the context exits
+            with lock:
+                if done.is_set():
+                    return
+                interrupt()
+            done.wait(_INTERRUPT_INTERVAL)
+
+    watcher = threading.Thread(target=watch)
+    watcher.daemon = True
+    watcher.start()
+    try:
+        yield
+    finally:
+        with lock:
+            done.set()
@@ -1,4 +1,5 @@
 from . import forms
+from . import snapshots
 
 import collections
 import datetime
@@ -9,24 +10,29 @@ from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.db import models
-from django.db.models import F, Q
-from django.db.models import Count, Max, Sum
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models import Count, Sum
 from django.db.models import Case, When, Value
+from django.db.models.functions import Coalesce, Lower, Trunc
 from django.db.models.fields.related import RelatedField
 from django.db.models.fields import CharField
+from django.shortcuts import get_object_or_404
 from django.shortcuts import render
 
-from registrasion.controllers.cart import CartController
-from registrasion.controllers.item import ItemController
+from registrasion.controllers.search import AttendeeSearchController
 from registrasion.models import conditions
 from registrasion.models import commerce
 from registrasion.models import people
+from registrasion.models import reporting
 from registrasion import util
 from registrasion import views
 
 from symposion.schedule import models as schedule_models
 
+from .cube import sales_cube
+from .reports import DeferredReport
 from .reports import get_all_reports
+from .reports import IteratorReport
 from .reports import Links
 from .reports import ListReport
 from .reports import QuerysetReport
@@ -41,6 +47,32 @@ def CURRENCY():
 AttendeeProfile = util.get_object_from_name(settings.ATTENDEE_PROFILE_MODEL)
 
 
+def _attendee_name_path(user_path):
+    ''' Returns a lookup path that follows ``user_path`` (the path to a User)
+    to the name field of that user's attendee profile, so that attendee names
+    can be fetched in the same query as the rest of a report. '''
+
+    name_field = AttendeeProfile.name_field()
+    if name_field is None:
+        return user_path + "__username"
+
+    # Walk from the concrete profile model up to AttendeeProfileBase
+    subclass_path = []
+    model = AttendeeProfile
+    while model is not people.AttendeeProfileBase:
+        parent, link = next(
+            (parent, link) for parent, link in model._meta.parents.items()
+            if issubclass(parent, people.AttendeeProfileBase)
+        )
+        subclass_path.insert(0, link.related_query_name())
+        model = parent
+
+    path = [user_path, "attendee", "attendeeprofilebase"]
+    path += subclass_path
+    path.append(name_field)
+    return "__".join(path)
+
+
 @user_passes_test(views._staff_only)
 def reports_list(request):
     ''' Lists all of the reports currently available. '''
@@ -71,10 +103,10 @@ def reconciliation(request, form):
     refunds into the system. '''
 
     return [
-        sales_payment_summary(),
-        items_sold(),
-        payments(),
-        credit_note_refunds(),
+        DeferredReport(sales_payment_summary),
+        DeferredReport(items_sold),
+        DeferredReport(payments),
+        DeferredReport(credit_note_refunds),
     ]
 
 
@@ -85,18 +117,20 @@ def items_sold():
     data = None
     headings = None
 
-    line_items = commerce.LineItem.objects.filter(
-        invoice__status=commerce.Invoice.STATUS_PAID,
-    ).select_related("invoice")
-
-    line_items = line_items.order_by(
-        # sqlite requires an order_by for .values() to work
-        "-price", "description",
-    ).values(
-        "price", "description",
-    ).annotate(
-        total_quantity=Sum("quantity"),
-    )
+    cube = sales_cube()
+    if cube is not None:
+        line_items = cube.items_sold()
+    else:
+        line_items = commerce.LineItem.objects.filter(
+            invoice__status=commerce.Invoice.STATUS_PAID,
+        ).order_by(
+            # sqlite requires an order_by for .values() to work
+            "-price", "description",
+        ).values(
+            "price", "description",
+        ).annotate(
+            total_quantity=Sum("quantity"),
+        )
 
     headings = ["Description", "Quantity", "Price", "Total"]
 
@@ -184,7 +218,9 @@ def payments():
 
 def credit_note_refunds():
     ''' Shows all of the credit notes that have been generated. '''
-    notes_refunded = commerce.CreditNote.refunded()
+    notes_refunded = commerce.CreditNote.refunded().select_related(
+        "creditnoterefund",
+    )
     return QuerysetReport(
         "Credit note refunds",
         ["id", "creditnoterefund__reference", "amount"],
@@ -243,78 +279,158 @@ def group_by_cart_status(queryset, order, values):
     return values
 
 
-@report_view("Limits")
-def limits(request, form):
-    ''' Shows the summary of sales against stock limits. '''
+def product_usage(products=None, categories=None):
+    ''' Returns the cart status totals (see ``group_by_cart_status``) of each
+    product in products, or in categories. Includes every product if neither
+    is given. '''
 
-    line_items = commerce.ProductItem.objects.filter(
-        cart__status=commerce.Invoice.STATUS_PAID,
-    ).values(
-        "product", "product__name",
-    ).annotate(
-        total_quantity=Sum("quantity")
+    cube = sales_cube()
+    if cube is not None:
+        return cube.product_totals(
+            products=_ids(products),
+            categories=_ids(categories),
+        )
+
+    items = commerce.ProductItem.objects.all()
+    if products is not None or categories is not None:
+        items = items.filter(
+            Q(product__in=products or []) |
+            Q(product__category__in=categories or []),
+        )
+
+    return group_by_cart_status(
+        items,
+        ["product__category__order", "product__order"],
+        ["product", "product__category__name", "product__name"],
+    )
+
+
+def discount_usage(discounts=None):
+    ''' Returns the cart status totals (see ``group_by_cart_status``) of each
+    discount in discounts, or of every discount if not given. '''
+
+    cube = sales_cube()
+    if cube is not None:
+        return cube.discount_totals(discounts=_ids(discounts))
+
+    items = commerce.DiscountItem.objects.all()
+    if discounts is not None:
+        items = items.filter(discount__in=discounts)
+
+    return group_by_cart_status(
+        items,
+        ["discount"],
+        ["discount", "discount__description"],
     )
 
-    quantities = collections.defaultdict(int)
-    for line_item in line_items.all():
-        quantities[line_item['product__name']] += line_item['total_quantity']
+
+def _ids(objects):
+    ''' Returns the ids of a collection of model instances or ids. '''
+
+    if objects is None:
+        return None
+    return [getattr(i, "id", i) for i in objects]
+
+
+def _limit_description(condition):
+    ''' Returns the description of a (possibly) time-limited condition,
+    including its start and end times. '''
+
+    description = condition.description
+    extras = []
+    if getattr(condition, 'start_time', None):
+        extras.append('Starts: %s' % (condition.start_time))
+
+    if getattr(condition, 'end_time', None):
+        extras.append('Ends: %s' % (condition.end_time))
+
+    if extras:
+        description += ' (' + ', '.join(extras) + ')'
+
+    return description
+
+
+def _limit_usage(used, limit):
+    if limit:
+        return '%s/%s' % (used, limit)
+    else:
+        return used
+
+
+@report_view("Limits")
+def limits(request, form):
+    ''' Shows the summary of sales and reservations against stock limits. '''
 
     limits = conditions.TimeOrStockLimitFlag.objects.all().order_by("-limit")
+    limits = list(limits)
+
+    # Work out which products fall under each limit, either directly, or
+    # through their category.
+    products_by_limit = collections.defaultdict(set)
+    by_product = conditions.TimeOrStockLimitFlag.objects.filter(
+        products__isnull=False,
+    ).values_list("id", "products")
+    by_category = conditions.TimeOrStockLimitFlag.objects.filter(
+        categories__product__isnull=False,
+    ).values_list("id", "categories__product")
+    for limit_id, product_id in itertools.chain(by_product, by_category):
+        products_by_limit[limit_id].add(product_id)
+
+    all_products = set(itertools.chain(*products_by_limit.values()))
+
+    # Get the usage of all of those products in one hit.
+    items = product_usage(products=all_products)
 
-    headings = ["Product", "Quantity"]
+    headings = ["Product", "Paid", "Reserved", "Used"]
 
     reports = []
     for limit in limits:
         data = []
-        total = 0
-        for product in limit.products.all():
-            if product.name in quantities:
-                total += quantities[product.name]
-                data.append([product.name, quantities[product.name]])
-        if limit.limit:
-            data.append(['(TOTAL)', '%s/%s' % (total, limit.limit)])
-        else:
-            data.append(['(TOTAL)', total])
-
-        description = limit.description
-        extras = []
-        if limit.start_time:
-            extras.append('Starts: %s' % (limit.start_time))
-
-        if limit.end_time:
-            extras.append('Ends: %s' % (limit.end_time))
+        total_paid = 0
+        total_reserved = 0
+        products = products_by_limit[limit.id]
+        for item in items:
+            if item["product"] not in products:
+                continue
+            total_paid += item["total_paid"]
+            total_reserved += item["total_reserved"]
+            data.append([
+                "%s - %s" % (
+                    item["product__category__name"], item["product__name"]
+                ),
+                item["total_paid"],
+                item["total_reserved"],
+                item["total_paid"] + item["total_reserved"],
+            ])
 
-        if extras:
-            description += ' (' + ', '.join(extras) + ')'
+        used = total_paid + total_reserved
+        data.append([
+            '(TOTAL)', total_paid, total_reserved,
+            _limit_usage(used, limit.limit),
+        ])
 
-        reports.append(ListReport(description, headings, data))
+        reports.append(ListReport(_limit_description(limit), headings, data))
 
     # now get discount items
-    discount_items = conditions.DiscountBase.objects.select_subclasses()
-
-    data = []
-    for discount in discount_items.all():
-        quantity = 0
-        for item in discount.discountitem_set.filter(cart__status=2):
-            quantity += item.quantity
-
-        description = discount.description
-        extras = []
-        if getattr(discount, 'start_time', None):
-            extras.append('Starts: %s' % (discount.start_time))
+    discounts = conditions.DiscountBase.objects.select_subclasses()
 
-        if getattr(discount, 'end_time', None):
-            extras.append('Ends: %s' % (discount.end_time))
+    usage = dict((item["discount"], item) for item in discount_usage())
 
-        if extras:
-            description += ' (' + ', '.join(extras) + ')'
+    data = []
+    for discount in discounts:
+        paid = reserved = 0
+        if discount.id in usage:
+            paid = usage[discount.id]["total_paid"]
+            reserved = usage[discount.id]["total_reserved"]
 
-        if getattr(discount, 'limit', None):
-            data.append([description, '%s/%s' % (quantity, discount.limit)])
-        else:
-            data.append([description, quantity])
+        data.append([
+            _limit_description(discount),
+            paid,
+            reserved,
+            _limit_usage(paid + reserved, getattr(discount, 'limit', None)),
+        ])
 
-    headings = ["Discount", "Quantity"]
+    headings = ["Discount", "Paid", "Reserved", "Used"]
     reports.append(ListReport('Discounts', headings, data))
 
     return reports
@@ -328,15 +444,7 @@ def product_status(request, form):
     products = form.cleaned_data["product"]
     categories = form.cleaned_data["category"]
 
-    items = commerce.ProductItem.objects.filter(
-        Q(product__in=products) | Q(product__category__in=categories),
-    ).select_related("cart", "product")
-
-    items = group_by_cart_status(
-        items,
-        ["product__category__order", "product__order"],
-        ["product", "product__category__name", "product__name"],
-    )
+    items = product_usage(products=products, categories=categories)
 
     headings = [
         "Product", "Paid", "Reserved", "Unreserved", "Refunded",
@@ -363,15 +471,7 @@ def discount_status(request, form):
 
     discounts = form.cleaned_data["discount"]
 
-    items = commerce.DiscountItem.objects.filter(
-        Q(discount__in=discounts),
-    ).select_related("cart", "product", "product__category")
-
-    items = group_by_cart_status(
-        items,
-        ["discount"],
-        ["discount", "discount__description"],
-    )
+    items = discount_usage(discounts=discounts)
 
     headings = [
         "Discount", "Paid", "Reserved", "Unreserved", "Refunded",
@@ -398,54 +498,64 @@ def product_line_items(request, form):
     products = form.cleaned_data["product"]
     categories = form.cleaned_data["category"]
 
-    invoices = commerce.Invoice.objects.filter(
-        (
-            Q(lineitem__product__in=products) |
-            Q(lineitem__product__category__in=categories)
-        ),
-        status=commerce.Invoice.STATUS_PAID,
-    ).select_related(
-        "cart",
-        "user",
-        "user__attendee",
-        "user__attendee__attendeeprofilebase"
-    ).order_by("issue_time").distinct()
+    items = commerce.ProductItem.objects.filter(
+        Q(product__in=products) | Q(product__category__in=categories),
+        cart__invoice__status=commerce.Invoice.STATUS_PAID,
+    ).annotate(
+        attendee_name=F(_attendee_name_path("cart__user")),
+    ).order_by(
+        "cart__invoice__issue_time",
+        "cart__invoice__id",
+        "product",
+    ).values(
+        "cart__invoice__id",
+        "cart__invoice__issue_time",
+        "cart__status",
+        "attendee_name",
+        "quantity",
+        "product__name",
+        "product__category__name",
+    )
 
     headings = [
         'Invoice', 'Invoice Date', 'Attendee', 'Qty', 'Product', 'Status'
     ]
 
+    statuses = {
+        commerce.Cart.STATUS_PAID: 'PAID',
+        commerce.Cart.STATUS_ACTIVE: 'UNPAID',
+        commerce.Cart.STATUS_RELEASED: 'REFUNDED',
+    }
+
     data = []
-    for invoice in invoices:
-        for item in invoice.cart.productitem_set.all():
-            if item.product in products or item.product.category in categories:
-                output = []
-                output.append(invoice.id)
-                output.append(invoice.issue_time.strftime('%Y-%m-%d %H:%M:%S'))
-                output.append(
-                    invoice.user.attendee.attendeeprofilebase.attendee_name()
-                )
-                output.append(item.quantity)
-                output.append(item.product)
-                cart = invoice.cart
-                if cart.status == commerce.Cart.STATUS_PAID:
-                    output.append('PAID')
-                elif cart.status == commerce.Cart.STATUS_ACTIVE:
-                    output.append('UNPAID')
-                elif cart.status == commerce.Cart.STATUS_RELEASED:
-                    output.append('REFUNDED')
-                data.append(output)
+    for item in items:
+        data.append([
+            item["cart__invoice__id"],
+            item["cart__invoice__issue_time"].strftime('%Y-%m-%d %H:%M:%S'),
+            item["attendee_name"],
+            item["quantity"],
+            "%s - %s" % (
+                item["product__category__name"], item["product__name"]
+            ),
+            statuses.get(item["cart__status"]),
+        ])
 
     return ListReport("Line Items", headings, data)
 
 
-@report_view("Paid invoices by date", form_type=forms.ProductAndCategoryForm)
+@report_view(
+    "Paid invoices by date",
+    form_type=forms.mix_form(
+        forms.ProductAndCategoryForm, forms.GranularityForm,
+    ),
+)
 def paid_invoices_by_date(request, form):
     ''' Shows the number of paid invoices containing given products or
-    categories per day. '''
+    categories per hour, day, or week, along with a running total. '''
 
     products = form.cleaned_data["product"]
     categories = form.cleaned_data["category"]
+    granularity = form.cleaned_data["granularity"]
 
     invoices = commerce.Invoice.objects.filter(
         (
@@ -455,37 +565,46 @@ def paid_invoices_by_date(request, form):
         status=commerce.Invoice.STATUS_PAID,
     )
 
-    # Invoices with payments will be paid at the time of their latest payment
-    payments = commerce.PaymentBase.objects.all()
-    payments = payments.filter(
-        invoice__in=invoices,
-    )
-    payments = payments.order_by("invoice")
-    invoice_max_time = payments.values("invoice").annotate(
-        max_time=Max("time")
-    )
-
+    # Invoices with payments will be paid at the time of their latest payment.
     # Zero-value invoices will have no payments, so they're paid at issue time
-    zero_value_invoices = invoices.filter(value=0).distinct()
+    latest_payment = commerce.PaymentBase.objects.filter(
+        invoice=OuterRef("pk"),
+    ).order_by("-time").values("time")[:1]
+
+    # Weeks are rolled up from days below, as not every supported database
+    # backend can truncate to weeks.
+    if granularity == forms.GranularityForm.GRANULARITY_HOUR:
+        kind, date_format = "hour", "%Y-%m-%d %H:00"
+    else:
+        kind, date_format = "day", "%Y-%m-%d"
 
-    times = itertools.chain(
-        (line["max_time"] for line in invoice_max_time),
-        (invoice.issue_time for invoice in zero_value_invoices),
-    )
+    buckets = commerce.Invoice.objects.filter(
+        id__in=invoices.values("id"),
+    ).annotate(
+        paid_time=Coalesce(
+            Subquery(latest_payment, output_field=models.DateTimeField()),
+            "issue_time",
+        ),
+    ).annotate(
+        bucket=Trunc("paid_time", kind, output_field=models.DateTimeField()),
+    ).order_by("bucket").values("bucket").annotate(count=Count("id"))
 
-    by_date = collections.defaultdict(int)
-    for time in times:
-        date = datetime.datetime(
-            year=time.year, month=time.month, day=time.day
-        )
-        by_date[date] += 1
+    by_date = collections.OrderedDict()
+    for line in buckets:
+        date_ = line["bucket"]
+        if granularity == forms.GranularityForm.GRANULARITY_WEEK:
+            date_ = date_ - datetime.timedelta(days=date_.weekday())
+        by_date[date_] = by_date.get(date_, 0) + line["count"]
 
-    data = [(date_, count) for date_, count in sorted(by_date.items())]
-    data = [(date_.strftime("%Y-%m-%d"), count) for date_, count in data]
+    data = []
+    total = 0
+    for date_, count in by_date.items():
+        total += count
+        data.append((date_.strftime(date_format), count, total))
 
     return ListReport(
         "Paid Invoices By Date",
-        ["date", "count"],
+        ["date", "count", "cumulative"],
         data,
     )
 
@@ -494,20 +613,21 @@ def paid_invoices_by_date(request, form):
 def credit_notes(request, form):
     ''' Shows all of the credit notes in the system. '''
 
-    notes = commerce.CreditNote.objects.all().select_related(
-        "creditnoterefund",
-        "creditnoteapplication",
-        "invoice",
-        "invoice__user__attendee__attendeeprofilebase",
+    notes = commerce.CreditNote.objects.with_status().select_related(
+        "invoice__user__attendee",
+    ).prefetch_related(
+        people.AttendeeProfileBase.prefetch(
+            "invoice__user__attendee__attendeeprofilebase",
+        ),
     )
 
     return QuerysetReport(
         "Credit Notes",
         ["id",
          "invoice__user__attendee__attendeeprofilebase__invoice_recipient",
-         "status", "value"],
+         "status", "value", "remaining_value"],
         notes,
-        headings=["id", "Owner", "Status", "Value"],
+        headings=["id", "Owner", "Status", "Value", "Unclaimed Value"],
         link_view=views.credit_note,
     )
 
@@ -527,36 +647,147 @@ def invoices(request, form):
     )
 
 
-class AttendeeListReport(ListReport):
+class _AttendeeLinks(object):
+    ''' Links the user ID in the first column to the attendee report. '''
 
     def get_link(self, argument):
         return reverse(self._link_view) + "?user=%d" % int(argument)
 
 
-@report_view("Attendee", form_type=forms.UserIdForm)
+class AttendeeListReport(_AttendeeLinks, ListReport):
+    pass
+
+
+class AttendeeIteratorReport(_AttendeeLinks, IteratorReport):
+    pass
+
+
+_AttendeeLedger = collections.namedtuple(
+    "_AttendeeLedger",
+    [
+        "attendee", "profile", "cart", "paid", "unpaid", "invoices",
+        "credit_notes", "payments",
+    ],
+)
+
+
+def _attendee_ledger(user_id):
+    ''' Fetches everything the attendee report needs to know about a user in
+    a fixed number of queries. Unlike ``CartController.for_user``, this never
+    creates a cart for the user.
+
+    Returns:
+        _AttendeeLedger: the attendee; their profile (or None); their active
+            cart (or None); lists of (product, quantity) pairs for their paid
+            and unpaid items; and lists of their invoices, credit notes, and
+            payments.
+
+    '''
+
+    attendee = people.Attendee.objects.select_related("user").get(
+        user__id=user_id,
+    )
+    user = attendee.user
+
+    related = []
+    many_to_many = []
+    for field in AttendeeProfile._meta.get_fields():
+        if not field.concrete or field.auto_created:
+            continue
+        elif field.many_to_many:
+            many_to_many.append(field.name)
+        elif field.is_relation:
+            related.append(field.name)
+
+    profile = AttendeeProfile.objects.filter(
+        attendee=attendee,
+    ).select_related(
+        "attendee__user", *related
+    ).prefetch_related(
+        *many_to_many
+    ).first()
+
+    cart = commerce.Cart.objects.filter(
+        user=user,
+        status=commerce.Cart.STATUS_ACTIVE,
+    ).first()
+
+    items = commerce.ProductItem.objects.filter(
+        cart__user=user,
+        cart__status__in=[
+            commerce.Cart.STATUS_PAID, commerce.Cart.STATUS_ACTIVE,
+        ],
+    ).select_related(
+        "cart", "product", "product__category",
+    ).order_by(
+        "product__category__order", "product__order", "product",
+    )
+
+    quantities = {
+        commerce.Cart.STATUS_PAID: collections.OrderedDict(),
+        commerce.Cart.STATUS_ACTIVE: collections.OrderedDict(),
+    }
+    for item in items:
+        by_product = quantities[item.cart.status]
+        by_product[item.product] = (
+            by_product.get(item.product, 0) + item.quantity
+        )
+
+    def product_quantities(status):
+        return [
+            (product, quantity)
+            for product, quantity in quantities[status].items()
+            if quantity > 0
+        ]
+
+    invoices = commerce.Invoice.objects.filter(user=user).order_by("id")
+
+    credit_notes = commerce.CreditNote.objects.with_status().filter(
+        invoice__user=user,
+    ).order_by("id")
+
+    payments = commerce.PaymentBase.objects.filter(
+        invoice__user=user,
+    ).select_related("invoice").order_by("time", "id")
+
+    return _AttendeeLedger(
+        attendee=attendee,
+        profile=profile,
+        cart=cart,
+        paid=product_quantities(commerce.Cart.STATUS_PAID),
+        unpaid=product_quantities(commerce.Cart.STATUS_ACTIVE),
+        invoices=list(invoices),
+        credit_notes=list(credit_notes),
+        payments=list(payments),
+    )
+
+
+@report_view("Attendee", form_type=forms.AttendeeSearchForm)
 def attendee(request, form, user_id=None):
     ''' Returns a list of all manifested attendees if no attendee is specified,
-    else displays the attendee manifest. '''
+    or the attendees that best match a search, else displays the attendee
+    manifest. '''
 
     if user_id is None and form.cleaned_data["user"] is not None:
         user_id = form.cleaned_data["user"]
 
+    if user_id is None and form.cleaned_data.get("search"):
+        return attendee_search(request, form.cleaned_data["search"])
+
     if user_id is None:
         return attendee_list(request)
 
+    ledger = _attendee_ledger(user_id)
+    profile = ledger.profile
+
     reports = []
 
     profile_data = []
-    try:
-        attendee = people.Attendee.objects.get(user__id=user_id)
-        name = attendee.attendeeprofilebase.attendee_name()
-
-        profile = people.AttendeeProfileBase.objects.get_subclass(
-            attendee=attendee
-        )
+    if profile is not None:
+        name = getattr(profile, profile.name_field())
         fields = profile._meta.get_fields()
-    except people.AttendeeProfileBase.DoesNotExist:
-        name = attendee.user.username
+    else:
+        name = ledger.attendee.user.username
         fields = []
 
     exclude = set(["attendeeprofilebase_ptr", "id"])
@@ -575,11 +806,11 @@ def attendee(request, form, user_id=None):
 
         profile_data.append((field.verbose_name, value))
 
-    cart = CartController.for_user(attendee.user)
-    try:
-        reservation = cart.cart.reservation_duration + cart.cart.time_last_updated
-    except AttributeError:  # No reservation_duration set -- default to 24h
-        reservation = datetime.datetime.now() + datetime.timedelta(hours=24)
+    if ledger.cart is not None:
+        cart = ledger.cart
+        reservation = cart.reservation_duration + cart.time_last_updated
+    else:
+        reservation = "No active cart"
 
     profile_data.append(("Current cart reserved until", reservation))
 
@@ -601,115 +832,166 @@ def attendee(request, form, user_id=None):
 
     reports.append(Links("Actions for " + name, links))
 
-    # Paid and pending  products
-    try:
-        ic = ItemController(attendee.user)
-        reports.append(ListReport(
-            "Paid Products",
-            ["Product", "Quantity"],
-            [(pq.product, pq.quantity) for pq in ic.items_purchased()],
-        ))
-        reports.append(ListReport(
-            "Unpaid Products",
-            ["Product", "Quantity"],
-            [(pq.product, pq.quantity) for pq in ic.items_pending()],
-        ))
-    except AttributeError:
-        pass
+    # Paid and pending products
+    reports.append(ListReport(
+        "Paid Products",
+        ["Product", "Quantity"],
+        ledger.paid,
+    ))
+    reports.append(ListReport(
+        "Unpaid Products",
+        ["Product", "Quantity"],
+        ledger.unpaid,
+    ))
 
     # Invoices
-    try:
-        invoices = commerce.Invoice.objects.filter(
-            user=attendee.user,
-        )
-        reports.append(QuerysetReport(
-            "Invoices",
-            ["id", "get_status_display", "value"],
-            invoices,
-            headings=["Invoice ID", "Status", "Value"],
-            link_view=views.invoice,
-        ))
-    except AttrbuteError:
-        pass
+    reports.append(ListReport(
+        "Invoices",
+        ["Invoice ID", "Status", "Value"],
+        [
+            (invoice.id, invoice.get_status_display(), invoice.value)
+            for invoice in ledger.invoices
+        ],
+        link_view=views.invoice,
+    ))
 
     # Credit Notes
-    try:
-        credit_notes = commerce.CreditNote.objects.filter(
-            invoice__user=attendee.user,
-        ).select_related("invoice", "creditnoteapplication", "creditnoterefund")
-
-        reports.append(QuerysetReport(
-            "Credit Notes",
-            ["id", "status", "value"],
-            credit_notes,
-            link_view=views.credit_note,
-        ))
-    except AttributeError:
-        pass
+    reports.append(ListReport(
+        "Credit Notes",
+        ["Id", "Status", "Value"],
+        [
+            (credit_note.id, credit_note.status, credit_note.value)
+            for credit_note in ledger.credit_notes
+        ],
+        link_view=views.credit_note,
+    ))
 
     # All payments
-    try:
-        payments = commerce.PaymentBase.objects.filter(
-            invoice__user=attendee.user,
-        ).select_related("invoice")
-
-        reports.append(QuerysetReport(
-            "Payments",
-            ["invoice__id", "id", "reference", "amount"],
-            payments,
-            link_view=views.invoice,
-        ))
-    except AttributeError:
-        pass
+    reports.append(ListReport(
+        "Payments",
+        ["Invoice ID", "Id", "Reference", "Amount"],
+        [
+            (payment.invoice.id, payment.id, payment.reference, payment.amount)
+            for payment in ledger.payments
+        ],
+        link_view=views.invoice,
+    ))
 
     return reports
 
 
+def _attendees():
+    ''' Returns the attendees, each annotated with their name and whether
+    they've registered. '''
+
+    return people.Attendee.objects.annotate(
+        has_registered=Count(
+            Q(user__invoice__status=commerce.Invoice.STATUS_PAID)
+        ),
+    ).annotate(
+        registered=Case(
+            When(has_registered__gt=0, then=Value(True)),
+            default=Value(False),
+            output_field=models.BooleanField(),
+        ),
+        attendee_name=F(_attendee_name_path("user")),
+    )
+
+
 def attendee_list(request):
     ''' Returns a list of all attendees. '''
 
-    attendees = people.Attendee.objects.select_related(
-        "attendeeprofilebase",
-        "user",
+    attendees = _attendees().order_by(
+        # Sort by whether they've registered, then ID.
+        "-registered", "user__id",
+    ).values_list(
+        "user__id", "attendee_name", "user__email", "registered",
     )
 
-    profiles = AttendeeProfile.objects.filter(
-        attendee__in=attendees
-    ).select_related(
-        "attendee", "attendee__user",
+    headings = [
+        "User ID", "Name", "Email", "Has registered",
+    ]
+
+    def rows():
+        for user_id, name, email, registered in attendees.iterator():
+            yield [user_id, name or "", email, registered]
+
+    return AttendeeIteratorReport(
+        "Attendees", headings, rows, count=attendees.count,
+        link_view=attendee,
     )
-    profiles_by_attendee = dict((i.attendee, i) for i in profiles)
 
-    attendees = attendees.annotate(
-        has_registered=Count(
-            Q(user__invoice__status=commerce.Invoice.STATUS_PAID)
-        ),
+
+def attendee_search(request, query):
+    ''' Returns the attendees that best match a search, best first. '''
+
+    matches = AttendeeSearchController.search(query)
+
+    attendees = dict(
+        (row[0], row[1:]) for row in _attendees().filter(
+            id__in=[attendee_id for attendee_id, score in matches],
+        ).values_list(
+            "id", "user__id", "attendee_name", "user__email", "registered",
+        )
     )
 
     headings = [
-        "User ID", "Name", "Email", "Has registered",
+        "User ID", "Name", "Email", "Has registered", "Match",
     ]
 
     data = []
-
-    for a in attendees:
+    for attendee_id, score in matches:
+        if attendee_id not in attendees:
+            # The search index may be behind deleted attendees
+            continue
+        user_id, name, email, registered = attendees[attendee_id]
         data.append([
-            a.user.id,
-            (profiles_by_attendee[a].attendee_name()
-                if a in profiles_by_attendee else ""),
-            a.user.email,
-            a.has_registered > 0,
+            user_id, name or "", email, registered, "%d%%" % (score * 100),
         ])
 
-    # Sort by whether they've registered, then ID.
-    data.sort(key=lambda a: (-a[3], a[0]))
-
-    return AttendeeListReport("Attendees", headings, data, link_view=attendee)
+    return AttendeeListReport(
+        "Attendees matching \"%s\"" % query, headings, data,
+        link_view=attendee,
+    )
 
 
 ProfileForm = forms.model_fields_form_factory(AttendeeProfile)
 
 
+def _profile_cells(profile, field, field_type):
+    ''' Returns the grouping and display values for one field of an attendee
+    profile.
+
+    Returns:
+        ([(key, display), ...], display): The groups that this profile falls
+            into for the field (keyed by value or related object ID), and the
+            value to display against the profile in the per-attendee table.
+
+    '''
+
+    value = getattr(profile, field)
+
+    if isinstance(field_type, models.ManyToManyField):
+        related = list(value.all())
+        groups = [(i.id, i) for i in related] or [(None, None)]
+        return groups, [str(i) for i in related] or ""
+    elif isinstance(field_type, RelatedField):
+        key = value.id if value is not None else None
+        return [(key, value)], bleach.clean(value)
+    else:
+        display = bleach.clean(value)
+        return [(value, display)], display
+
+
+def _group_order(key):
+    ''' Sorts the groups in attendee_data by product or category, then by
+    profile value, with attendees that gave no value last. The value may be
+    None, which can't be compared with other values. '''
+
+    value = key[-1]
+    return (key[:-1], value is None, value)
+
+
 @report_view(
     "Attendees By Product/Category",
     form_type=forms.mix_form(
@@ -740,9 +1022,15 @@ def attendee_data(request, form, user_id=None):
         Q(product__in=products) | Q(product__category__in=categories),
     ).exclude(
         cart__status=commerce.Cart.STATUS_RELEASED
-    ).select_related(
-        "cart", "cart__user", "product", "product__category",
-    ).order_by("cart__status")
+    )
+
+    # Load the items once, as a narrow table.
+    item_rows = items.order_by("cart__status", "id").values(
+        "cart__user", "cart__status",
+        "product", "product__name", "product__order",
+        "product__category", "product__category__name",
+    )
+    item_rows = list(item_rows)
 
     # Add invoice nag link
     links = []
@@ -753,129 +1041,97 @@ def attendee_data(request, form, user_id=None):
         (invoice_mailout + "&status=2", "Send mail for paid invoices",),
     ]
 
-    if items.count() > 0:
+    if item_rows:
         output.append(Links("Actions", links))
 
+    field_types = [AttendeeProfile._meta.get_field(field) for field in fields]
+    field_names = [field_type.verbose_name for field_type in field_types]
+
     # Make sure we select all of the related fields
-    related_fields = set(
-        field for field in fields
-        if isinstance(AttendeeProfile._meta.get_field(field), RelatedField)
-    )
+    many_fields = [
+        field for field, field_type in zip(fields, field_types)
+        if isinstance(field_type, models.ManyToManyField)
+    ]
+    related_fields = [
+        field for field, field_type in zip(fields, field_types)
+        if isinstance(field_type, RelatedField) and field not in many_fields
+    ]
 
-    # Get all of the relevant attendee profiles in one hit.
+    # Get all of the relevant attendee profiles in one hit, and work out
+    # each profile's values for the selected fields only once.
     profiles = AttendeeProfile.objects.filter(
-        attendee__user__cart__productitem__in=items
-    ).select_related("attendee__user").prefetch_related(*related_fields)
+        attendee__user__in=items.values("cart__user"),
+    ).select_related(
+        "attendee__user", *related_fields
+    ).prefetch_related(*many_fields)
+
     by_user = {}
     for profile in profiles:
-        by_user[profile.attendee.user] = profile
-
-    cart = "attendee__user__cart"
-    cart_status = cart + "__status"  # noqa
-    product = cart + "__productitem__product"
-    product_name = product + "__name"
-    category = product + "__category"
-    category_name = category + "__name"
-
+        by_user[profile.attendee.user.id] = (profile, [
+            _profile_cells(profile, field, field_type)
+            for field, field_type in zip(fields, field_types)
+        ])
 
     if by_category:
-        grouping_fields = (category, category_name)
-        order_by = (category, )
         first_column = "Category"
-        group_name = lambda i: "%s" % (i[category_name], )  # noqa
     else:
-        grouping_fields = (product, product_name, category_name)
-        order_by = (category, )
         first_column = "Product"
-        group_name = lambda i: "%s - %s" % (i[category_name], i[product_name])  # noqa
 
-    # Group the responses per-field.
-    for field in fields:
-        concrete_field = AttendeeProfile._meta.get_field(field)
-        field_verbose = concrete_field.verbose_name
-
-        # Render the correct values for related fields
-        if field in related_fields:
-            # Get all of the IDs that will appear
-            all_ids = profiles.order_by(field).values(field)
-            all_ids = [i[field] for i in all_ids if i[field] is not None]
-            # Get all of the concrete objects for those IDs
-            model = concrete_field.related_model
-            all_objects = model.objects.filter(id__in=all_ids)
-            all_objects_by_id = dict((i.id, i) for i in all_objects)
-
-            # Define a function to render those IDs.
-            def display_field(value):
-                if value in all_objects_by_id:
-                    return all_objects_by_id[value]
-                else:
-                    return None
+    # Group the responses per-field, and build the report for individual
+    # attendees, in a single pass over the items.
+    groups = [{} for field in fields]
+    data = []
+    for item in item_rows:
+        if item["cart__user"] not in by_user:
+            continue
+        profile, cells = by_user[item["cart__user"]]
+
+        category_name = item["product__category__name"]
+        product_name = "%s - %s" % (category_name, item["product__name"])
+        if by_category:
+            group_key = (item["product__category"], )
+            group_name = category_name
         else:
-            def display_field(value):
-                return bleach.clean(value)
+            group_key = (
+                item["product__category"],
+                item["product__order"],
+                item["product"],
+            )
+            group_name = product_name
+
+        status = item["cart__status"]
+        for field_groups, (values, display) in zip(groups, cells):
+            for key, value in values:
+                group = field_groups.setdefault(
+                    group_key + (key, ), [group_name, value, 0, 0],
+                )
+                if status == commerce.Cart.STATUS_PAID:
+                    group[2] += 1
+                elif status == commerce.Cart.STATUS_ACTIVE:
+                    group[3] += 1
 
-        status_count = lambda status: Case(When(  # noqa
-                attendee__user__cart__status=status,
-                then=Value(1),
-            ),
-            default=Value(0),
-            output_field=models.fields.IntegerField(),
-        )
-        paid_count = status_count(commerce.Cart.STATUS_PAID)
-        unpaid_count = status_count(commerce.Cart.STATUS_ACTIVE)
+        data.append([
+            item["cart__user"],
+            getattr(profile, name_field),
+            profile.attendee.user.email,
+            product_name,
+            status_display[status],
+        ] + [
+            display for values, display in cells
+        ])
 
-        groups = profiles.order_by(
-            *(order_by + (field, ))
-        ).values(
-            *(grouping_fields + (field, ))
-        ).annotate(
-            paid_count=Sum(paid_count),
-            unpaid_count=Sum(unpaid_count),
-        )
+    for field_verbose, field_groups in zip(field_names, groups):
         output.append(ListReport(
             "Grouped by %s" % field_verbose,
             [first_column, field_verbose, "paid", "unpaid"],
             [
-                (
-                    group_name(group),
-                    display_field(group[field]),
-                    group["paid_count"] or 0,
-                    group["unpaid_count"] or 0,
-                )
-                for group in groups
+                field_groups[key]
+                for key in sorted(field_groups, key=_group_order)
             ],
         ))
 
-    # DO the report for individual attendees
-
-    field_names = [
-        AttendeeProfile._meta.get_field(field).verbose_name for field in fields
-    ]
-
-    def display_field(profile, field):
-        field_type = AttendeeProfile._meta.get_field(field)
-        attr = getattr(profile, field)
-
-        if isinstance(field_type, models.ManyToManyField):
-            return [str(i) for i in attr.all()] or ""
-        else:
-            return bleach.clean(attr)
-
     headings = ["User ID", "Name", "Email", "Product", "Item Status"]
     headings.extend(field_names)
-    data = []
-    for item in items:
-        profile = by_user[item.cart.user]
-        line = [
-            item.cart.user.id,
-            getattr(profile, name_field),
-            profile.attendee.user.email,
-            item.product,
-            status_display[item.cart.status],
-        ] + [
-            display_field(profile, field) for field in fields
-        ]
-        data.append(line)
 
     output.append(AttendeeListReport(
         "Attendees by item with profile data", headings, data,
@@ -945,69 +1201,95 @@ def manifest(request, form):
     invoices = commerce.Invoice.objects.filter(
         line_items,
         status=commerce.Invoice.STATUS_PAID,
-    ).select_related(
-        "cart",
-        "user",
-        "user__attendee",
-        "user__attendee__attendeeprofilebase"
     )
 
-    users = set(i.user for i in invoices)
-
-    carts = commerce.Cart.objects.filter(
-        user__in=users
-    )
+    users = User.objects.filter(invoice__in=invoices).distinct()
 
+    # Fetch every item for those users as a narrow stream, ordered by
+    # attendee name, so that each user's items can be grouped as they arrive.
     items = commerce.ProductItem.objects.filter(
-        cart__in=carts
-    ).select_related(
+        cart__user__in=users,
+    ).annotate(
+        attendee_name=F(_attendee_name_path("cart__user")),
+    ).order_by(
+        Lower("attendee_name"),
+        "cart__user",
+        "product__category__order",
+        "product__order",
         "product",
-        "product__category",
         "cart",
-        "cart__user",
-        "cart__user__attendee",
-        "cart__user__attendee__attendeeprofilebase"
-    ).order_by("product__category__order", "product__order")
+    ).values(
+        "cart__user", "attendee_name", "cart__status", "quantity",
+        "product__name", "product__category__name",
+    )
 
-    users = {}
+    headings = ["User ID", "Name", "Paid", "Unpaid", "Refunded"]
 
-    for item in items:
-        cart = item.cart
-        if cart.user not in users:
-            users[cart.user] = {"unpaid": [], "paid": [], "refunded": []}
-        items = users[cart.user]
-        if cart.status == commerce.Cart.STATUS_ACTIVE:
-            items["unpaid"].append(item)
-        elif cart.status == commerce.Cart.STATUS_PAID:
-            items["paid"].append(item)
-        elif cart.status == commerce.Cart.STATUS_RELEASED:
-            items["refunded"].append(item)
-
-    users_by_name = list(users.keys())
-    users_by_name.sort(key=(
-        lambda i: i.attendee.attendeeprofilebase.attendee_name().lower()
-    ))
+    columns = {
+        commerce.Cart.STATUS_PAID: 0,
+        commerce.Cart.STATUS_ACTIVE: 1,
+        commerce.Cart.STATUS_RELEASED: 2,
+    }
 
-    headings = ["User ID", "Name", "Paid", "Unpaid", "Refunded"]
+    def rows():
+        by_user = itertools.groupby(
+            items.iterator(), lambda item: item["cart__user"],
+        )
+        for user_id, user_items in by_user:
+            name = None
+            cells = ([], [], [])
+            for item in user_items:
+                name = item["attendee_name"]
+                cells[columns[item["cart__status"]]].append(
+                    '%d x %s - %s' % (
+                        item["quantity"],
+                        item["product__category__name"],
+                        item["product__name"],
+                    )
+                )
 
-    def format_items(item_list):
-        strings = [
-            '%d x %s' % (item.quantity, str(item.product))
-            for item in item_list
-        ]
-        return ", \n".join(strings)
+            yield [user_id, name] + [", \n".join(cell) for cell in cells]
 
-    output = []
-    for user in users_by_name:
-        items = users[user]
-        output.append([
-            user.id,
-            user.attendee.attendeeprofilebase.attendee_name(),
-            format_items(items["paid"]),
-            format_items(items["unpaid"]),
-            format_items(items["refunded"]),
-        ])
+    return IteratorReport("Manifest", headings, rows, count=users.count)
+
+
+@report_view("Report snapshots", use_replica=False)
+def report_snapshots(request, form, snapshot_id=None):
+    ''' Lists the reports that have been computed in the background, or
+    shows a snapshot of a report if one is specified. '''
 
-    return ListReport("Manifest", headings, output)
+    if snapshot_id is None:
+        return snapshot_list()
 
-    # attendeeprofilebase.attendee_name()
+    snapshot = get_object_or_404(reporting.ReportSnapshot, pk=snapshot_id)
+
+    if snapshot.is_done:
+        return snapshots.snapshot_reports(snapshot)
+
+    data = [
+        ("Report", snapshot.report),
+        ("Query", snapshot.query),
+        ("Requested", snapshot.requested_time),
+        ("Status", snapshot.get_status_display()),
+    ]
+    if snapshot.error:
+        data.append(("Error", snapshot.error))
+
+    return ListReport("Snapshot of " + snapshot.report, ["", ""], data)
+
+
+def snapshot_list():
+    ''' Returns a list of all report snapshots. '''
+
+    return QuerysetReport(
+        "Snapshots",
+        [
+            "id", "report", "query", "requested_time",
+            "get_status_display", "completed_time",
+        ],
+        reporting.ReportSnapshot.objects.all(),
+        headings=[
+            "Snapshot", "Report", "Query", "Requested", "Status", "Completed",
+        ],
+        link_view=report_snapshots,
+    )
@@ -0,0 +1,145 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db import IntegrityError
+from django.db import transaction
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from registrasion.controllers.write_version import WriteVersionController
+from registrasion.models import people
+
+
+def _fill_pool(count):
+    people.Attendee._access_code_pool.extend(
+        people.Attendee.allocate_access_codes(count)
+    )
+
+
+class AccessCodeTestCase(TestCase):
+
+    def _users(self, count):
+        return [
+            User.objects.create_user(username="user%d" % i)
+            for i in range(count)
+        ]
+
+    def test_allocated_codes_are_unused(self):
+        user, = self._users(1)
+        taken = people.Attendee.objects.create(user=user).access_code
+
+        codes = people.Attendee.allocate_access_codes(1000)
+
+        self.assertEqual(1000, len(set(codes)))
+        self.assertNotIn(taken, codes)
+
+    def test_bulk_create_assigns_codes(self):
+        users = self._users(20)
+        before = WriteVersionController.current()
+
+        # One query to check the codes, one to create the attendees, in a
+        # savepoint, and two to index them for search.
+        with self.assertNumQueries(6):
+            people.Attendee.objects.bulk_create(
+                people.Attendee(user=user) for user in users
+            )
+
+        codes = set(people.Attendee.objects.values_list(
+            "access_code", flat=True,
+        ))
+        self.assertEqual(20, len(codes))
+        self.assertNotIn("", codes)
+        self.assertNotEqual(before, WriteVersionController.current())
+
+    def test_creating_attendees_does_not_check_each_code(self):
+        users = self._users(10)
+        _fill_pool(len(users))
+
+        # One query to look for each attendee, three to create them in a
+        # savepoint (as the test is inside a transaction), and one to index
+        # them for search.
+        with self.assertNumQueries(5 * 10):
+            for user in users:
+                people.Attendee.get_instance(user)
+
+    def _allocating(self, *codes):
+        ''' Makes the next call to allocate_access_codes return codes. '''
+
+        allocate = people.Attendee.__dict__["allocate_access_codes"]
+
+        def allocate_once(cls, count):
+            people.Attendee.allocate_access_codes = allocate
+            return list(codes)
+
+        people.Attendee.allocate_access_codes = classmethod(allocate_once)
+        self.addCleanup(
+            setattr, people.Attendee, "allocate_access_codes", allocate,
+        )
+
+    def test_bulk_create_replaces_taken_codes(self):
+        users = self._users(3)
+        taken = people.Attendee.objects.create(user=users[0]).access_code
+
+        # As if another process took a code after it was allocated
+        self._allocating(taken, "ZZZZZ1")
+        people.Attendee.objects.bulk_create(
+            people.Attendee(user=user) for user in users[1:]
+        )
+
+        codes = set(people.Attendee.objects.values_list(
+            "access_code", flat=True,
+        ))
+        self.assertEqual(3, len(codes))
+        self.assertIn("ZZZZZ1", codes)
+
+    def test_bulk_created_codes_are_not_pooled(self):
+        user, = self._users(1)
+        people.Attendee._access_code_pool.append("ZZZZZ2")
+
+        self._allocating("ZZZZZ2")
+        people.Attendee.objects.bulk_create([people.Attendee(user=user)])
+
+        self.assertNotIn("ZZZZZ2", people.Attendee._access_code_pool)
+
+    def test_taken_code_from_the_pool_is_replaced(self):
+        users = self._users(2)
+        taken = people.Attendee.objects.create(user=users[0]).access_code
+
+        # As if another process took this code after it was pooled
+        people.Attendee._access_code_pool.append(taken)
+        attendee = people.Attendee.objects.create(user=users[1])
+
+        self.assertNotEqual(taken, attendee.access_code)
+        self.assertEqual(2, people.Attendee.objects.count())
+
+    def test_other_integrity_errors_are_raised(self):
+        user, = self._users(1)
+        people.Attendee.objects.create(user=user)
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                people.Attendee.objects.create(user=user)
+
+
+class AutocommitAccessCodeTestCase(TransactionTestCase):
+
+    def test_creating_attendees_outside_a_transaction(self):
+        users = [
+            User.objects.create_user(username="user%d" % i)
+            for i in range(10)
+        ]
+        _fill_pool(len(users))
+
+        with CaptureQueriesContext(connection) as queries:
+            for user in users:
+                people.Attendee.get_instance(user)
+
+        # Without a transaction to protect, attendees are created without
+        # a savepoint: one query to look for each attendee, one to create
+        # them, and one to index them for search. (SQLite also logs the
+        # BEGIN of the transaction that each save runs in.)
+        statements = [
+            query["sql"] for query in queries.captured_queries
+            if query["sql"] != "BEGIN"
+        ]
+        self.assertEqual(3 * 10, len(statements))
@@ -0,0 +1,14 @@
+from django.test import TestCase
+
+from registrasion.reporting import views
+
+
+class AttendeeDataGroupingTestCase(TestCase):
+
+    def test_groups_without_a_value_sort_last(self):
+        keys = [(2, "b"), (1, None), (1, "b"), (2, None), (1, "a")]
+
+        self.assertEqual(
+            [(1, "a"), (1, "b"), (1, None), (2, "b"), (2, None)],
+            sorted(keys, key=views._group_order),
+        )
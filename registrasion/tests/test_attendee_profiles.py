@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from registrasion import util
+from registrasion.models import people
+
+
+AttendeeProfile = util.get_object_from_name(settings.ATTENDEE_PROFILE_MODEL)
+
+
+class AttendeeProfileTestCase(TestCase):
+
+    def setUp(self):
+        super(AttendeeProfileTestCase, self).setUp()
+
+        self.names = ["Attendee %d" % i for i in range(5)]
+        for i, name in enumerate(self.names):
+            user = User.objects.create_user(username="user%d" % i)
+            profile = AttendeeProfile(
+                attendee=people.Attendee.get_instance(user),
+            )
+            setattr(profile, AttendeeProfile.name_field(), name)
+            profile.save()
+
+    def test_concrete_profile_is_looked_up_once(self):
+        profile = people.AttendeeProfileBase.objects.first()
+        self.assertIs(type(profile), people.AttendeeProfileBase)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names[0], profile.attendee_name())
+            self.assertIs(type(profile.concrete_profile()), AttendeeProfile)
+            profile.invoice_recipient()
+
+    def test_concrete_profile_of_a_subclass_is_itself(self):
+        profile = AttendeeProfile.objects.first()
+
+        with self.assertNumQueries(0):
+            self.assertIs(profile, profile.concrete_profile())
+
+    def test_prefetched_profiles_are_concrete(self):
+        attendees = people.Attendee.objects.order_by("id").prefetch_related(
+            people.AttendeeProfileBase.prefetch("attendeeprofilebase"),
+        )
+
+        with self.assertNumQueries(2):
+            names = [
+                attendee.attendeeprofilebase.attendee_name()
+                for attendee in attendees
+            ]
+
+        self.assertEqual(self.names, names)
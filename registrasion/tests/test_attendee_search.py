@@ -0,0 +1,146 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save
+from django.test import TestCase
+
+from registrasion import util
+from registrasion.controllers.search import AttendeeSearchController
+from registrasion.models import inventory
+from registrasion.models import people
+from registrasion.reporting import views
+
+
+AttendeeProfile = util.get_object_from_name(settings.ATTENDEE_PROFILE_MODEL)
+
+
+class AttendeeSearchTestCase(TestCase):
+
+    def setUp(self):
+        super(AttendeeSearchTestCase, self).setUp()
+
+        self.ada = self._attendee("ada", "Ada Lovelace", "XQZ001")
+        self.adam = self._attendee("adam", "Adam Smith", "XQZ002")
+        self.grace = self._attendee("grace", "Grace Hopper", "XQZ003")
+
+    def _attendee(self, username, name, access_code):
+        user = User.objects.create_user(
+            username=username, email=username + "@example.com",
+        )
+        # Random access codes could share trigrams with the searches
+        attendee = people.Attendee.objects.create(
+            user=user, access_code=access_code,
+        )
+        profile = AttendeeProfile(attendee=attendee)
+        setattr(profile, AttendeeProfile.name_field(), name)
+        profile.save()
+        return attendee
+
+    def _found(self, query):
+        return [
+            attendee_id for attendee_id, score
+            in AttendeeSearchController.search(query)
+        ]
+
+    def test_trigrams_are_padded(self):
+        self.assertEqual(
+            set(["  a", " ad", "ada", "da "]),
+            AttendeeSearchController.trigrams("ADA"),
+        )
+
+    def test_dissimilar_attendees_are_left_out(self):
+        found = self._found("ada lovelace")
+
+        self.assertEqual([self.ada.id], found)
+
+    def test_close_matches_are_found(self):
+        found = self._found("ada")
+
+        self.assertEqual([self.ada.id, self.adam.id], found)
+
+    def test_search_by_the_start_of_a_name(self):
+        self.assertEqual(self.grace.id, self._found("hop")[0])
+
+    def test_search_by_access_code(self):
+        self.assertEqual(self.grace.id, self._found(self.grace.access_code)[0])
+
+    def test_profile_changes_are_indexed(self):
+        profile = AttendeeProfile.objects.get(attendee=self.grace)
+        setattr(profile, AttendeeProfile.name_field(), "Grace Brewster")
+        profile.save()
+
+        self.assertEqual(self.grace.id, self._found("brewster")[0])
+        self.assertNotIn(self.grace.id, self._found("hopper"))
+
+    def test_email_changes_are_indexed(self):
+        self.ada.user.email = "countess@example.org"
+        self.ada.user.save()
+
+        self.assertEqual(self.ada.id, self._found("countess")[0])
+
+    def test_repeated_terms_count_once(self):
+        # As an accent insensitive collation would see two similar trigrams
+        people.AttendeeSearchTerm.objects.bulk_create(
+            people.AttendeeSearchTerm(attendee=self.ada, term=term)
+            for term in AttendeeSearchController.trigrams("ada")
+        )
+
+        score = dict(AttendeeSearchController.search("ada"))[self.ada.id]
+        self.assertEqual(1, score)
+
+    def test_rebuilt_index_matches(self):
+        before = self._found("ada lovelace")
+
+        self.assertEqual(3, AttendeeSearchController.index_all())
+
+        self.assertEqual(before, self._found("ada lovelace"))
+
+    def test_search_report(self):
+        report = views.attendee_search(None, "grace")
+
+        row = list(report.rows("text/csv"))[0]
+        self.assertEqual(
+            [self.grace.user.id, "Grace Hopper", "grace@example.com", False],
+            row[:4],
+        )
+
+    def test_search_report_skips_attendees_that_are_gone(self):
+        search = AttendeeSearchController.search
+        missing = people.Attendee.objects.order_by("-id").first().id + 1
+        AttendeeSearchController.search = classmethod(
+            lambda cls, query: [(missing, 1.0), (self.grace.id, 0.5)]
+        )
+        try:
+            report = views.attendee_search(None, "grace")
+        finally:
+            AttendeeSearchController.search = search
+
+        rows = list(report.rows("text/csv"))
+        self.assertEqual([self.grace.user.id], [row[0] for row in rows])
+
+    def test_bulk_created_attendees_are_indexed(self):
+        users = [
+            User.objects.create_user(username=username)
+            for username in ("hedy", "katherine")
+        ]
+        people.Attendee.objects.bulk_create(
+            people.Attendee(user=user, access_code="XQZ10%d" % i)
+            for i, user in enumerate(users)
+        )
+        hedy = people.Attendee.objects.get(user__username="hedy")
+
+        self.assertEqual([hedy.id], self._found("hedy"))
+
+        indexed = sorted(people.AttendeeSearchTerm.objects.values_list(
+            "attendee", "term",
+        ))
+        AttendeeSearchController.index_all()
+        self.assertEqual(indexed, sorted(
+            people.AttendeeSearchTerm.objects.values_list("attendee", "term")
+        ))
+
+    def test_only_searchable_models_are_listened_to(self):
+        saved = AttendeeSearchController._model_saved
+
+        for model in (User, people.Attendee, AttendeeProfile):
+            self.assertIn(saved, post_save._live_receivers(model))
+        self.assertNotIn(saved, post_save._live_receivers(inventory.Product))
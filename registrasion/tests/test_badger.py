@@ -0,0 +1,400 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.contrib.auth.models import Group
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import RequestFactory
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+from lxml import etree
+
+from registrasion import forms
+from registrasion import views
+from registrasion.contrib import badger
+from registrasion.controllers.badge_version import BadgeVersionController
+from registrasion.controllers.write_version import WriteVersionController
+from registrasion.models import commerce
+from registrasion.models import inventory
+from registrasion.models import people
+from registrasion.tests.controller_helpers import TestingCartController
+from registrasion.tests.controller_helpers import TestingInvoiceController
+
+from registrasion.tests.test_cart import RegistrationCartTestCase
+
+
+class BadgeRolesTestCase(TestCase):
+
+    def setUp(self):
+        super(BadgeRolesTestCase, self).setUp()
+
+        self.user = User.objects.create_user(username="organiser")
+        self.attendee = people.Attendee.get_instance(self.user)
+
+    def test_missing_groups_have_no_members(self):
+        Group.objects.filter(name__in=[
+            badger.VOLUNTEERS_GROUP, badger.ORGANISERS_GROUP,
+        ]).delete()
+
+        roles = badger.BadgeRoles()
+
+        self.assertFalse(roles.is_volunteer(self.attendee))
+        self.assertFalse(roles.is_organiser(self.attendee))
+
+    def test_group_members_are_looked_up_once(self):
+        group, _ = Group.objects.get_or_create(name=badger.ORGANISERS_GROUP)
+        group.user_set.add(self.user)
+
+        roles = badger.BadgeRoles()
+        self.assertTrue(roles.is_organiser(self.attendee))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(roles.is_organiser(self.attendee))
+
+
+class PaidAttendeeMixin(object):
+
+    def setUp(self):
+        super(PaidAttendeeMixin, self).setUp()
+
+        # Badge data cached by an earlier test may be for a different
+        # version of these users.
+        cache.clear()
+
+        self.CAT_1.name = "Conference Ticket"
+        self.CAT_1.save()
+        self.CAT_2.name = "T-Shirt"
+        self.CAT_2.save()
+
+    def _paid_attendee(self, user, name):
+        attendee = people.Attendee.get_instance(user)
+        people.AttendeeProfileBase.objects.filter(attendee=attendee).delete()
+        badger.AttendeeProfile.objects.create(
+            attendee=attendee, name=name, company="Google Australia",
+        )
+
+        cart = TestingCartController.for_user(user)
+        cart.add_to_cart(self.PROD_1, 1)
+        cart.add_to_cart(self.PROD_3, 2)
+        invoice = TestingInvoiceController.for_cart(self.reget(cart.cart))
+        invoice.pay("Reference", invoice.invoice.value)
+
+
+class CollateTestCase(PaidAttendeeMixin, RegistrationCartTestCase):
+
+    def _collate(self):
+        with CaptureQueriesContext(connection) as queries:
+            badges = list(badger.collate({"usernames": None}))
+        return badges, len(queries)
+
+    def test_attendee_data(self):
+        self._paid_attendee(self.USER_1, "Dr Ada Lovelace")
+
+        (data, ), _ = self._collate()
+
+        self.assertEqual("Dr Ada", data["firstname"])
+        self.assertEqual("Lovelace", data["lastname"])
+        self.assertEqual("Google", data["company"])
+        self.assertEqual("Product 1", data["ticket"])
+        self.assertEqual(["Product 3"], data["shirts"])
+        self.assertTrue(data["paid"])
+        self.assertFalse(data["speaker"])
+        self.assertFalse(data["organiser"])
+
+    def test_queries_do_not_grow_with_attendees(self):
+        self._paid_attendee(self.USER_1, "Ada Lovelace")
+        badges, one_attendee = self._collate()
+        self.assertEqual(1, len(badges))
+
+        self._paid_attendee(self.USER_2, "Grace Hopper")
+        badges, two_attendees = self._collate()
+        self.assertEqual(2, len(badges))
+
+        self.assertEqual(one_attendee, two_attendees)
+
+    def test_users_can_be_selected_with_a_queryset(self):
+        self._paid_attendee(self.USER_1, "Ada Lovelace")
+        self._paid_attendee(self.USER_2, "Grace Hopper")
+
+        users = User.objects.filter(username=self.USER_2.username)
+        data, = badger.collate({"usernames": None, "users": users})
+
+        self.assertEqual(self.USER_2.id, data["user_id"])
+
+
+def _template_svg():
+    ''' Returns a minimal badge template with every element svg_badge
+    fills in. '''
+    texts = []
+    colours = []
+    for side in "lr":
+        for part in ("t" + side, "b" + side):
+            texts.extend("line-%s-%d" % (part, m) for m in range(4))
+            texts.extend("tags-%s-%d" % (part, m) for m in range(3))
+            texts.append("icons-" + part)
+            colours.append("colour-" + part)
+        texts.extend(["shirt-" + side, "email-" + side])
+
+    svg = [
+        '<svg xmlns="http://www.w3.org/2000/svg" '
+        'width="210mm" height="148mm"><g>'
+    ]
+    svg.extend('<rect id="%s" style="fill:#316a9a"/>' % i for i in colours)
+    svg.extend(
+        '<text id="%s"><tspan style="font-size:60px">-</tspan></text>' % i
+        for i in texts
+    )
+    svg.append("</g></svg>")
+    return "".join(svg)
+
+
+class BadgeTemplateTestCase(PaidAttendeeMixin, RegistrationCartTestCase):
+
+    def setUp(self):
+        super(BadgeTemplateTestCase, self).setUp()
+
+        self.out_dir = tempfile.mkdtemp()
+        self.template = os.path.join(self.out_dir, "template.svg")
+        with open(self.template, "w") as f:
+            f.write(_template_svg())
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+        super(BadgeTemplateTestCase, self).tearDown()
+
+    def test_sheet_matches_searching_the_tree(self):
+        self._paid_attendee(self.USER_1, "Ada Lovelace")
+        data, = badger.collate({"usernames": None})
+
+        root = etree.parse(self.template).getroot()
+        badger.svg_badge(root, data, 1)
+
+        sheet = badger.BadgeTemplate.load(self.template).sheet()
+        badger.svg_badge(sheet, data, 1)
+
+        self.assertEqual(etree.tostring(root), sheet.tostring())
+        self.assertIn("Lovelace", sheet.tostring())
+
+    def test_template_is_loaded_once(self):
+        self.assertIs(
+            badger.BadgeTemplate.load(self.template),
+            badger.BadgeTemplate.load(self.template),
+        )
+
+    def test_generate_badges_across_processes(self):
+        self._paid_attendee(self.USER_1, "Ada Lovelace")
+        self._paid_attendee(self.USER_2, "Grace Hopper")
+        self._paid_attendee(
+            User.objects.create_user(username="babbage"), "Charles Babbage",
+        )
+
+        badger.generate_badges({
+            "usernames": None,
+            "template": self.template,
+            "out_dir": self.out_dir,
+            "processes": 2,
+        })
+
+        with open(os.path.join(self.out_dir, "badge-1.svg")) as f:
+            sheet = f.read()
+        self.assertIn("Lovelace", sheet)
+        self.assertIn("Hopper", sheet)
+
+        with open(os.path.join(self.out_dir, "badge-2.svg")) as f:
+            self.assertIn("Babbage", f.read())
+
+    def test_badges_download_as_zip(self):
+        self._paid_attendee(self.USER_1, "Ada Lovelace")
+        self._paid_attendee(self.USER_2, "Grace Hopper")
+        invoices = commerce.Invoice.objects.filter(
+            status=commerce.Invoice.STATUS_PAID,
+        )
+
+        request = RequestFactory().post(
+            "/?category=%d&status=%d" % (
+                self.CAT_1.id, commerce.Invoice.STATUS_PAID,
+            ),
+            {"invoice": [invoice.id for invoice in invoices]},
+        )
+        request.user = User.objects.create_user(
+            username="staff", is_staff=True,
+        )
+
+        with override_settings(
+            PROJECT_ROOT=self.out_dir, BADGER_DEFAULT_SVG=self.template,
+        ):
+            response = views.badges(request)
+            content = b"".join(response.streaming_content)
+
+        self.assertEqual("application/zip", response["Content-Type"])
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        self.assertEqual(
+            sorted([
+                "badge_%d.svg" % self.USER_1.id,
+                "badge_%d.svg" % self.USER_2.id,
+            ]),
+            sorted(archive.namelist()),
+        )
+        badge = archive.read("badge_%d.svg" % self.USER_2.id)
+        self.assertIn(b"Hopper", badge)
+
+    def test_generate_badges_in_a_grid(self):
+        for name in ("Ada Lovelace", "Grace Hopper", "Charles Babbage"):
+            user = User.objects.create_user(username=name.split()[1])
+            self._paid_attendee(user, name)
+
+        badger.generate_badges({
+            "usernames": None,
+            "template": self.template,
+            "out_dir": self.out_dir,
+            "processes": 1,
+            "columns": 2,
+            "rows": 1,
+        })
+
+        page = etree.parse(os.path.join(self.out_dir, "badge-2.svg"))
+        root = page.getroot()
+        self.assertEqual("420mm", root.get("width"))
+        self.assertEqual("0 0 420 148", root.get("viewBox"))
+
+        left, right = root
+        self.assertEqual("0", left.get("x"))
+        self.assertEqual("210", right.get("x"))
+        self.assertIn("Hopper", etree.tostring(left))
+        self.assertIn("Babbage", etree.tostring(right))
+
+    def test_badge_data_are_cached_until_the_profile_changes(self):
+        self._paid_attendee(self.USER_1, "Ada Lovelace")
+
+        data = badger.collate_user(self.USER_1)
+        self.assertEqual("Lovelace", data["lastname"])
+        with self.assertNumQueries(0):
+            badger.collate_user(self.USER_1)
+
+        profile = badger.AttendeeProfile.objects.get(
+            attendee__user=self.USER_1,
+        )
+        profile.name = "Ada King"
+        profile.save()
+
+        self.assertEqual("King", badger.collate_user(self.USER_1)["lastname"])
+
+    def test_badge_data_change_with_group_membership(self):
+        self._paid_attendee(self.USER_1, "Ada Lovelace")
+        self.assertFalse(badger.collate_user(self.USER_1)["organiser"])
+
+        group, _ = Group.objects.get_or_create(name=badger.ORGANISERS_GROUP)
+        group.user_set.add(self.USER_1)
+
+        self.assertTrue(badger.collate_user(self.USER_1)["organiser"])
+
+    def test_unpaid_user_has_no_badge(self):
+        self.assertIsNone(badger.collate_user(self.USER_1))
+
+    def test_rendered_badges_are_reused(self):
+        self._paid_attendee(self.USER_1, "Ada Lovelace")
+        data = badger.collate_user(self.USER_1)
+        template = badger.BadgeTemplate(self.template)
+
+        svg = badger.render_badge(template, data)
+        self.assertIn("Lovelace", svg)
+
+        template.sheet = None  # Rendering again would fail
+        self.assertEqual(svg, badger.render_badge(template, data))
+
+        data = dict(data, lastname="King")
+        with self.assertRaises(TypeError):
+            badger.render_badge(template, data)
+
+
+class BadgeVersionTestCase(TestCase):
+
+    def test_only_badge_models_are_listened_to(self):
+        changed = BadgeVersionController._model_changed
+
+        for model in (User, people.Attendee, badger.AttendeeProfile):
+            self.assertIn(changed, post_save._live_receivers(model))
+        self.assertNotIn(changed, post_save._live_receivers(inventory.Product))
+
+
+class TicketSelectionTestCase(RegistrationCartTestCase):
+
+    def setUp(self):
+        super(TicketSelectionTestCase, self).setUp()
+
+        # The tests run in one process, so the choices can be cached.
+        self._shared = WriteVersionController.shared
+        WriteVersionController.shared = True
+
+        self.CAT_1.name = "Conference Ticket"
+        self.CAT_1.save()
+
+    def tearDown(self):
+        WriteVersionController.shared = self._shared
+        super(TicketSelectionTestCase, self).tearDown()
+
+    def _form(self, ticket):
+        return forms.BadgeForm({
+            "name": "Ada Lovelace",
+            "email": "ada@example.com",
+            "free_text_1": "",
+            "free_text_2": "",
+            "ticket": ticket,
+        })
+
+    def test_choices_are_keyed_by_product(self):
+        self.assertEqual(
+            [(self.PROD_1.id, "Product 1"), (self.PROD_2.id, "Product 2")],
+            forms.ticket_selection()[1:],
+        )
+        self.assertEqual("Product 2", forms.ticket_name(self.PROD_2.id))
+
+    def test_submitting_a_badge_does_not_query_products(self):
+        forms.ticket_selection()
+
+        with self.assertNumQueries(0):
+            form = self._form(self.PROD_2.id)
+            self.assertTrue(form.is_valid())
+            data = views.collate_from_form(form)
+
+        self.assertEqual("Product 2", data["ticket"])
+
+    def test_choices_are_not_cached_without_a_shared_cache(self):
+        WriteVersionController.shared = False
+        forms.ticket_selection()
+
+        with self.assertNumQueries(1):
+            forms.ticket_selection()
+
+    def test_choices_are_fetched_once_per_form(self):
+        WriteVersionController.shared = False
+
+        with self.assertNumQueries(1):
+            form = self._form(self.PROD_2.id)
+            self.assertTrue(form.is_valid())
+            form["ticket"].as_widget()
+            data = views.collate_from_form(form)
+
+        self.assertEqual("Product 2", data["ticket"])
+
+    def test_choices_follow_product_changes(self):
+        forms.ticket_selection()
+
+        self.PROD_1.name = "Product One"
+        self.PROD_1.save()
+
+        self.assertEqual("Product One", forms.ticket_name(self.PROD_1.id))
+
+    def test_products_that_are_not_tickets_are_invalid(self):
+        self.assertFalse(self._form(self.PROD_3.id).is_valid())
+
+        with self.assertRaises(badger.InvalidTicketChoiceError):
+            forms.ticket_name(self.PROD_3.id)
+        with self.assertRaises(badger.InvalidTicketChoiceError):
+            self._form(0).is_valid()
@@ -465,3 +465,61 @@ class CreditNoteTestCase(TestHelperMixin, RegistrationCartTestCase):
 
         extra_invoice = self._manual_invoice(23)  # noqa
         self.test_cancellation_fee_is_applied()
+
+    def _refunded_credit_note(self):
+        invoice = self._manual_invoice(1)
+        invoice.pay("Pay", invoice.invoice.value)
+        invoice.refund()
+        return self._credit_note_for_invoice(invoice.invoice)
+
+    def _annotated(self, cn):
+        return commerce.CreditNote.objects.with_status().get(
+            id=cn.credit_note.id,
+        )
+
+    def test_with_status_for_unclaimed_credit_note(self):
+        cn = self._refunded_credit_note()
+
+        note = self._annotated(cn)
+        self.assertEqual("Unclaimed", note.status_text)
+        self.assertFalse(note.is_claimed)
+        self.assertEqual(note.value, note.remaining_value)
+        self.assertTrue(note.is_unclaimed)
+
+        # Only reports ask for the status to be worked out in the database
+        plain = commerce.CreditNote.unclaimed().get(id=cn.credit_note.id)
+        self.assertFalse(hasattr(plain, "status_text"))
+        self.assertEqual(note.status, plain.status)
+
+    def test_with_status_for_refunded_credit_note(self):
+        cn = self._refunded_credit_note()
+        cn.refund()
+
+        note = self._annotated(cn)
+        self.assertEqual(
+            "Refunded with reference: Whoops.", note.status_text,
+        )
+        self.assertEqual(self.reget(cn.credit_note).status, note.status_text)
+        self.assertTrue(note.is_claimed)
+        self.assertEqual(0, note.remaining_value)
+        self.assertFalse(note.is_unclaimed)
+
+        self.assertEqual(1, commerce.CreditNote.refunded().count())
+
+    def test_with_status_for_applied_credit_note(self):
+        cn = self._refunded_credit_note()
+
+        # Generating the invoice automatically applies the credit note
+        invoice2 = self._manual_invoice(1)
+        self.assertTrue(invoice2.invoice.is_paid)
+
+        note = self._annotated(cn)
+        self.assertEqual(
+            "Applied to invoice %d" % invoice2.invoice.id, note.status_text,
+        )
+        self.assertEqual(self.reget(cn.credit_note).status, note.status_text)
+        self.assertTrue(note.is_claimed)
+        self.assertEqual(0, note.remaining_value)
+        self.assertFalse(note.is_unclaimed)
+
+        self.assertEqual(0, commerce.CreditNote.unclaimed().count())
@@ -0,0 +1,130 @@
+import threading
+import time
+
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+
+from registrasion.reporting import reports
+
+
+def _thread_report(title):
+    ''' Returns a report saying which thread computed it. '''
+    return reports.ListReport(
+        title, ["Thread"], [[threading.current_thread().name]],
+    )
+
+
+def _linked_report():
+    return reports.ListReport("Linked", ["Id"], [[1]], link_view="invoice")
+
+
+class Rendezvous(object):
+    ''' Makes reports that only finish together once count of them are
+    being computed at the same time, or after a few seconds otherwise. '''
+
+    def __init__(self, count):
+        self.count = count
+        self.arrived = 0
+        self.condition = threading.Condition()
+
+    def report(self, title):
+        end = time.time() + 3
+        with self.condition:
+            self.arrived += 1
+            self.condition.notify_all()
+            while self.arrived < self.count and time.time() < end:
+                self.condition.wait(end - time.time())
+            together = self.arrived >= self.count
+        return reports.ListReport(title, ["Together"], [[together]])
+
+    def deferred(self):
+        return [
+            reports.DeferredReport(self.report, str(i))
+            for i in range(self.count)
+        ]
+
+
+def _wrap(*deferred):
+    return reports.ReportView.wrap_reports(deferred, "text/html")
+
+
+class DeferredReportTestCase(TestCase):
+
+    def test_deferred_reports_are_evaluated(self):
+        wrappers = _wrap(
+            reports.DeferredReport(_thread_report, "One"),
+            reports.ListReport("Two", ["Thread"], [["-"]]),
+        )
+
+        self.assertEqual("_thread_report", wrappers[0].statistics.name)
+
+        reports.evaluate_reports(wrappers)
+
+        self.assertEqual("One", wrappers[0].title())
+        self.assertEqual("One", wrappers[0].statistics.name)
+        self.assertEqual(1, wrappers[0].count())
+
+    def test_evaluated_report_renders_other_content_types(self):
+        wrapper, = _wrap(reports.DeferredReport(_linked_report))
+
+        reports.evaluate_reports([wrapper])
+
+        html, = wrapper.report.rows("text/html")
+        text, = wrapper.report.rows("text/csv")
+        self.assertIn("<a href", html[0])
+        self.assertEqual([1], text)
+
+    def test_reports_are_serial_inside_a_transaction(self):
+        wrappers = _wrap(
+            reports.DeferredReport(_thread_report, "One"),
+            reports.DeferredReport(_thread_report, "Two"),
+        )
+
+        reports.evaluate_reports(wrappers)
+
+        current = threading.current_thread().name
+        for wrapper in wrappers:
+            self.assertEqual([[current]], list(wrapper.rows()))
+
+
+class ConcurrentDeferredReportTestCase(TransactionTestCase):
+
+    @override_settings(REPORT_THREADS=2)
+    def test_reports_are_evaluated_on_pool_threads(self):
+        wrappers = _wrap(
+            reports.DeferredReport(_thread_report, "One"),
+            reports.DeferredReport(_thread_report, "Two"),
+        )
+
+        reports.evaluate_reports(wrappers)
+
+        current = threading.current_thread().name
+        for wrapper in wrappers:
+            (thread, ), = wrapper.rows()
+            self.assertNotEqual(current, thread)
+
+    @override_settings(REPORT_THREADS=1)
+    def test_single_thread_evaluates_serially(self):
+        wrappers = _wrap(
+            reports.DeferredReport(_thread_report, "One"),
+            reports.DeferredReport(_thread_report, "Two"),
+        )
+
+        reports.evaluate_reports(wrappers)
+
+        current = threading.current_thread().name
+        for wrapper in wrappers:
+            self.assertEqual([[current]], list(wrapper.rows()))
+
+    def test_pool_is_sized_for_each_call(self):
+        with self.settings(REPORT_THREADS=2):
+            reports.evaluate_reports(_wrap(*Rendezvous(2).deferred()))
+
+        rendezvous = Rendezvous(3)
+        wrappers = _wrap(*rendezvous.deferred())
+        with self.settings(REPORT_THREADS=3):
+            reports.evaluate_reports(wrappers)
+
+        for wrapper in wrappers:
+            self.assertEqual([[True]], list(wrapper.rows()))
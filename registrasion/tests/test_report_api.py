@@ -0,0 +1,102 @@
+import datetime
+import json
+
+from decimal import Decimal
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from registrasion.controllers.write_version import WriteVersionController
+from registrasion.reporting import reports
+
+
+# Reports read from the primary database, so that they're never out of date
+@override_settings(REPORTING_DATABASE=None)
+class ReportApiTestCase(TestCase):
+
+    def setUp(self):
+        super(ReportApiTestCase, self).setUp()
+
+        # The tests run in one process, so the write version is shared.
+        self._shared = WriteVersionController.shared
+        WriteVersionController.shared = True
+
+        self.calls = 0
+
+        def sales(request, form):
+            self.calls += 1
+            return reports.ListReport(
+                "Sales",
+                ["Item", "Price", "Time"],
+                [["Ticket", Decimal("12.50"), datetime.date(2017, 8, 4)]],
+            )
+
+        self.view = reports.ReportView(sales, "Sales", None)
+
+    def tearDown(self):
+        WriteVersionController.shared = self._shared
+        super(ReportApiTestCase, self).tearDown()
+
+    def _get(self, content_type, **headers):
+        request = RequestFactory().get(
+            "/", {"content_type": content_type}, **headers
+        )
+        request.user = AnonymousUser()
+        return self.view(request)
+
+    def test_json_cells_are_typed(self):
+        response = self._get("application/json")
+        document = json.loads(response.content)
+
+        report, = document["reports"]
+        self.assertEqual("Sales", report["title"])
+        self.assertEqual(["Item", "Price", "Time"], report["headings"])
+        self.assertEqual([["Ticket", "12.50", "2017-08-04"]], report["rows"])
+
+    def test_ndjson_streams_headings_then_rows(self):
+        response = self._get("application/x-ndjson")
+        lines = b"".join(response.streaming_content).splitlines()
+
+        self.assertEqual(2, len(lines))
+        self.assertEqual("Sales", json.loads(lines[0])["title"])
+        self.assertEqual(
+            ["Ticket", "12.50", "2017-08-04"], json.loads(lines[1])["row"],
+        )
+
+    def test_unchanged_report_is_not_modified(self):
+        response = self._get("application/json")
+        etag = response["ETag"]
+
+        response = self._get("application/json", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(1, self.calls)
+
+    def test_no_validators_without_a_shared_cache(self):
+        WriteVersionController.shared = False
+
+        response = self._get("application/json")
+
+        self.assertFalse(response.has_header("ETag"))
+        self.assertFalse(response.has_header("Last-Modified"))
+
+    def test_changed_report_is_modified(self):
+        etag = self._get("application/json")["ETag"]
+
+        WriteVersionController.bump()
+        response = self._get("application/json", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response["ETag"])
+        self.assertEqual(2, self.calls)
+
+    def test_if_modified_since(self):
+        WriteVersionController.bump()
+        last_modified = self._get("application/json")["Last-Modified"]
+
+        response = self._get(
+            "application/json", HTTP_IF_MODIFIED_SINCE=last_modified,
+        )
+
+        self.assertEqual(304, response.status_code)
@@ -0,0 +1,181 @@
+import datetime
+import unittest
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from registrasion.controllers.write_version import WriteVersionController
+from registrasion.reporting import routers
+
+from registrasion.tests.controller_helpers import TestingCartController
+from registrasion.tests.test_cart import RegistrationCartTestCase
+
+
+MINUTES = datetime.timedelta(minutes=1)
+
+
+class ReportingRouterTestCase(RegistrationCartTestCase):
+
+    def setUp(self):
+        super(ReportingRouterTestCase, self).setUp()
+        self._old_latest_write = routers._latest_write
+        cache.delete(routers._as_of_cache_key("replica"))
+
+    def tearDown(self):
+        routers._latest_write = self._old_latest_write
+        super(ReportingRouterTestCase, self).tearDown()
+
+    def _set_latest_writes(self, primary, replica):
+        self.checks = []
+
+        def latest_write(using):
+            self.checks.append(using)
+            return primary if using == "default" else replica
+        routers._latest_write = latest_write
+
+    def test_reads_are_routed_inside_reporting_database(self):
+        router = routers.ReportingRouter()
+
+        self.assertIsNone(router.db_for_read(User))
+
+        with routers.reporting_database("replica"):
+            self.assertEqual("replica", router.db_for_read(User))
+            self.assertIsNone(router.db_for_write(User))
+
+            with routers.reporting_database(None):
+                self.assertIsNone(router.db_for_read(User))
+
+            self.assertEqual("replica", router.db_for_read(User))
+
+        self.assertIsNone(router.db_for_read(User))
+
+    def test_no_reporting_database_uses_default(self):
+        self.assertEqual((None, None), routers.choose_database())
+
+    @override_settings(REPORTING_DATABASE="replica")
+    def test_reports_can_opt_out_of_replica(self):
+        self.assertEqual(
+            (None, None), routers.choose_database(use_replica=False),
+        )
+
+    @override_settings(REPORTING_DATABASE="replica")
+    def test_up_to_date_replica_is_current(self):
+        self.add_timedelta(MINUTES * 10)
+        self._set_latest_writes(self.now - MINUTES, self.now - MINUTES)
+
+        alias, as_of = routers.choose_database()
+
+        self.assertEqual("replica", alias)
+        self.assertEqual(self.now, as_of)
+
+    @override_settings(REPORTING_DATABASE="replica")
+    def test_lagging_replica_reports_as_of_its_latest_write(self):
+        self.add_timedelta(MINUTES * 10)
+        self._set_latest_writes(self.now - MINUTES, self.now - MINUTES * 5)
+
+        alias, as_of = routers.choose_database()
+
+        self.assertEqual("replica", alias)
+        self.assertEqual(self.now - MINUTES * 5, as_of)
+
+    @override_settings(
+        REPORTING_DATABASE="replica",
+        REPORTING_DATABASE_MAX_LAG=60,
+    )
+    def test_replica_is_not_used_when_too_far_behind(self):
+        self.add_timedelta(MINUTES * 10)
+        self._set_latest_writes(self.now - MINUTES, self.now - MINUTES * 5)
+
+        self.assertEqual((None, None), routers.choose_database())
+
+    @override_settings(REPORTING_DATABASE="replica")
+    def test_replica_without_writes_is_not_used(self):
+        self._set_latest_writes(self.now - MINUTES, None)
+
+        self.assertIsNone(routers.replica_as_of("replica"))
+        self.assertEqual((None, None), routers.choose_database())
+
+    @override_settings(REPORTING_DATABASE="replica")
+    def test_lag_is_not_checked_on_every_report(self):
+        self._set_latest_writes(self.now - MINUTES, self.now - MINUTES)
+        checked_at = self.now
+
+        self.assertEqual(("replica", checked_at), routers.choose_database())
+        self.assertEqual(["default", "replica"], self.checks)
+
+        # The replica falls behind, but the last check is still trusted
+        self.add_timedelta(datetime.timedelta(seconds=1))
+        self._set_latest_writes(self.now, None)
+
+        self.assertEqual(("replica", checked_at), routers.choose_database())
+        self.assertEqual([], self.checks)
+
+    @override_settings(
+        REPORTING_DATABASE="replica",
+        REPORTING_DATABASE_LAG_CHECK_INTERVAL=0,
+    )
+    def test_lag_can_be_checked_on_every_report(self):
+        self._set_latest_writes(self.now - MINUTES, self.now - MINUTES)
+        self.assertEqual(("replica", self.now), routers.choose_database())
+
+        self._set_latest_writes(self.now, None)
+        self.assertEqual((None, None), routers.choose_database())
+        self.assertEqual(["default", "replica"], self.checks)
+
+    @override_settings(REPORTING_DATABASE="replica")
+    def test_writes_since_the_lag_check_are_not_current(self):
+        shared = WriteVersionController.shared
+        WriteVersionController.shared = True
+        try:
+            self._set_latest_writes(self.now - MINUTES, self.now - MINUTES)
+            checked_at = self.now
+            routers.choose_database()
+
+            # Nothing has been written, so the replica is still current
+            self.add_timedelta(datetime.timedelta(seconds=1))
+            self.assertEqual(("replica", self.now), routers.choose_database())
+
+            # The replica may not have this write yet
+            WriteVersionController.bump()
+            self.add_timedelta(datetime.timedelta(seconds=1))
+            self.assertEqual(
+                ("replica", checked_at), routers.choose_database(),
+            )
+            self.assertEqual(["default", "replica"], self.checks)
+        finally:
+            WriteVersionController.shared = shared
+
+    def test_replica_as_of_default_database_is_now(self):
+        self.assertEqual(timezone.now(), routers.replica_as_of("default"))
+
+
+# A database other than the default, if the tests have one.
+OTHER_DATABASE = next(
+    (alias for alias in sorted(settings.DATABASES) if alias != "default"),
+    None,
+)
+
+
+@unittest.skipIf(OTHER_DATABASE is None, "Needs a second database")
+@override_settings(REPORTING_DATABASE=OTHER_DATABASE)
+class ReplicaDatabaseTestCase(RegistrationCartTestCase):
+
+    multi_db = True
+
+    def setUp(self):
+        super(ReplicaDatabaseTestCase, self).setUp()
+        cache.delete(routers._as_of_cache_key(OTHER_DATABASE))
+
+    def test_empty_replica_is_not_used(self):
+        if settings.DATABASES[OTHER_DATABASE].get("TEST", {}).get("MIRROR"):
+            self.skipTest("The second database mirrors the default")
+
+        # Writes only go to the default database
+        cart = TestingCartController.for_user(self.USER_1)
+        cart.add_to_cart(self.PROD_1, 1)
+
+        self.assertIsNone(routers.replica_as_of(OTHER_DATABASE))
+        self.assertEqual((None, None), routers.choose_database())
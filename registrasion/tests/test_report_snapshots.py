@@ -0,0 +1,136 @@
+import datetime
+
+from django.http import Http404
+from django.http import QueryDict
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from registrasion.models import reporting
+from registrasion.reporting import snapshots
+from registrasion.reporting import views
+from registrasion.tests.test_helpers import TestHelperMixin
+
+from registrasion.tests.test_cart import RegistrationCartTestCase
+
+
+ReportSnapshot = reporting.ReportSnapshot
+
+
+class ReportSnapshotTestCase(TestHelperMixin, RegistrationCartTestCase):
+
+    def test_queued_snapshot_is_computed(self):
+        invoice = self._invoice_containing_prod_1(1)
+
+        snapshot = snapshots.queue_snapshot("invoices", "", self.USER_1)
+        self.assertEqual(ReportSnapshot.STATUS_QUEUED, snapshot.status)
+
+        self.assertEqual(1, snapshots.run_queued_snapshots())
+
+        snapshot = self.reget(snapshot)
+        self.assertEqual(ReportSnapshot.STATUS_DONE, snapshot.status)
+        self.assertIsNotNone(snapshot.completed_time)
+
+        reports = snapshots.snapshot_reports(snapshot)
+        self.assertEqual(1, len(reports))
+        self.assertEqual(1, reports[0].count())
+
+        # Text rows are stored without links; HTML rows link to the invoice
+        text_row = list(reports[0].rows("text/csv"))[0]
+        html_row = list(reports[0].rows("text/html"))[0]
+        self.assertEqual(str(invoice.invoice.id), text_row[0])
+        self.assertIn("<a href=", html_row[0])
+
+    def test_snapshot_of_report_that_reads_the_request(self):
+        self._invoice_containing_prod_1(1)
+
+        # attendee_data links to the mailout with its own query string
+        snapshot = snapshots.queue_snapshot(
+            "attendee_data", "product=%d" % self.PROD_1.id, self.USER_1,
+        )
+        snapshots.run_queued_snapshots()
+
+        snapshot = self.reget(snapshot)
+        self.assertEqual(ReportSnapshot.STATUS_DONE, snapshot.status)
+        self.assertNotEqual(0, len(snapshots.snapshot_reports(snapshot)))
+
+    def test_missing_snapshot_is_not_found(self):
+        self.USER_1.is_staff = True
+        self.USER_1.save()
+
+        request = RequestFactory().get("/")
+        request.user = self.USER_1
+
+        with self.assertRaises(Http404):
+            views.report_snapshots(request, "1000")
+
+    def test_snapshot_is_only_computed_once(self):
+        snapshot = snapshots.queue_snapshot("invoices", "")
+
+        self.assertTrue(snapshots.compute_snapshot(snapshot))
+        self.assertFalse(snapshots.compute_snapshot(snapshot))
+        self.assertEqual(0, snapshots.run_queued_snapshots())
+
+    def test_snapshot_of_missing_report_fails(self):
+        snapshot = snapshots.queue_snapshot("not_a_report", "")
+        snapshots.run_queued_snapshots()
+
+        snapshot = self.reget(snapshot)
+        self.assertEqual(ReportSnapshot.STATUS_FAILED, snapshot.status)
+        self.assertIn("not_a_report", snapshot.error)
+
+    def test_snapshot_of_report_without_url_fails(self):
+        report_path = snapshots._report_path
+        snapshots._report_path = lambda name: None
+        try:
+            snapshot = snapshots.queue_snapshot("invoices", "")
+            snapshots.run_queued_snapshots()
+        finally:
+            snapshots._report_path = report_path
+
+        snapshot = self.reget(snapshot)
+        self.assertEqual(ReportSnapshot.STATUS_FAILED, snapshot.status)
+        self.assertIn("has no URL", snapshot.error)
+
+    @override_settings(ALLOWED_HOSTS=["*", "registration.example.com"])
+    def test_snapshot_request_is_like_the_report_request(self):
+        snapshot = snapshots.queue_snapshot(
+            "attendee_data", "product=1&product=2", self.USER_1,
+        )
+        path = snapshots._report_path("attendee_data")
+
+        request = snapshots._snapshot_request(snapshot, path)
+
+        self.assertEqual("GET", request.method)
+        self.assertEqual(path, request.path)
+        self.assertEqual(["1", "2"], request.GET.getlist("product"))
+        self.assertEqual("product=1&product=2", request.META["QUERY_STRING"])
+        self.assertEqual("registration.example.com", request.get_host())
+        self.assertEqual(self.USER_1, request.user)
+
+    def test_snapshot_query_ignores_display_parameters(self):
+        query = QueryDict(
+            "product=1&content_type=text/csv&section=0&snapshot=1"
+        )
+        self.assertEqual("product=1", snapshots.snapshot_query(query))
+
+    @override_settings(REPORT_SNAPSHOT_SCHEDULE=[("invoices", "", 15)])
+    def test_scheduled_snapshots_are_queued_when_due(self):
+        self.assertEqual(1, len(snapshots.queue_scheduled_snapshots()))
+
+        # The snapshot we just queued is recent enough.
+        self.assertEqual(0, len(snapshots.queue_scheduled_snapshots()))
+
+        ReportSnapshot.objects.update(
+            requested_time=timezone.now() - datetime.timedelta(minutes=16),
+        )
+
+        self.assertEqual(1, len(snapshots.queue_scheduled_snapshots()))
+
+    @override_settings(REPORT_SNAPSHOT_SCHEDULE=[("invoices", "", 15)])
+    def test_failed_snapshots_are_rescheduled(self):
+        for snapshot in snapshots.queue_scheduled_snapshots():
+            snapshot.status = ReportSnapshot.STATUS_FAILED
+            snapshot.save()
+
+        self.assertEqual(1, len(snapshots.queue_scheduled_snapshots()))
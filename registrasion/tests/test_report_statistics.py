@@ -0,0 +1,77 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from registrasion.reporting import reports
+
+
+class ReportStatisticsTestCase(TestCase):
+
+    def test_measure_counts_queries(self):
+        statistics = reports.ReportStatistics("test")
+
+        with statistics.measure():
+            list(User.objects.all())
+            list(User.objects.all())
+
+        self.assertEqual(2, statistics.queries)
+        self.assertGreaterEqual(statistics.db_time, 0)
+        self.assertGreaterEqual(statistics.wall_time, statistics.db_time)
+
+    def test_measure_does_not_need_the_query_log(self):
+        statistics = reports.ReportStatistics("test")
+        logged = len(connection.queries_log)
+
+        with statistics.measure():
+            self.assertFalse(connection.queries_logged)
+            list(User.objects.all())
+
+        self.assertEqual(1, statistics.queries)
+        self.assertEqual(logged, len(connection.queries_log))
+
+    def test_nested_measures_both_count(self):
+        outer = reports.ReportStatistics("outer")
+        inner = reports.ReportStatistics("inner")
+
+        with outer.measure():
+            list(User.objects.all())
+            with inner.measure():
+                list(User.objects.all())
+
+        self.assertEqual(2, outer.queries)
+        self.assertEqual(1, inner.queries)
+
+    def test_measure_accumulates(self):
+        statistics = reports.ReportStatistics("test")
+
+        for i in range(3):
+            with statistics.measure():
+                list(User.objects.all())
+
+        self.assertEqual(3, statistics.queries)
+
+    def test_report_rows_are_measured(self):
+        report = reports.QuerysetReport(
+            "Users", ["username"], User.objects.all(),
+        )
+        wrapper = reports._ReportTemplateWrapper("text/html", report)
+
+        list(wrapper.rows())
+
+        self.assertEqual(1, wrapper.statistics.queries)
+
+    @override_settings(REPORT_STATISTICS_THRESHOLDS={"queries": 1})
+    def test_exceeded_thresholds(self):
+        statistics = reports.ReportStatistics("test")
+
+        with statistics.measure():
+            list(User.objects.all())
+
+        self.assertFalse(statistics.is_slow)
+
+        with statistics.measure():
+            list(User.objects.all())
+
+        self.assertTrue(statistics.is_slow)
+        self.assertEqual(["queries"], statistics.exceeded())
@@ -0,0 +1,82 @@
+from django.contrib.auth.models import AnonymousUser
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from registrasion.reporting import reports
+
+
+TABLE_TEMPLATE = \
+    "<h1>{{ title }}</h1>" \
+    "{% for report in reports %}" \
+    "<h2>{{ report.title }}</h2>" \
+    "<table><tr>{% for h in report.headings %}<th>{{ h }}</th>{% endfor %}" \
+    "</tr>" \
+    "{% for row in report.rows %}" \
+    "<tr class=\"row\">{% for c in row %}\n<td>{{ c|safe }}</td>{% endfor %}" \
+    "</tr>" \
+    "{% endfor %}" \
+    "</table>" \
+    "{% endfor %}" \
+    "<footer></footer>"
+
+LIST_TEMPLATE = \
+    "{% for report in reports %}" \
+    "{% for row in report.rows %}" \
+    "<li>{{ row|join:',' }}</li>" \
+    "{% endfor %}" \
+    "{% endfor %}"
+
+
+def _templates(template):
+    return [{
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "OPTIONS": {
+            "loaders": [(
+                "django.template.loaders.locmem.Loader",
+                {"registrasion/report.html": template},
+            )],
+        },
+    }]
+
+
+class StreamingHtmlTestCase(TestCase):
+
+    def setUp(self):
+        super(StreamingHtmlTestCase, self).setUp()
+
+        def people(request, form):
+            return [
+                reports.ListReport(
+                    "People", ["Id", "Name"],
+                    [[i, "Person %d" % i] for i in range(250)],
+                ),
+                reports.ListReport("Nobody", ["Id"], []),
+                reports.ListReport("Links", ["Link"], [['<a href="/">']]),
+            ]
+
+        self.view = reports.ReportView(people, "People", None)
+
+    def _get(self, **get):
+        request = RequestFactory().get("/", get)
+        request.user = AnonymousUser()
+        return self.view(request)
+
+    @override_settings(TEMPLATES=_templates(TABLE_TEMPLATE))
+    def test_streamed_page_matches_rendered_page(self):
+        rendered = self._get().content
+
+        response = self._get(stream="1")
+
+        self.assertIsInstance(response, StreamingHttpResponse)
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(rendered, b"".join(chunks))
+
+    @override_settings(TEMPLATES=_templates(LIST_TEMPLATE))
+    def test_falls_back_without_table_rows(self):
+        response = self._get(stream="1")
+
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+        self.assertIn(b"<li>0,Person 0</li>", response.content)
@@ -0,0 +1,157 @@
+import threading
+import time
+
+from django.db import connection
+from django.db import OperationalError
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+
+from registrasion.reporting import reports
+from registrasion.reporting import timeouts
+
+from registrasion.tests.test_deferred_reports import Rendezvous
+
+
+# Counts to a hundred million, which takes far longer than these tests allow.
+SLOW_QUERY = '''
+    WITH RECURSIVE counter(x) AS (
+        SELECT 1 UNION ALL SELECT x + 1 FROM counter WHERE x < 100000000
+    )
+    SELECT COUNT(*) FROM counter
+'''
+
+
+def _slow_rows():
+    with connection.cursor() as cursor:
+        cursor.execute(SLOW_QUERY)
+        yield cursor.fetchone()
+
+
+class ReportTimeoutTestCase(TestCase):
+
+    @override_settings(
+        REPORT_TIMEOUT=30,
+        REPORT_TIMEOUTS={"attendee_data": 60},
+    )
+    def test_report_timeout_settings(self):
+        self.assertEqual(60, timeouts.report_timeout("attendee_data"))
+        self.assertEqual(30, timeouts.report_timeout("manifest"))
+
+    def test_no_timeout_by_default(self):
+        self.assertIsNone(timeouts.report_timeout("manifest"))
+
+    def test_passed_deadline_times_out(self):
+        with self.assertRaises(timeouts.ReportTimedOut):
+            with timeouts.deadline(time.time() - 1):
+                pass
+
+    def test_slow_query_is_stopped(self):
+        start = time.time()
+
+        with self.assertRaises(timeouts.ReportTimedOut):
+            with timeouts.deadline(start + 0.2):
+                list(_slow_rows())
+
+        self.assertLess(time.time() - start, 5)
+
+    def test_queries_after_an_interrupted_query_are_stopped(self):
+        start = time.time()
+
+        with self.assertRaises(timeouts.ReportTimedOut):
+            with timeouts.deadline(start + 0.2):
+                try:
+                    list(_slow_rows())
+                except OperationalError:
+                    pass
+                list(_slow_rows())
+
+        self.assertLess(time.time() - start, 5)
+
+    def test_sections_share_the_deadline(self):
+        def sleepy_rows():
+            time.sleep(0.3)
+            yield [1]
+
+        sleepy = reports.IteratorReport("Sleepy", ["Count"], sleepy_rows)
+        fast = reports.ListReport("Fast", ["Count"], [[1]])
+        wrappers = reports.ReportView.wrap_reports([sleepy, fast], "text/html")
+
+        reports.evaluate_reports(wrappers, timeout=0.2)
+
+        # The sleepy section used up all of the time
+        self.assertTrue(wrappers[1].timed_out)
+
+    def test_slow_section_is_replaced_with_notice(self):
+        fast = reports.ListReport("Fast", ["Count"], [[1]])
+        slow = reports.IteratorReport("Slow", ["Count"], _slow_rows)
+        wrappers = reports.ReportView.wrap_reports([fast, slow], "text/html")
+
+        reports.evaluate_reports(wrappers, timeout=0.2)
+
+        self.assertFalse(wrappers[0].timed_out)
+        self.assertEqual([[1]], list(wrappers[0].rows()))
+
+        self.assertTrue(wrappers[1].timed_out)
+        self.assertTrue(wrappers[1].statistics.timed_out)
+        self.assertEqual("Slow", wrappers[1].title())
+        self.assertEqual(1, len(list(wrappers[1].rows())))
+
+
+class ConcurrentReportTimeoutTestCase(TransactionTestCase):
+
+    def setUp(self):
+        super(ConcurrentReportTimeoutTestCase, self).setUp()
+        self.threads = threading.active_count()
+
+    def tearDown(self):
+        # Sections that weren't waited for are still running
+        end = time.time() + 5
+        while threading.active_count() > self.threads and time.time() < end:
+            time.sleep(0.01)
+        super(ConcurrentReportTimeoutTestCase, self).tearDown()
+
+    @override_settings(REPORT_THREADS=2)
+    def test_section_the_database_cannot_stop_is_not_waited_for(self):
+        def sleepy_rows():
+            time.sleep(3)
+            yield [1]
+
+        slow = reports.IteratorReport("Slow", ["Count"], sleepy_rows)
+        fast = reports.ListReport("Fast", ["Count"], [[1]])
+        wrappers = reports.ReportView.wrap_reports([slow, fast], "text/html")
+
+        start = time.time()
+        reports.evaluate_reports(wrappers, timeout=0.2)
+
+        self.assertLess(time.time() - start, 2)
+        self.assertTrue(wrappers[0].timed_out)
+        self.assertFalse(wrappers[1].timed_out)
+
+    @override_settings(REPORT_THREADS=2)
+    def test_stuck_section_does_not_hold_up_later_reports(self):
+        stuck = threading.Event()
+
+        def stuck_rows():
+            stuck.wait(10)
+            yield [1]
+
+        wrappers = reports.ReportView.wrap_reports([
+            reports.IteratorReport("Stuck", ["Count"], stuck_rows),
+            reports.ListReport("Fast", ["Count"], [[1]]),
+        ], "text/html")
+        reports.evaluate_reports(wrappers, timeout=0.2)
+
+        self.assertTrue(wrappers[0].timed_out)
+
+        # Both of these sections need a thread at the same time
+        wrappers = reports.ReportView.wrap_reports(
+            Rendezvous(2).deferred(), "text/html",
+        )
+        reports.evaluate_reports(wrappers, timeout=5)
+
+        for wrapper in wrappers:
+            self.assertFalse(wrapper.timed_out)
+            self.assertEqual([[True]], list(wrapper.rows()))
+
+        stuck.set()
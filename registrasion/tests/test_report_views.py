@@ -0,0 +1,531 @@
+import datetime
+
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from registrasion import util
+from registrasion.models import commerce
+from registrasion.models import inventory
+from registrasion.models import people
+from registrasion.reporting import forms
+from registrasion.reporting import views
+from registrasion.tests.controller_helpers import TestingCartController
+from registrasion.tests.controller_helpers import TestingCreditNoteController
+from registrasion.tests.controller_helpers import TestingInvoiceController
+
+from registrasion.tests.test_cart import RegistrationCartTestCase
+
+
+AttendeeProfile = util.get_object_from_name(settings.ATTENDEE_PROFILE_MODEL)
+
+
+def _report(view, form, request=None):
+    ''' Calls the undecorated report view, returning its reports. '''
+
+    reports = view.report_view.inner_view(request, form)
+    if not isinstance(reports, (list, tuple)):
+        reports = [reports]
+    return reports
+
+
+def _rows(report):
+    return [list(row) for row in report.rows("text/csv")]
+
+
+class ReportViewTestCase(RegistrationCartTestCase):
+
+    def _named_user(self, username, name):
+        user = User.objects.create_user(username=username)
+        profile = AttendeeProfile(
+            attendee=people.Attendee.get_instance(user),
+        )
+        setattr(profile, AttendeeProfile.name_field(), name)
+        profile.save()
+        return user
+
+    def _paid(self, user, *products):
+        cart = TestingCartController.for_user(user)
+        for product, quantity in products:
+            cart.add_to_cart(product, quantity)
+        invoice = TestingInvoiceController.for_cart(self.reget(cart.cart))
+        invoice.pay("Reference", invoice.invoice.value)
+        return invoice
+
+    def _reserved(self, user, *products):
+        cart = TestingCartController.for_user(user)
+        for product, quantity in products:
+            cart.add_to_cart(product, quantity)
+        return cart
+
+
+class LimitsReportTestCase(ReportViewTestCase):
+
+    def _limit_rows(self, description):
+        for report in _report(views.limits, None):
+            if report.title() == description:
+                return _rows(report)
+
+    def test_category_limit_counts_the_category_products(self):
+        self.make_category_ceiling("Category limit", limit=10)
+
+        self._paid(self.USER_1, (self.PROD_1, 1))
+        self._reserved(self.USER_2, (self.PROD_2, 2), (self.PROD_3, 1))
+
+        self.assertEqual(
+            [
+                ["Category 1 - Product 1", 1, 0, 1],
+                ["Category 1 - Product 2", 0, 2, 2],
+                ["(TOTAL)", 1, 2, "3/10"],
+            ],
+            self._limit_rows("Category limit"),
+        )
+
+    def test_paid_and_reserved_items_are_split(self):
+        self.make_ceiling("Product limit", limit=5)
+
+        self._paid(self.USER_1, (self.PROD_1, 2))
+        self._reserved(self.USER_2, (self.PROD_1, 1))
+
+        self.assertEqual(
+            [
+                ["Category 1 - Product 1", 2, 1, 3],
+                ["(TOTAL)", 2, 1, "3/5"],
+            ],
+            self._limit_rows("Product limit"),
+        )
+
+        # Once the reservation expires, only the paid items are used
+        self.add_timedelta(self.RESERVATION * 2)
+
+        self.assertEqual(
+            [
+                ["Category 1 - Product 1", 2, 0, 2],
+                ["(TOTAL)", 2, 0, "2/5"],
+            ],
+            self._limit_rows("Product limit"),
+        )
+
+    def _count_limits_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            for report in _report(views.limits, None):
+                _rows(report)
+        return len(queries)
+
+    def test_queries_do_not_grow_with_products(self):
+        self.make_category_ceiling("Category limit", limit=100)
+        self._paid(self.USER_1, (self.PROD_1, 1))
+
+        before = self._count_limits_queries()
+
+        cart = TestingCartController.for_user(self.USER_2)
+        for i in range(10):
+            product = inventory.Product.objects.create(
+                name="Extra %d" % i,
+                category=self.CAT_1,
+                price=Decimal("1.00"),
+                reservation_duration=self.RESERVATION,
+                limit_per_user=10,
+                order=10 + i,
+            )
+            cart.add_to_cart(product, 1)
+
+        # Product 1 and the extra products, but not the unsold Product 2
+        self.assertEqual(11, len(self._limit_rows("Category limit")) - 1)
+        with self.assertNumQueries(before):
+            for report in _report(views.limits, None):
+                _rows(report)
+
+
+class _Form(object):
+    ''' Stands in for a report's bound form. '''
+
+    def __init__(self, **cleaned_data):
+        self.cleaned_data = cleaned_data
+
+
+class ProductLineItemsReportTestCase(ReportViewTestCase):
+
+    def _line_items(self):
+        form = _Form(product=[self.PROD_1], category=[self.CAT_2])
+        report, = _report(views.product_line_items, form)
+        return _rows(report)
+
+    def test_rows_follow_invoice_order(self):
+        grace = self._named_user("grace", "Grace Hopper")
+
+        first = self._paid(grace, (self.PROD_1, 2), (self.PROD_3, 1))
+        self.add_timedelta(self.RESERVATION)
+        # These users have no concrete profile holding their name
+        second = self._paid(self.USER_2, (self.PROD_4, 1))
+        self.add_timedelta(self.RESERVATION)
+        third = self._paid(self.USER_1, (self.PROD_1, 1), (self.PROD_2, 1))
+        # Unpaid invoices are not line items
+        self._reserved(grace, (self.PROD_1, 1))
+
+        def date(invoice):
+            return invoice.invoice.issue_time.strftime('%Y-%m-%d %H:%M:%S')
+
+        self.assertEqual(
+            [
+                [
+                    first.invoice.id, date(first), "Grace Hopper", 2,
+                    "Category 1 - Product 1", "PAID",
+                ],
+                [
+                    first.invoice.id, date(first), "Grace Hopper", 1,
+                    "Category 2 - Product 3", "PAID",
+                ],
+                [
+                    second.invoice.id, date(second), None, 1,
+                    "Category 2 - Product 4", "PAID",
+                ],
+                [
+                    third.invoice.id, date(third), None, 1,
+                    "Category 1 - Product 1", "PAID",
+                ],
+            ],
+            self._line_items(),
+        )
+
+    def test_names_are_fetched_with_the_line_items(self):
+        for i in range(10):
+            user = self._named_user("user%d" % i, "Attendee %d" % i)
+            self._paid(user, (self.PROD_1, 1), (self.PROD_3, 1))
+
+        with self.assertNumQueries(1):
+            rows = self._line_items()
+
+        self.assertEqual(20, len(rows))
+        self.assertEqual("Attendee 0", rows[0][2])
+
+
+class AttendeeReportTestCase(ReportViewTestCase):
+
+    def _attendee(self, user):
+        form = _Form(user=user.id, search=None)
+        return dict(
+            (report.title(), _rows(report))
+            for report in _report(views.attendee, form)
+            if hasattr(report, "rows")
+        )
+
+    def test_viewing_an_attendee_does_not_create_a_cart(self):
+        self._paid(self.USER_1, (self.PROD_1, 1))
+        carts = commerce.Cart.objects.count()
+
+        reports = self._attendee(self.USER_1)
+
+        self.assertEqual(carts, commerce.Cart.objects.count())
+        self.assertIn(
+            ["Current cart reserved until", "No active cart"],
+            reports["Profile"],
+        )
+
+    def test_ledger_is_listed_in_order(self):
+        first = self._paid(self.USER_1, (self.PROD_3, 1), (self.PROD_1, 2))
+        self.add_timedelta(datetime.timedelta(minutes=1))
+        second = self._paid(self.USER_1, (self.PROD_2, 1))
+        self.add_timedelta(datetime.timedelta(minutes=1))
+        second.refund()
+        self.add_timedelta(datetime.timedelta(minutes=1))
+        cart = self._reserved(self.USER_1, (self.PROD_4, 1))
+        cart.cart.refresh_from_db()
+
+        reports = self._attendee(self.USER_1)
+
+        self.assertEqual(
+            [[self.PROD_1, 2], [self.PROD_3, 1]],
+            reports["Paid Products"],
+        )
+        self.assertEqual([[self.PROD_4, 1]], reports["Unpaid Products"])
+        self.assertEqual(
+            [first.invoice.id, second.invoice.id],
+            [row[0] for row in reports["Invoices"]],
+        )
+        credit_note = commerce.CreditNote.objects.get()
+        self.assertEqual(
+            [[credit_note.id, "Unclaimed", credit_note.value]],
+            reports["Credit Notes"],
+        )
+        self.assertEqual(
+            [
+                (first.invoice.id, first.invoice.value),
+                (second.invoice.id, second.invoice.value),
+                (second.invoice.id, -credit_note.value),
+            ],
+            [(row[0], row[3]) for row in reports["Payments"]],
+        )
+        self.assertIn(
+            [
+                "Current cart reserved until",
+                cart.cart.reservation_duration + cart.cart.time_last_updated,
+            ],
+            reports["Profile"],
+        )
+
+    def _count_attendee_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self._attendee(self.USER_1)
+        return len(queries)
+
+    def test_queries_do_not_grow_with_the_ledger(self):
+        self._paid(self.USER_1, (self.PROD_1, 1))
+
+        before = self._count_attendee_queries()
+
+        for product in (self.PROD_2, self.PROD_3, self.PROD_4):
+            invoice = self._paid(self.USER_1, (product, 1))
+        invoice.refund()
+        self._reserved(self.USER_1, (self.PROD_1, 1), (self.PROD_3, 1))
+
+        with self.assertNumQueries(before):
+            self._attendee(self.USER_1)
+
+
+class ManifestReportTestCase(ReportViewTestCase):
+
+    def _manifest(self):
+        form = _Form(product=[self.PROD_1], category=[])
+        report, = _report(views.manifest, form)
+        return report
+
+    def test_items_are_grouped_by_user(self):
+        zoe = self._named_user("zoe", "Zoe")
+        sam_1 = self._named_user("sam1", "Sam")
+        sam_2 = self._named_user("sam2", "sam")
+
+        # Interleave everyone's purchases
+        self._paid(zoe, (self.PROD_1, 1))
+        self._paid(sam_2, (self.PROD_1, 1), (self.PROD_3, 1))
+        self._paid(sam_1, (self.PROD_1, 2))
+        self._paid(zoe, (self.PROD_4, 1)).refund()
+        self._reserved(sam_2, (self.PROD_2, 1))
+        self._paid(sam_1, (self.PROD_3, 1))
+        self._reserved(zoe, (self.PROD_3, 2))
+        # Has bought only things that aren't in the manifest
+        self._paid(self.USER_1, (self.PROD_3, 1))
+
+        self.assertEqual(
+            [
+                [
+                    sam_1.id, "Sam",
+                    "2 x Category 1 - Product 1, \n"
+                    "1 x Category 2 - Product 3",
+                    "", "",
+                ],
+                [
+                    sam_2.id, "sam",
+                    "1 x Category 1 - Product 1, \n"
+                    "1 x Category 2 - Product 3",
+                    "1 x Category 1 - Product 2",
+                    "",
+                ],
+                [
+                    zoe.id, "Zoe",
+                    "1 x Category 1 - Product 1",
+                    "2 x Category 2 - Product 3",
+                    "1 x Category 2 - Product 4",
+                ],
+            ],
+            _rows(self._manifest()),
+        )
+
+    def test_manifest_is_read_in_one_query(self):
+        for i in range(10):
+            user = self._named_user("user%d" % i, "Attendee %d" % i)
+            self._paid(user, (self.PROD_1, 1))
+            self._reserved(user, (self.PROD_3, 1))
+
+        report = self._manifest()
+        with self.assertNumQueries(1):
+            rows = _rows(report)
+
+        self.assertEqual(10, len(rows))
+        self.assertEqual(10, report.count())
+
+
+class PaidInvoicesByDateReportTestCase(ReportViewTestCase):
+
+    def _paid_at(self, product, *times):
+        ''' Pays for an invoice for ``product``, with one payment at each of
+        ``times``. '''
+
+        cart = TestingCartController.for_user(self.USER_1)
+        cart.add_to_cart(product, 1)
+        invoice = TestingInvoiceController.for_cart(self.reget(cart.cart))
+
+        amounts = [Decimal("1.00")] * (len(times) - 1)
+        amounts.insert(0, invoice.invoice.value - sum(amounts))
+        for time, amount in zip(times, amounts):
+            commerce.PaymentBase.objects.create(
+                invoice=invoice.invoice,
+                reference="Reference",
+                amount=amount,
+                time=time,
+            )
+        invoice.update_status()
+        self.assertTrue(invoice.invoice.is_paid)
+
+    def setUp(self):
+        super(PaidInvoicesByDateReportTestCase, self).setUp()
+
+        def at(*a):
+            return datetime.datetime(*a, tzinfo=timezone.utc)
+
+        self.set_time(at(2017, 7, 20))
+
+        # Paid at its latest payment, on Tuesday
+        self._paid_at(self.PROD_1, at(2017, 7, 30), at(2017, 8, 1, 12, 30))
+        # Either side of midnight between Sunday and Monday
+        self._paid_at(self.PROD_1, at(2017, 8, 6, 23, 59, 59))
+        self._paid_at(self.PROD_1, at(2017, 8, 7, 0, 0, 0))
+        self._paid_at(self.PROD_1, at(2017, 8, 7, 0, 59, 59))
+        self._paid_at(self.PROD_1, at(2017, 8, 7, 1, 0, 0))
+        # Not in the report
+        self._paid_at(self.PROD_3, at(2017, 8, 7, 1, 0, 0))
+
+    def _by_date(self, granularity):
+        form = _Form(
+            product=[self.PROD_1], category=[], granularity=granularity,
+        )
+        with self.assertNumQueries(1):
+            report, = _report(views.paid_invoices_by_date, form)
+        return _rows(report)
+
+    def test_hours(self):
+        self.assertEqual(
+            [
+                ["2017-08-01 12:00", 1, 1],
+                ["2017-08-06 23:00", 1, 2],
+                ["2017-08-07 00:00", 2, 4],
+                ["2017-08-07 01:00", 1, 5],
+            ],
+            self._by_date(forms.GranularityForm.GRANULARITY_HOUR),
+        )
+
+    def test_days(self):
+        self.assertEqual(
+            [
+                ["2017-08-01", 1, 1],
+                ["2017-08-06", 1, 2],
+                ["2017-08-07", 3, 5],
+            ],
+            self._by_date(forms.GranularityForm.GRANULARITY_DAY),
+        )
+
+    def test_weeks_start_on_monday(self):
+        self.assertEqual(
+            [
+                ["2017-07-31", 2, 2],
+                ["2017-08-07", 3, 5],
+            ],
+            self._by_date(forms.GranularityForm.GRANULARITY_WEEK),
+        )
+
+
+class AttendeeDataReportTestCase(ReportViewTestCase):
+
+    def _attendee_data(self, group_by):
+        form = _Form(
+            product=[self.PROD_1, self.PROD_2],
+            category=[self.CAT_2],
+            fields=[AttendeeProfile.name_field()],
+            group_by=group_by,
+        )
+        request = RequestFactory().get("/", {"group_by": group_by})
+        reports = _report(views.attendee_data, form, request=request)
+        return [_rows(report) for report in reports if report.headings()]
+
+    def _buy(self):
+        ann_1 = self._named_user("ann1", "Ann")
+        ann_2 = self._named_user("ann2", "Ann")
+        bea = self._named_user("bea", "Bea")
+
+        self._paid(ann_1, (self.PROD_1, 1))
+        self._reserved(ann_2, (self.PROD_1, 1))
+        self._paid(bea, (self.PROD_1, 1), (self.PROD_2, 1), (self.PROD_3, 1))
+        self._paid(bea, (self.PROD_4, 1)).refund()
+        # Has no concrete profile, so isn't listed
+        self._paid(self.USER_1, (self.PROD_1, 1))
+
+    def test_grouped_by_product(self):
+        self._buy()
+
+        grouped, attendees = self._attendee_data(
+            forms.GroupByForm.GROUP_BY_PRODUCT,
+        )
+
+        self.assertEqual(
+            [
+                ["Category 1 - Product 1", "Ann", 1, 1],
+                ["Category 1 - Product 1", "Bea", 1, 0],
+                ["Category 1 - Product 2", "Bea", 1, 0],
+                ["Category 2 - Product 3", "Bea", 1, 0],
+            ],
+            grouped,
+        )
+        self.assertEqual(5, len(attendees))
+
+    def test_grouped_by_category(self):
+        self._buy()
+
+        grouped, attendees = self._attendee_data(
+            forms.GroupByForm.GROUP_BY_CATEGORY,
+        )
+
+        self.assertEqual(
+            [
+                ["Category 1", "Ann", 1, 1],
+                ["Category 1", "Bea", 2, 0],
+                ["Category 2", "Bea", 1, 0],
+            ],
+            grouped,
+        )
+
+    def _count_attendee_data_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self._attendee_data(forms.GroupByForm.GROUP_BY_PRODUCT)
+        return len(queries)
+
+    def test_queries_do_not_grow_with_attendees(self):
+        self._buy()
+
+        before = self._count_attendee_data_queries()
+
+        for i in range(10):
+            user = self._named_user("user%d" % i, "Attendee %d" % i)
+            self._paid(user, (self.PROD_1, 1), (self.PROD_3, 1))
+
+        with self.assertNumQueries(before):
+            self._attendee_data(forms.GroupByForm.GROUP_BY_PRODUCT)
+
+
+class CreditNotesReportTestCase(ReportViewTestCase):
+
+    def test_unclaimed_value_is_listed(self):
+        user = self._named_user("ann", "Ann")
+        self._paid(user, (self.PROD_1, 1)).refund()
+        refunded = TestingCreditNoteController(
+            commerce.CreditNote.objects.get(),
+        )
+        refunded.refund()
+        self._paid(user, (self.PROD_4, 1)).refund()
+
+        report, = _report(views.credit_notes, None)
+
+        self.assertEqual(
+            ["id", "Owner", "Status", "Value", "Unclaimed Value"],
+            report.headings(),
+        )
+        self.assertEqual(
+            [
+                ["Refunded with reference: Whoops.", Decimal("10.00"), 0],
+                ["Unclaimed", Decimal("5.00"), Decimal("5.00")],
+            ],
+            [row[2:] for row in sorted(_rows(report))],
+        )
@@ -0,0 +1,188 @@
+import unittest
+
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+
+from registrasion import util
+from registrasion.controllers.write_version import WriteVersionController
+from registrasion.models import conditions
+from registrasion.models import people
+from registrasion.reporting import cube
+from registrasion.reporting import views
+from registrasion.tests.controller_helpers import TestingCartController
+from registrasion.tests.controller_helpers import TestingInvoiceController
+
+from registrasion.tests.test_cart import RegistrationCartTestCase
+
+
+AttendeeProfile = util.get_object_from_name(settings.ATTENDEE_PROFILE_MODEL)
+
+
+class WriteVersionTestCase(RegistrationCartTestCase):
+
+    def test_version_changes_when_cart_changes(self):
+        before = WriteVersionController.current()
+
+        cart = TestingCartController.for_user(self.USER_1)
+        cart.add_to_cart(self.PROD_1, 1)
+
+        self.assertNotEqual(before, WriteVersionController.current())
+
+    def test_version_is_stable_without_writes(self):
+        self.assertEqual(
+            WriteVersionController.current(),
+            WriteVersionController.current(),
+        )
+
+    def test_version_changes_when_profile_changes(self):
+        user = User.objects.create_user(username="profiled")
+        profile = AttendeeProfile(attendee=people.Attendee.get_instance(user))
+        before = WriteVersionController.current()
+
+        profile.save()
+
+        self.assertNotEqual(before, WriteVersionController.current())
+
+    def test_version_changes_when_user_changes(self):
+        before = WriteVersionController.current()
+
+        self.USER_1.email = "changed@example.com"
+        self.USER_1.save()
+
+        self.assertNotEqual(before, WriteVersionController.current())
+
+    def test_version_does_not_change_on_login(self):
+        before = WriteVersionController.current()
+
+        self.USER_1.save(update_fields=["last_login"])
+
+        self.assertEqual(before, WriteVersionController.current())
+
+    def test_version_does_not_change_for_search_terms(self):
+        attendee = people.Attendee.get_instance(self.USER_1)
+        before = WriteVersionController.current()
+
+        people.AttendeeSearchTerm.objects.create(
+            attendee=attendee, term="abc",
+        )
+
+        self.assertEqual(before, WriteVersionController.current())
+
+    def test_process_local_caches_are_not_shared(self):
+        caches = {
+            "django.core.cache.backends.locmem.LocMemCache": False,
+            "django.core.cache.backends.dummy.DummyCache": False,
+            "django.core.cache.backends.filebased.FileBasedCache": True,
+        }
+        shared = WriteVersionController.shared
+        try:
+            for backend, expected in caches.items():
+                with override_settings(CACHES={"default": {
+                    "BACKEND": backend, "LOCATION": "/tmp/registrasion",
+                }}):
+                    WriteVersionController.check_cache()
+                    self.assertEqual(expected, WriteVersionController.shared)
+        finally:
+            WriteVersionController.shared = shared
+
+
+@unittest.skipUnless(cube.numpy, "NumPy is not installed")
+class SalesCubeTestCase(RegistrationCartTestCase):
+
+    def setUp(self):
+        super(SalesCubeTestCase, self).setUp()
+
+        # The tests run in one process, so the cube can be cached.
+        self._shared = WriteVersionController.shared
+        WriteVersionController.shared = True
+
+        self.discount = conditions.IncludedProductDiscount.objects.create(
+            description="PROD_1 includes PROD_2",
+        )
+        self.discount.enabling_products.add(self.PROD_1)
+        conditions.DiscountForProduct.objects.create(
+            discount=self.discount,
+            product=self.PROD_2,
+            percentage=Decimal(100),
+            quantity=1,
+        )
+
+        # USER_1 pays for their cart
+        cart = TestingCartController.for_user(self.USER_1)
+        cart.add_to_cart(self.PROD_1, 1)
+        cart.add_to_cart(self.PROD_2, 2)
+        cart.add_to_cart(self.PROD_4, 1)
+        invoice = TestingInvoiceController.for_cart(self.reget(cart.cart))
+        invoice.pay("Reference", invoice.invoice.value)
+
+        # USER_2 has an active, reserved cart
+        cart = TestingCartController.for_user(self.USER_2)
+        cart.add_to_cart(self.PROD_1, 2)
+        cart.add_to_cart(self.PROD_3, 1)
+
+    def tearDown(self):
+        WriteVersionController.shared = self._shared
+        super(SalesCubeTestCase, self).tearDown()
+
+    def _without_cube(self, f, **kwargs):
+        sales_cube = views.sales_cube
+        views.sales_cube = lambda: None
+        try:
+            return f(**kwargs)
+        finally:
+            views.sales_cube = sales_cube
+
+    def _assert_matches_sql(self, f, **kwargs):
+        self.assertIsNotNone(cube.sales_cube())
+        self.assertEqual(self._without_cube(f, **kwargs), f(**kwargs))
+
+    def test_product_usage_matches_sql(self):
+        usage = lambda **kwargs: list(views.product_usage(**kwargs))
+
+        self._assert_matches_sql(usage)
+        self._assert_matches_sql(usage, products=[self.PROD_1])
+        self._assert_matches_sql(usage, categories=[self.CAT_2])
+
+    def test_discount_usage_matches_sql(self):
+        usage = lambda **kwargs: list(views.discount_usage(**kwargs))
+
+        self._assert_matches_sql(usage)
+        self._assert_matches_sql(usage, discounts=[self.discount])
+
+    def test_items_sold_matches_sql(self):
+        rows = lambda: list(views.items_sold().rows("text/html"))
+
+        self._assert_matches_sql(rows)
+
+    def test_cube_is_cached_until_data_changes(self):
+        first = cube.sales_cube()
+        self.assertIs(first, cube.sales_cube())
+
+        cart = TestingCartController.for_user(self.USER_2)
+        cart.add_to_cart(self.PROD_2, 1)
+
+        self.assertIsNot(first, cube.sales_cube())
+
+    def test_expired_reservations_are_not_counted_as_reserved(self):
+        def reserved(product):
+            totals = cube.sales_cube().product_totals(products=[product.id])
+            return totals[0]["total_reserved"]
+
+        sales_cube = cube.sales_cube()
+        self.assertEqual(2, reserved(self.PROD_1))
+
+        # Past USER_2's reservation, without any writes in between
+        self.add_timedelta(self.RESERVATION * 2)
+
+        self.assertIs(sales_cube, cube.sales_cube())
+        self.assertEqual(0, reserved(self.PROD_1))
+        self._assert_matches_sql(
+            lambda: list(views.product_usage(products=[self.PROD_1])),
+        )
+
+    def test_cube_is_not_used_without_a_shared_cache(self):
+        WriteVersionController.shared = False
+
+        self.assertIsNone(cube.sales_cube())
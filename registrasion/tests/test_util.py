@@ -0,0 +1,29 @@
+import io
+import zipfile
+
+from django.test import TestCase
+
+from registrasion import util
+
+
+class StreamZipTestCase(TestCase):
+
+    def test_entries_are_streamed_one_at_a_time(self):
+        consumed = []
+
+        def entries():
+            for i in range(3):
+                consumed.append(i)
+                yield "file_%d.txt" % i, b"contents %d" % i
+
+        stream = util.stream_zip(entries())
+
+        chunks = [next(stream)]
+        self.assertEqual([0], consumed)
+        chunks.extend(stream)
+
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+        self.assertEqual(
+            ["file_0.txt", "file_1.txt", "file_2.txt"], archive.namelist(),
+        )
+        self.assertEqual(b"contents 2", archive.read("file_2.txt"))
@@ -7,6 +7,7 @@ from .views import (
     amend_registration,
     badge,
     badger,
+    badges,
     checkout,
     credit_note,
     edit_profile,
@@ -26,6 +27,7 @@ from .views import (
 public = [
     url(r"^amend/([0-9]+)$", amend_registration, name="amend_registration"),
     url(r"^badge/([0-9]+)$", badge, name="badge"),
+    url(r"^badges$", badges, name="badges"),
     url(r"^badger/([A-Za-z0-9]+)$", badger, name="badger"),
     url(r"^badger/", badger, name="badger"),
     url(r"^category/([0-9]+)$", product_category, name="product_category"),
@@ -73,6 +75,12 @@ reports = [
     ),
     url(r"^product_status/?$", rv.product_status, name="product_status"),
     url(r"^reconciliation/?$", rv.reconciliation, name="reconciliation"),
+    url(r"^snapshots/?$", rv.report_snapshots, name="report_snapshots"),
+    url(
+        r"^snapshots/([0-9]+)$",
+        rv.report_snapshots,
+        name="report_snapshots",
+    ),
     url(
         r"^speaker_registrations/?$",
         rv.speaker_registrations,
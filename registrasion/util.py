@@ -1,5 +1,6 @@
 import string
 import sys
+import zipfile
 
 from django.utils.crypto import get_random_string
 
@@ -72,3 +73,55 @@ def get_object_from_name(name):
     mod_name, property_name = name[:dot], name[dot + 1:]
     __import__(mod_name)
     return getattr(sys.modules[mod_name], property_name)
+
+
+class _ZipBuffer(object):
+    ''' A write-only file for ZipFile, which hands back whatever has been
+    written to it since it was last drained. '''
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.offset += len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    ''' Produces a ZIP archive piece by piece, suitable for a
+    ``StreamingHttpResponse``.
+
+    Arguments:
+        entries (iterable): ``(name, data)`` pairs, where ``data`` is a
+            ``bytes`` object. These are consumed lazily, so only one entry
+            needs to be held in memory at a time.
+
+        compression (int): The ``zipfile`` compression method to use.
+
+    Yields:
+        bytes: The archive, one entry at a time, followed by its central
+            directory.
+
+    '''
+
+    buf = _ZipBuffer()
+    archive = zipfile.ZipFile(buf, "w", compression)
+
+    for name, data in entries:
+        archive.writestr(name, data)
+        yield buf.drain()
+
+    archive.close()
+    yield buf.drain()
@@ -1,5 +1,4 @@
 import datetime
-import zipfile
 import os
 
 from . import forms
@@ -29,17 +28,17 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.exceptions import ValidationError
 from django.core.mail import send_mass_mail
 from django.http import Http404, HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect
 from django.shortcuts import render
 from django.template import Context, Template, loader
 
-from lxml import etree
-from copy import deepcopy
-
-from registrasion.forms import BadgeForm, ticket_selection
+from registrasion.forms import BadgeForm
 from registrasion.contrib.badger import (
+                                         BadgeTemplate,
                                          collate,
-                                         svg_badge,
+                                         collate_user,
+                                         render_badge,
                                          InvalidTicketChoiceError
                                          )
 
@@ -383,9 +382,8 @@ def _handle_profile(request, prefix):
     attendee = people.Attendee.get_instance(request.user)
 
     try:
-        profile = attendee.attendeeprofilebase
         profile = people.AttendeeProfileBase.objects.get_subclass(
-            pk=profile.id,
+            attendee=attendee,
         )
     except ObjectDoesNotExist:
         profile = None
@@ -1105,27 +1103,28 @@ def badge(request, user_id):
     user_id = int(user_id)
     user = User.objects.get(pk=user_id)
 
-    # This will fail spectacularly -- will put exception handling in later ...
-    user_data = list(collate({'usernames': [user.username]}))[0]
-
-    orig = etree.parse(_get_badge_template_name())
-    tree = deepcopy(orig)
-    root = tree.getroot()
+    user_data = collate_user(user)
+    if user_data is None:
+        raise Http404()
 
-    svg_badge(root, user_data, 0)
+    template = BadgeTemplate.load(_get_badge_template_name())
 
-    response = HttpResponse(etree.tostring(root))
+    response = HttpResponse(render_badge(template, user_data))
     response["Content-Type"] = "image/svg+xml"
     response["Content-Disposition"] = 'inline; filename="badge.svg"'
     return response
 
 
+@user_passes_test(_staff_only)
 def badges(request):
     '''
-    *** NOT USED FOR PYCONAU 2017 MELBOURNE  (I.e., not supported in badger module.) ***
-
     Either displays a form containing a list of users with badges to
-    render, or returns a .zip file containing their badges. '''
+    render, or returns a .zip file containing their badges.
+
+    The badges are collated and rendered one at a time as the archive is
+    sent, so the download starts straight away, no matter how many badges
+    there are. Only attendees who have paid show up in the archive.
+    '''
 
     category = request.GET.getlist("category", [])
     product = request.GET.getlist("product", [])
@@ -1139,16 +1138,13 @@ def badges(request):
     )
 
     if form.is_valid():
-        response = HttpResponse()
-        response["Content-Type"] = "application.zip"
-        response["Content-Disposition"] = 'attachment; filename="badges.zip"'
+        users = User.objects.filter(invoice__in=form.cleaned_data["invoice"])
 
-        z = zipfile.ZipFile(response, "w")
-
-        for invoice in form.cleaned_data["invoice"]:
-            user = invoice.user
-            badge = render_badge(user)
-            z.writestr("badge_%d.svg" % user.id, badge.encode("utf-8"))
+        response = StreamingHttpResponse(
+            util.stream_zip(_render_badges(users)),
+            content_type="application/zip",
+        )
+        response["Content-Disposition"] = 'attachment; filename="badges.zip"'
 
         return response
 
@@ -1159,6 +1155,16 @@ def badges(request):
     return render(request, "registrasion/badges.html", data)
 
 
+def _render_badges(users):
+    ''' Yields a (filename, SVG) pair for the badge of each user in the
+    users queryset. '''
+
+    template = BadgeTemplate.load(_get_badge_template_name())
+
+    for data in collate({'usernames': None, 'users': users}):
+        yield "badge_%d.svg" % data['user_id'], render_badge(template, data)
+
+
 def collate_from_form(form):
     '''
     Does what collate does, but using form data as its input source
@@ -1200,7 +1206,7 @@ def collate_from_form(form):
     # choice isn't found in the ticket list or is the
     # "Plese select a valid tickt" choice.  (I.e., they forgot
     # to choose a ticket.)
-    data['ticket'] = ticket_selection()[int(form.data['ticket'])][1]
+    data['ticket'] = form.ticket_name()
 
     data['volunteer'] = data['ticket'].find("Volunteer") >= 0
 
@@ -1240,8 +1246,10 @@ def badger(request, username=None):
         # We have a username.  Try to populate our badge data
         # from User/Attendee model.
         try:
-            data = collate({'usernames': [username,]}).next()
-        except: # No matching User record (probably) ... just put up a blank form
+            data = collate_user(User.objects.get(username=username))
+        except: # No matching User record (probably) ...
+            data = None
+        if data is None:  # ... just put up a blank form
             return render(request, settings.BADGER_DEFAULT_FORM, {'form': BadgeForm})
     else:
         form = BadgeForm(request.POST)
@@ -1264,15 +1272,13 @@ def badger(request, username=None):
 
     # We should have valid data if we get this far.
     # Fill in the template and return the resulting SVG object.
-    orig = etree.parse(_get_badge_template_name())
-    tree = deepcopy(orig)
-    root = tree.getroot()
+    template = BadgeTemplate.load(_get_badge_template_name())
 
-    # Generate the badge (svg)
-    svg_badge(root, data, 0)
+    # Generate the badge (svg), or fetch it if it's been rendered before
+    svg = render_badge(template, data)
 
     # Ship it back to the user...
-    response = HttpResponse(etree.tostring(root))
+    response = HttpResponse(svg)
 
     response["Content-Type"] = "image/svg+xml"
     response["Content-Disposition"] = 'inline; filename="badge.svg"'